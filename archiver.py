@@ -0,0 +1,119 @@
+import dbm
+import logging
+import os
+import shutil
+import sys
+import time
+from os.path import join, isdir, isfile
+from threading import Thread, Event
+
+from leases import LEASE_FILE_EXT
+
+
+class Archiver(Thread):
+    """Move completed jobs out of the jobs folder, keeping directory operations on it fast.
+
+    A job is completed once its confirmation file exists. It's archived (job file, confirmation and acknowledgement
+    files) as soon as upstream acknowledges it, by creating an empty <job file><ACK_FILE_EXT> file, or once its
+    confirmation is older than `max_age` seconds.
+
+    Archived jobs go to dated sub directories (day of confirmation) of the archive folder. An index (dbm) maps each
+    job file name to its sub directory, see find().
+    """
+
+    ACK_FILE_EXT = '.ack'
+    INDEX_FILE = 'index'
+
+    def __init__(self, jobs_folder, archive_folder, confirm_ext, max_age=86400, interval=300):
+        super().__init__(name='Archiver', daemon=True)
+        self.logger = logging.getLogger('Archiver')
+        self.jobs_folder = jobs_folder
+        self.archive_folder = archive_folder
+        self.confirm_ext = confirm_ext
+        self.max_age = max_age      # Seconds a confirmed job stays in jobs folder when not acknowledged
+        self.interval = interval    # Seconds between jobs folder scans
+        self.stopped = Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.archive()
+            except Exception as ex:
+                self.logger.critical("Failed to archive jobs: {}".format(str(ex)))
+
+    def archive(self):
+        """Archive all completed jobs which are either acknowledged or too old.
+
+        :return: int Number of jobs archived.
+        """
+        oldest = time.time() - self.max_age
+        archived = 0
+
+        with os.scandir(self.jobs_folder) as entries:
+            confirmed = [entry for entry in entries if entry.name.endswith(self.confirm_ext) and entry.is_file()]
+
+        if not confirmed:
+            return 0
+
+        with dbm.open(join(self.archive_folder, Archiver.INDEX_FILE), 'c') as index:
+            for confirm_entry in confirmed:
+                job_file_name = confirm_entry.name[:-len(self.confirm_ext)]
+                ack_file = join(self.jobs_folder, job_file_name + Archiver.ACK_FILE_EXT)
+
+                confirmed_at = confirm_entry.stat().st_mtime
+                if confirmed_at > oldest and not isfile(ack_file):
+                    continue
+
+                day = time.strftime('%Y-%m-%d', time.localtime(confirmed_at))
+                day_folder = join(self.archive_folder, day)
+                if not isdir(day_folder):
+                    os.makedirs(day_folder)
+
+                for file_name in (job_file_name, confirm_entry.name, job_file_name + Archiver.ACK_FILE_EXT,
+                                  job_file_name + LEASE_FILE_EXT):
+                    if isfile(join(self.jobs_folder, file_name)):
+                        shutil.move(join(self.jobs_folder, file_name), join(day_folder, file_name))
+
+                index[job_file_name] = day
+                archived += 1
+
+        if archived:
+            self.logger.info("{} jobs archived to {}".format(archived, self.archive_folder))
+
+        return archived
+
+
+def find(archive_folder, job_file_name):
+    """Locate an archived job.
+
+    :return: str Absolute path of archived job file, or None if it isn't archived.
+    """
+    index_file = join(archive_folder, Archiver.INDEX_FILE)
+
+    try:
+        with dbm.open(index_file, 'r') as index:
+            day = index.get(job_file_name)
+    except dbm.error:
+        return None
+
+    if day is None:
+        return None
+
+    return join(archive_folder, day.decode(), job_file_name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: {} archive_folder job_file_name".format(sys.argv[0]))
+        sys.exit(1)
+
+    job_path = find(sys.argv[1], sys.argv[2])
+    if job_path is None:
+        print("Job not found in archive: {}".format(sys.argv[2]))
+        sys.exit(1)
+
+    print(job_path)
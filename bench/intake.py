@@ -0,0 +1,156 @@
+""" Intake transports throughput benchmark
+
+    Compares the file-per-job intake (job file + watchdog event + open/parse + .confirm file) against the stream
+    transports (Unix socket, JSON lines spool), using Ninja's own intake classes and a consumer which parses each job
+    and confirms it the same way Ninja does.
+
+    Usage: python -m bench.intake [-n JOBS]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from collections import deque
+from os.path import join
+from queue import Queue
+from threading import Condition, Thread
+
+from watchdog.observers import Observer
+
+from ninja import Ninja
+from transports import SocketIntake, SpoolIntake
+from utils import atomic_write
+
+JOB = {"operation": "transfer_bank", "account": "12345", "account_digit": "6", "account_type": "CH",
+       "amount": "10,00", "bank_id": "341", "branch": "0001", "cpf": "00000000000", "day": "01",
+       "fullname": "FULANO DE TAL", "month": "01", "send_receipt": "0", "year": "2020"}
+
+
+def _confirm(job, job_data):
+    job_data['status'] = 'ok'
+    data = json.dumps(job_data, separators=(',', ':'))
+
+    if job.channel is not None:
+        job.channel.send(job, data)
+    else:
+        atomic_write(data, job.path + Ninja.CONFIRM_FILE_EXT)
+
+
+def bench_files(jobs_count, work_dir):
+    jobs_folder = join(work_dir, 'jobs')
+    os.mkdir(jobs_folder)
+
+    job_queue, job_mutex = deque(), Condition()
+    observer = Observer()
+    observer.schedule(Ninja.TaskManager(job_queue=job_queue, job_mutex=job_mutex), jobs_folder, recursive=False)
+    observer.start()
+
+    def consume():
+        for _ in range(jobs_count):
+            with job_mutex:
+                while not job_queue:
+                    job_mutex.wait()
+                job = job_queue.popleft()
+
+            with open(job.path) as job_fp:
+                _confirm(job, json.load(job_fp))
+
+    consumer = Thread(target=consume)
+    consumer.start()
+
+    started = time.time()
+    for n in range(jobs_count):
+        atomic_write(json.dumps(dict(JOB, id=n)), join(jobs_folder, 'job-{}.json'.format(n)))
+    consumer.join()
+    elapsed = time.time() - started
+
+    observer.stop()
+    observer.join()
+
+    return elapsed
+
+
+def _consume_stream(jobs_queue, jobs_count):
+    for _ in range(jobs_count):
+        job = jobs_queue.get()
+        _confirm(job, json.loads(job.raw))
+
+
+def bench_socket(jobs_count, work_dir):
+    jobs_queue = Queue()
+    intake = SocketIntake(join(work_dir, 'ninja.sock'), jobs_queue.put)
+    intake.start()
+
+    consumer = Thread(target=_consume_stream, args=(jobs_queue, jobs_count))
+    consumer.start()
+
+    started = time.time()
+
+    producer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    producer.connect(join(work_dir, 'ninja.sock'))
+
+    def send():
+        for n in range(jobs_count):
+            producer.sendall(json.dumps(dict(JOB, id=n)).encode() + b'\n')
+
+    sender = Thread(target=send)
+    sender.start()
+
+    with producer.makefile('rb') as replies:
+        for _ in range(jobs_count):
+            replies.readline()
+
+    elapsed = time.time() - started
+
+    sender.join()
+    consumer.join()
+    producer.close()
+    intake.stop()
+    intake.close()
+
+    return elapsed
+
+
+def bench_spool(jobs_count, work_dir):
+    spool_path = join(work_dir, 'spool.jsonl')
+    jobs_queue = Queue()
+    intake = SpoolIntake(spool_path, Ninja.CONFIRM_FILE_EXT, jobs_queue.put, interval=0.01)
+    intake.start()
+
+    consumer = Thread(target=_consume_stream, args=(jobs_queue, jobs_count))
+    consumer.start()
+
+    started = time.time()
+    with open(spool_path, 'a') as spool:
+        for n in range(jobs_count):
+            spool.write(json.dumps(dict(JOB, id=n)) + '\n')
+            spool.flush()
+    consumer.join()
+    elapsed = time.time() - started
+
+    intake.stop()
+    intake.close()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intake transports throughput benchmark")
+    parser.add_argument('-n', '--jobs', type=int, default=10000, help="Jobs per transport")
+    args = parser.parse_args()
+
+    for name, bench in (('file', bench_files), ('socket', bench_socket), ('spool', bench_spool)):
+        work_dir = tempfile.mkdtemp(prefix='ninja-bench-')
+        try:
+            elapsed = bench(args.jobs, work_dir)
+        finally:
+            shutil.rmtree(work_dir)
+
+        print("{:<8} {:>8} jobs  {:>8.2f}s  {:>10.0f} jobs/s".format(name, args.jobs, elapsed, args.jobs / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+""" Job leases: exactly-once and throughput scaling check
+
+    Runs several local node processes sharing one jobs folder, each one made of Ninja's own watchdog handler
+    (TaskManager) and LeaseManager, and a fake job execution taking --work seconds. Every executed job is recorded, the
+    run fails if any job was run twice or never.
+
+    Nodes acquire jobs the way Ninja's intake does (LeaseManager.acquire(): claim, or adopt jobs restored from the
+    node's own persisted queue). With --crash, the first node dies right after acquiring its 10th job:
+        claim      its lease must be broken by another node's reaper (after --ttl seconds), job run exactly once anyway
+        operation  it dies in the job's 'operation' stage: the job must be confirmed as interrupted, never run again
+        restart    it's restarted right away with the job in its restored queue: it must adopt the job back, and the
+                   job run exactly once
+
+    Usage: python -m bench.leases [-n JOBS] [--nodes 1,2,4] [--work SECONDS] [--crash claim|operation|restart]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from os.path import join
+from threading import Condition, Lock
+
+from watchdog.observers import Observer
+
+from job import Job
+from leases import LeaseManager
+from ninja import Ninja
+from utils import atomic_write
+
+CRASH_AFTER = 10
+
+
+def node(node_id, jobs_folder, results_path, work, ttl, crash, restored, ready, stop):
+    job_queue, job_mutex = deque(), Condition()
+    results_mutex = Lock()
+
+    def record(line):
+        with results_mutex, open(results_path, 'a') as results:
+            results.write(line + '\n')
+
+    def reclaim(job_name, stage):
+        # As Ninja._reclaim_job() does
+        if stage != 'operation':
+            with job_mutex:
+                job_queue.append(Job(job_name, join(jobs_folder, job_name)))
+                job_mutex.notify()
+        elif leases.claim(job_name):
+            record('interrupted ' + job_name)
+            leases.release(job_name)
+
+    leases = LeaseManager(jobs_folder, node_id, reclaim, ttl=ttl, heartbeat=ttl / 4)
+    leases.start()
+
+    job_queue.extend(Job(job_name, join(jobs_folder, job_name)) for job_name in restored)
+
+    observer = Observer()
+    observer.schedule(Ninja.TaskManager(job_queue=job_queue, job_mutex=job_mutex), jobs_folder, recursive=False)
+    observer.start()
+    ready.set()
+
+    acquired = 0
+    while not stop.is_set():
+        with job_mutex:
+            if not job_queue:
+                job_mutex.wait(0.1)
+                continue
+            job = job_queue.popleft()
+
+        if not leases.acquire(job.name, restored=job.name in restored):
+            continue
+
+        acquired += 1
+        if crash and acquired == CRASH_AFTER:
+            if crash == 'operation':
+                leases.mark(job.name, 'operation')
+            elif crash == 'restart':
+                atomic_write(json.dumps([job.name]), results_path + '.restored')
+            os._exit(1)
+
+        time.sleep(work)
+        record('run ' + job.name)
+        leases.release(job.name)
+
+    observer.stop()
+    observer.join()
+    leases.stop()
+
+
+def _start_node(node_id, jobs_folder, results_path, work, ttl, crash, restored, stop):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=node, args=(node_id, jobs_folder, results_path, work, ttl, crash,
+                                                         restored, ready, stop))
+    process.start()
+    ready.wait()
+    return process
+
+
+def run(nodes_count, jobs_count, work, ttl, crash):
+    work_dir = tempfile.mkdtemp(prefix='ninja-bench-')
+    jobs_folder = join(work_dir, 'jobs')
+    os.mkdir(jobs_folder)
+
+    stop = multiprocessing.Event()
+    nodes = []
+    for n in range(nodes_count):
+        nodes.append(_start_node('node-{}'.format(n), jobs_folder, join(work_dir, 'results-{}'.format(n)), work, ttl,
+                                 crash if n == 0 else None, [], stop))
+
+    started = time.time()
+    for n in range(jobs_count):
+        atomic_write(json.dumps({"operation": "transfer_bank", "id": n}), join(jobs_folder, 'job-{}.json'.format(n)))
+
+    executed, interrupted = Counter(), Counter()
+    restarted = False
+    deadline = started + jobs_count * work + ttl * 3 + 30
+    while time.time() < deadline:
+        # First node comes back with the job it had acquired in its restored queue
+        restored_path = join(work_dir, 'results-0.restored')
+        if crash == 'restart' and not restarted and not nodes[0].is_alive() and os.path.isfile(restored_path):
+            with open(restored_path) as restored_file:
+                restored = json.load(restored_file)
+            nodes.append(_start_node('node-0', jobs_folder, join(work_dir, 'results-0'), work, ttl, None, restored,
+                                     stop))
+            restarted = True
+
+        executed, interrupted = Counter(), Counter()
+        for n in range(nodes_count):
+            results_path = join(work_dir, 'results-{}'.format(n))
+            if os.path.isfile(results_path):
+                with open(results_path) as results:
+                    for line in results:
+                        if line.endswith('\n'):
+                            outcome, job_name = line.split()
+                            (executed if outcome == 'run' else interrupted)[job_name] += 1
+
+        if len(executed) + len(interrupted) >= jobs_count:
+            break
+        time.sleep(0.05)
+
+    elapsed = time.time() - started
+
+    stop.set()
+    for process in nodes:
+        process.join()
+    shutil.rmtree(work_dir)
+
+    duplicated = sorted(name for name, count in (executed + interrupted).items() if count > 1)
+    duplicated += sorted(name for name in interrupted if name in executed)
+    missing = jobs_count - len(set(executed) | set(interrupted))
+
+    # Only the job the first node died in the operation stage of may be (must be) interrupted
+    unexpected = len(interrupted) != (1 if crash == 'operation' else 0)
+
+    return elapsed, duplicated, missing, len(interrupted), unexpected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job leases exactly-once and throughput scaling check")
+    parser.add_argument('-n', '--jobs', type=int, default=400, help="Jobs per run")
+    parser.add_argument('--nodes', default='1,2,4', help="Comma separated node counts, one run each")
+    parser.add_argument('--work', type=float, default=0.02, help="Seconds each job takes")
+    parser.add_argument('--ttl', type=float, default=2, help="Lease TTL, in seconds")
+    parser.add_argument('--crash', choices=('claim', 'operation', 'restart'),
+                        help="First node dies holding a lease (see module doc)")
+    args = parser.parse_args()
+
+    failed = False
+    for nodes_count in (int(n) for n in args.nodes.split(',')):
+        if args.crash and nodes_count < 2:
+            print("{:>2} nodes  skipped, --crash needs another node to reclaim the lease".format(nodes_count))
+            continue
+
+        elapsed, duplicated, missing, interrupted, unexpected = run(nodes_count, args.jobs, args.work, args.ttl,
+                                                                    args.crash)
+        failed = failed or duplicated or missing or unexpected
+
+        print("{:>2} nodes  {:>6} jobs  {:>7.2f}s  {:>8.1f} jobs/s  duplicated={} missing={} interrupted={}".format(
+            nodes_count, args.jobs, elapsed, args.jobs / elapsed, len(duplicated), missing, interrupted))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
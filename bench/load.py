@@ -0,0 +1,256 @@
+""" Full pipeline load test
+
+    Runs a real Ninja, in its own process and app dir, with the stub module (stub/task_handler.py) and drops job files
+    into its jobs folder at a target rate. Jobs go through the whole pipeline: TaskManager (watchdog), intake
+    (_validate_job), dispatcher, the stub's operation, confirm_job() and the confirmation stage (FileSink's
+    atomic_write), followed by a timings sink (sinks.TimingsSink) recording when each job went through each stage.
+
+    Reports, for every jobs count, stage latency percentiles and sustained jobs/s:
+        intake         job queued by the watchdog -> validated
+        queue wait     validated -> handed to the module
+        run            handed to the module -> confirmed (stub latency)
+        confirm write  confirmed -> confirmation written
+        end-to-end     job file dropped -> confirmation written
+
+    A report saved with --save can be used as --baseline of a later run, which then fails if sustained jobs/s dropped,
+    or any stage's p95 latency grew, by more than --threshold.
+
+    Usage: python -m bench.load [-n 10000 100000] [--rate JOBS_PER_SECOND] [--latency SECONDS] [--error-rate RATE]
+                                [--slots N] [--save REPORT] [--baseline REPORT] [--threshold FRACTION]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import dirname, abspath, join, isfile
+
+from utils import atomic_write
+
+APP_ROOT = dirname(dirname(abspath(__file__)))
+
+JOB = {"operation": "transfer_bank", "account": "12345", "account_digit": "6", "account_type": "CH",
+       "amount": "10,00", "bank_id": "341", "branch": "0001", "cpf": "00000000000", "day": "01",
+       "fullname": "FULANO DE TAL", "month": "01", "send_receipt": "0", "year": "2020"}
+
+STAGES = (('intake', 'queued', 'ready'),
+          ('queue wait', 'ready', 'started'),
+          ('run', 'started', 'confirmed'),
+          ('confirm write', 'confirmed', 'written'),
+          ('end-to-end', 'dropped', 'written'))
+
+# p95 latencies below this many seconds aren't compared against the baseline (they're mostly noise)
+LATENCY_FLOOR = 0.005
+
+
+def _ninja(app_dir):
+    # Ninja runs from the folder of its script, a config.json of our own and the stub module live there
+    sys.argv[0] = join(app_dir, 'ninja.py')
+    sys.path.insert(0, APP_ROOT)
+
+    from ninja import Ninja
+    Ninja().run()
+
+
+def _setup(work_dir, args):
+    os.symlink(join(APP_ROOT, 'stub'), join(work_dir, 'stub'))
+    os.mkdir(join(work_dir, 'profile'))
+    os.mkdir(join(work_dir, 'jobs'))
+
+    config = {
+        'module': 'stub',
+        'jobs_folder': join(work_dir, 'jobs'),
+        'firefox_binary': sys.executable,
+        'firefox_profile': join(work_dir, 'profile'),
+        'firefox_port': 0,
+        'log_level': args.log_level,
+        'confirm_sinks': [{'type': 'file'}, {'type': 'timings', 'path': join(work_dir, 'timings.jsonl')}],
+        'archive_interval': 0,
+        'retry_base_delay': 1,
+        'retry_max_delay': 1,
+        'stub_latency': args.latency,
+        'stub_latency_jitter': args.latency / 2,
+        'stub_error_rate': args.error_rate,
+        'stub_retry_rate': args.retry_rate,
+        'stub_slots': args.slots,
+        'stub_seed': 0
+    }
+
+    with open(join(work_dir, 'config.json'), 'w') as config_file:
+        json.dump(config, config_file, indent=2)
+
+
+def _warm_up(jobs_folder, timings_path, timeout=60):
+    """Wait for Ninja to confirm a first job (jobs dropped before its watchdog is started are never seen).
+
+    :return: Offset of timings_path past the first job's timings, None if Ninja didn't confirm it in time.
+    """
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        atomic_write(json.dumps(JOB), join(jobs_folder, 'warm-up-{}.json'.format(int(time.time() * 2))))
+
+        if isfile(timings_path):
+            with open(timings_path, 'rb') as timings_file:
+                line = timings_file.readline()
+                if line.endswith(b'\n'):
+                    return timings_file.tell()
+        time.sleep(0.5)
+
+    return None
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(jobs_count, args):
+    work_dir = tempfile.mkdtemp(prefix='ninja-load-')
+    jobs_folder = join(work_dir, 'jobs')
+    timings_path = join(work_dir, 'timings.jsonl')
+
+    _setup(work_dir, args)
+    ninja = multiprocessing.Process(target=_ninja, args=(work_dir,), name='Ninja')
+    ninja.start()
+
+    try:
+        offset = _warm_up(jobs_folder, timings_path)
+        if offset is None:
+            raise RuntimeError("Ninja didn't start, see {}".format(join(work_dir, 'log', 'ninja.log')))
+
+        # 1. Drop job files at the target rate
+        dropped = []
+        started = time.time()
+        for n in range(jobs_count):
+            if args.rate:
+                delay = started + n / args.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            dropped.append(time.time())
+            atomic_write(json.dumps(dict(JOB, id=n)), join(jobs_folder, 'job-{}.json'.format(n)))
+
+        # 2. Collect timings until every job is confirmed, or confirmations stall
+        timings = {}
+        progress_at = time.time()
+        partial = b''
+        with open(timings_path, 'rb') as timings_file:
+            timings_file.seek(offset)
+            while len(timings) < jobs_count and time.time() - progress_at < args.stall:
+                line = partial + timings_file.readline()
+                if not line.endswith(b'\n'):
+                    partial = line
+                    time.sleep(0.05)
+                    continue
+
+                partial = b''
+                record = json.loads(line)
+                if not record['job'].startswith('job-'):
+                    continue
+
+                record['dropped'] = dropped[int(record['job'][len('job-'):-len('.json')])]
+                timings[record['job']] = record
+                progress_at = time.time()
+    finally:
+        ninja.terminate()
+        ninja.join()
+        shutil.rmtree(work_dir)
+
+    # 3. Report
+    records = list(timings.values())
+    report = {
+        'jobs': jobs_count,
+        'completed': len(records),
+        'target_rate': args.rate,
+        'jobs_per_second': 0.0,
+        'stages': {}
+    }
+
+    if records:
+        elapsed = max(record['written'] for record in records) - dropped[0]
+        report['jobs_per_second'] = round(len(records) / elapsed, 1)
+
+    for stage, start, end in STAGES:
+        latencies = sorted(record[end] - record[start] for record in records
+                           if record[start] is not None and record[end] is not None)
+        if latencies:
+            report['stages'][stage] = {'p50': _percentile(latencies, 0.5), 'p95': _percentile(latencies, 0.95),
+                                       'p99': _percentile(latencies, 0.99), 'max': latencies[-1]}
+
+    return report
+
+
+def _print(report):
+    print("{} jobs ({} completed), target {} jobs/s: {} jobs/s sustained".format(
+        report['jobs'], report['completed'], report['target_rate'] or 'max', report['jobs_per_second']))
+    print("  {:<14} {:>9} {:>9} {:>9} {:>9}".format('ms', 'p50', 'p95', 'p99', 'max'))
+
+    for stage, _, _ in STAGES:
+        if stage in report['stages']:
+            print("  {:<14} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                stage, *(report['stages'][stage][p] * 1000 for p in ('p50', 'p95', 'p99', 'max'))))
+
+
+def _regressions(report, baseline, threshold):
+    regressions = []
+
+    if report['completed'] < report['jobs']:
+        regressions.append("{} jobs never confirmed".format(report['jobs'] - report['completed']))
+
+    if report['jobs_per_second'] < baseline['jobs_per_second'] * (1 - threshold):
+        regressions.append("jobs/s {} < baseline {}".format(report['jobs_per_second'], baseline['jobs_per_second']))
+
+    for stage, latencies in baseline['stages'].items():
+        p95 = report['stages'].get(stage, {}).get('p95', 0)
+        if p95 > LATENCY_FLOOR and p95 > latencies['p95'] * (1 + threshold):
+            regressions.append("{} p95 {:.2f}ms > baseline {:.2f}ms".format(stage, p95 * 1000,
+                                                                           latencies['p95'] * 1000))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full pipeline load test, with the stub module")
+    parser.add_argument('-n', '--jobs', type=int, nargs='+', default=[10000], help="Jobs counts, one run each")
+    parser.add_argument('--rate', type=float, default=1000, help="Job files dropped per second, 0 for no limit")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds each job takes")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of jobs failing")
+    parser.add_argument('--retry-rate', type=float, default=0, help="Fraction of jobs retried")
+    parser.add_argument('--slots', type=int, default=1, help="Jobs run at once")
+    parser.add_argument('--log-level', default='INFO', help="Ninja log level")
+    parser.add_argument('--stall', type=float, default=30, help="Seconds without confirmations before giving up")
+    parser.add_argument('--save', help="Save report to this file")
+    parser.add_argument('--baseline', help="Fail on regressions against this report")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Regression tolerance, as a fraction")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    reports = {}
+    failed = False
+    for jobs_count in args.jobs:
+        report = reports[str(jobs_count)] = run(jobs_count, args)
+        _print(report)
+
+        if report['completed'] < jobs_count:
+            failed = True
+
+        if str(jobs_count) in baseline:
+            for regression in _regressions(report, baseline[str(jobs_count)], args.threshold):
+                print("  REGRESSION: {}".format(regression))
+                failed = True
+
+    if args.save:
+        atomic_write(json.dumps(reports, indent=2), args.save)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+""" Queued jobs memory benchmark
+
+    Memory taken by a backlog of validated jobs waiting in the execution queue, each run in a fresh process (peak RSS
+    growth, Linux):
+        dict      Job records as they used to be: an instance __dict__, full path string and decoded data kept
+        slots     compact Job records (__slots__, shared jobs folder), decoded data kept (head of the queue)
+        unloaded  compact Job records whose data was dropped (queued behind config: ready_data_limit)
+
+    Unloaded jobs are loaded back from their job file when they're due, the cost of that is reported as well.
+
+    Usage: python -m bench.memory [-n 100000 1000000] [--modes dict,slots,unloaded]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import deque
+from os.path import join
+
+from job import Job
+from utils import atomic_write
+
+JOB = {"operation": "transfer_bank", "account": "12345", "account_digit": "6", "account_type": "CH",
+       "amount": "10,00", "bank_id": "341", "branch": "0001", "cpf": "00000000000", "day": "01",
+       "fullname": "FULANO DE TAL", "month": "01", "send_receipt": "0", "year": "2020"}
+
+JOBS_FOLDER = '/var/lib/ninja/jobs'
+
+# Jobs loaded back from their job file, to time it
+RELOADED_JOBS = 1000
+
+
+class DictJob:
+    """Job record before __slots__: what each queued job used to cost."""
+
+    def __init__(self, name, path=None, raw=None, channel=None):
+        self.name = name
+        self.path = path
+        self.raw = raw
+        self.channel = channel
+        self.data = None
+        self.queued_at = time.time()
+        self.ready_at = None
+        self.started_at = None
+        self.confirmed_at = None
+
+
+def _rss():
+    """Peak resident set size, in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _fill(mode, jobs_count, results):
+    job_class = DictJob if mode == 'dict' else Job
+    queue = deque()
+
+    rss = _rss()
+    started = time.time()
+
+    for n in range(jobs_count):
+        name = 'job-{}.json'.format(n)
+        job = job_class(name, join(JOBS_FOLDER, name))
+        payload = json.dumps(dict(JOB, id=n)).encode()
+        job.data = json.loads(payload)
+        if job_class is Job:
+            job.digest = Job._digest(payload)   # As Job.load() does
+        job.ready_at = time.time()
+
+        if mode == 'unloaded':
+            job.unload()
+        queue.append(job)
+
+    results.put((_rss() - rss, time.time() - started))
+
+
+def _reload_time(work_dir):
+    """Seconds it takes to load an unloaded job back from its job file."""
+    jobs = []
+    for n in range(RELOADED_JOBS):
+        path = join(work_dir, 'job-{}.json'.format(n))
+        atomic_write(json.dumps(dict(JOB, id=n)), path)
+
+        job = Job(os.path.basename(path), path)
+        job.data = job.load()
+        job.unload()
+        jobs.append(job)
+
+    started = time.time()
+    for job in jobs:
+        job.data
+    return (time.time() - started) / len(jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queued jobs memory benchmark")
+    parser.add_argument('-n', '--jobs', type=int, nargs='+', default=[100000, 1000000], help="Queued jobs counts")
+    parser.add_argument('--modes', default='dict,slots,unloaded', help="Comma separated job record modes")
+    args = parser.parse_args()
+
+    for jobs_count in args.jobs:
+        for mode in args.modes.split(','):
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_fill, args=(mode, jobs_count, results))
+            process.start()
+            memory, elapsed = results.get()
+            process.join()
+
+            print("{:>8} jobs  {:<9} {:>9.1f} MB  {:>6.0f} bytes/job  {:>6.2f}s".format(
+                jobs_count, mode, memory / 2 ** 20, memory / jobs_count, elapsed))
+
+    work_dir = tempfile.mkdtemp(prefix='ninja-bench-')
+    try:
+        print("Loading an unloaded job back: {:.1f}us".format(_reload_time(work_dir) * 10 ** 6))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+""" ITAU beneficiary (favorecido) registration
+
+    When an operation can't locate its customer (OP_CUSTOMER_NOT_FOUND), this module registers it using the
+    current logged in session, so the operation can be resumed right away (config: auto_register_customer, off by
+    default).
+
+    The registration form locators (see locators, "Beneficiary registration") weren't checked against the live page
+    yet: check them before enabling it.
+"""
+import logging
+
+import time
+from selenium.common.exceptions import TimeoutException
+
+from itau import operation_codes, navigation, locators
+
+logger = logging.getLogger(__name__)
+
+# Account types as expected by the registration form
+ACCOUNT_TYPES = {
+    'CH': 'CC',   # Checking account
+    'SV': 'PP'    # Savings account
+}
+
+
+def _fill_input(driver, locator_name, value):
+    element = locators.find(driver, locator_name, timeout=8)
+    element.click()
+    element.clear()
+    element.send_keys(value)
+
+
+def _open_form(driver):
+    navigation.switch_to_frame(driver, 'CORPO')
+
+    try:
+        register_link = locators.find(driver, 'beneficiary_register', timeout=8)
+        register_link.click()
+    except TimeoutException:
+        logger.critical("Unable to locate register link: {}".format(locators.describe('beneficiary_register')))
+        return False
+
+    time.sleep(2)
+    navigation.switch_to_frame(driver, 'CORPO')
+
+    return True
+
+
+def _submit_form(driver):
+    try:
+        submit_btn = locators.find(driver, 'include_submit', condition='present', timeout=0)
+        submit_btn.click()
+    except TimeoutException:
+        logger.critical("Unable to locate submit button: {}".format(locators.describe('include_submit')))
+        return operation_codes.OP_CUSTOMER_REGISTER_FAILED
+
+    time.sleep(3)
+
+    logger.info("Customer submitted, checking if registration was approved...")
+    try:
+        locators.find(driver, 'success_message', condition='visible', timeout=8, floor=True)
+    except TimeoutException:
+        logger.critical("Unable to find registration approval status!")
+        return operation_codes.OP_CUSTOMER_REGISTER_FAILED
+
+    logger.info("Customer successfully registered!")
+
+    return operation_codes.OP_SUCCESS
+
+
+def register_tef(driver, job_data):
+    """Register an ITAU checking account customer, nicknamed after its branch+account (see tef_ch)."""
+    account_nick = (job_data['branch'] + job_data['account']).strip()
+
+    logger.info("Registering ITAU customer: Nick({}) Name({})".format(account_nick, job_data['fullname']))
+
+    if not _open_form(driver):
+        return operation_codes.OP_CUSTOMER_REGISTER_FAILED
+
+    try:
+        _fill_input(driver, 'beneficiary_branch', job_data['branch'])
+        _fill_input(driver, 'beneficiary_account', job_data['account'])
+        _fill_input(driver, 'beneficiary_digit', job_data['account_digit'])
+        _fill_input(driver, 'beneficiary_nick', account_nick)
+    except TimeoutException as ex:
+        logger.critical('Timeout when filling in form: {}'.format(str(ex)))
+        return operation_codes.OP_TIMEOUT
+
+    return _submit_form(driver)
+
+
+def register_ted(driver, job_data):
+    """Register another bank's customer, located afterwards by its full name (see ted_doc)."""
+    logger.info("Registering customer: Bank({}) Name({})".format(job_data['bank_id'], job_data['fullname']))
+
+    if not _open_form(driver):
+        return operation_codes.OP_CUSTOMER_REGISTER_FAILED
+
+    try:
+        _fill_input(driver, 'beneficiary_name', job_data['fullname'][:30].strip())
+        _fill_input(driver, 'beneficiary_cpf', job_data['cpf'])
+        _fill_input(driver, 'beneficiary_bank', job_data['bank_id'])
+        _fill_input(driver, 'beneficiary_branch', job_data['branch'])
+        _fill_input(driver, 'beneficiary_account', job_data['account'])
+        _fill_input(driver, 'beneficiary_digit', job_data['account_digit'])
+    except TimeoutException as ex:
+        logger.critical('Timeout when filling in form: {}'.format(str(ex)))
+        return operation_codes.OP_TIMEOUT
+
+    account_type = ACCOUNT_TYPES[job_data['account_type']]
+    try:
+        locators.find(driver, 'beneficiary_account_type', account_type, condition='present', timeout=0).click()
+    except TimeoutException:
+        logger.critical("Unable to select account type: {}".format(
+            locators.describe('beneficiary_account_type', account_type)))
+        return operation_codes.OP_CUSTOMER_REGISTER_FAILED
+
+    return _submit_form(driver)
@@ -1,4 +1,5 @@
 
 REQUIRED_FIELDS_BY_COMMAND = {
-    "transfer_bank": "account account_digit account_type amount bank_id branch cpf day fullname month send_receipt year".split()
+    "transfer_bank": "account account_digit account_type amount bank_id branch cpf day fullname month send_receipt year".split(),
+    "transfer_batch": "transfers".split()
 }
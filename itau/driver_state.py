@@ -0,0 +1,174 @@
+""" Web driver state tracker
+
+    Keeps track of the window/frame a web driver is in and of the elements it has located, so redundant frame switches
+    become no-ops and elements are reused while they're still attached to the page. Every WebDriver command goes
+    through DriverState.execute(), which counts commands and drops cached state whenever the page may have changed.
+
+    Scripts don't count as navigation: Selenium sends its own atoms (is_displayed(), get_attribute()) as scripts under
+    W3C. Scripts which do load a new page must be run through execute_navigation_script().
+"""
+import logging
+
+from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException, WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+logger = logging.getLogger(__name__)
+
+# Commands which load a new page: any cached state is gone.
+NAVIGATION_COMMANDS = {Command.GET, Command.REFRESH, Command.GO_BACK, Command.GO_FORWARD}
+
+# Commands which may load a new page as a side effect: current frame must be verified before being trusted.
+INTERACTION_COMMANDS = {Command.CLICK_ELEMENT, Command.SUBMIT_ELEMENT, Command.W3C_ACTIONS, Command.CLICK,
+                        Command.DOUBLE_CLICK}
+
+
+def execute_navigation_script(driver, script, *args):
+    """Run a script which loads a new page (e.g. Itau's passaParam()), dropping driver's cached state."""
+    result = driver.execute_script(script, *args)
+
+    state = getattr(driver, 'state', None)
+    if state is not None:
+        state.invalidate()
+
+    return result
+
+
+def _attached(element):
+    # Any command on a stale element raises StaleElementReferenceException
+    element.is_enabled()
+    return True
+
+
+# Element conditions, checked on an element found (also used by locators)
+CONDITIONS = {
+    'present': lambda element: True,
+    'visible': lambda element: element.is_displayed(),
+    'clickable': lambda element: element.is_displayed() and element.is_enabled()
+}
+
+# How to wait for an element fulfilling each condition
+WAIT_CONDITIONS = {
+    'present': EC.presence_of_element_located,
+    'visible': EC.visibility_of_element_located,
+    'clickable': EC.element_to_be_clickable
+}
+
+# Commands spent by a frame switch: default_content + find frame + switch to it
+FRAME_SWITCH_COMMANDS = 3
+
+
+class DriverState:
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.frame = ''             # Name of current frame, '' for top level document, None when unknown
+        self.frame_verified = True  # False after interactions which may have replaced the current frame
+        self.window = None          # Current window handle, None for the initial one
+        self.elements = {}          # (window, frame, condition, locator) -> (element, commands spent locating it)
+        self.commands = 0           # WebDriver commands sent
+        self.avoided = 0            # WebDriver commands avoided by cached state
+        self.internal = False       # Set while the tracker itself sends commands which don't change the page
+
+        # Hook every command sent by the driver and by its elements (WebElement commands go through driver.execute)
+        self._execute = driver.execute
+        driver.execute = self.execute
+
+    def execute(self, driver_command, params=None):
+        self.commands += 1
+
+        if self.internal:
+            pass
+        elif driver_command in NAVIGATION_COMMANDS:
+            # A new top level document means we're back to the top level context
+            self.invalidate(frame='' if driver_command == Command.GET else None)
+        elif driver_command in INTERACTION_COMMANDS:
+            self.frame_verified = False
+        elif driver_command == Command.SWITCH_TO_FRAME:
+            self.frame = '' if (params or {}).get('id') is None else None
+        elif driver_command == Command.SWITCH_TO_PARENT_FRAME:
+            self.frame = None
+        elif driver_command == Command.SWITCH_TO_WINDOW:
+            self.window = (params or {}).get('handle', (params or {}).get('name'))
+            self.frame = ''
+
+        return self._execute(driver_command, params)
+
+    def invalidate(self, frame=None):
+        self.frame = frame
+        self.frame_verified = True
+        self.elements.clear()
+
+    def reset_stats(self):
+        self.commands = 0
+        self.avoided = 0
+
+    def in_frame(self, frame_name):
+        """Tell whether driver is already inside the given frame, so switching to it can be skipped."""
+        if self.frame != frame_name:
+            return False
+
+        if not self.frame_verified:
+            # One command instead of a full frame switch: a frame's window name is the frame name.
+            self.internal = True
+            try:
+                self.frame_verified = self.driver.execute_script("return window.name;") == frame_name
+            except WebDriverException:
+                # Frame's browsing context was discarded (NoSuchWindow/NoSuchFrame): caller switches from scratch
+                self.frame_verified = False
+            finally:
+                self.internal = False
+
+            if not self.frame_verified:
+                self.frame = None
+                return False
+
+            self.avoided += FRAME_SWITCH_COMMANDS - 1
+            return True
+
+        self.avoided += FRAME_SWITCH_COMMANDS
+        return True
+
+    def entered_frame(self, frame_name):
+        self.frame = frame_name
+        self.frame_verified = True
+
+    def find(self, locator, condition='clickable', timeout=None, wait=None, method=None):
+        """Locate an element, reusing the one located before in this window/frame while it's not stale.
+
+        :param locator: (By, value) tuple, or any hashable key identifying the element when `method` is given.
+        :param condition: 'present', 'visible' or 'clickable'.
+        :param timeout: Seconds to wait for the element (or use `wait`, a WebDriverWait).
+        :param method: Callable(driver) returning the element or False, used instead of waiting for `locator`.
+        :raise TimeoutException: Element wasn't found (fulfilling condition) in time.
+        """
+        # Cached elements must still be attached to the page, whatever the condition
+        check = _attached if condition == 'present' else CONDITIONS[condition]
+        key = (self.window, self.frame, condition, locator)
+
+        cached = self.elements.get(key)
+        if cached is not None:
+            element, cost = cached
+            commands = self.commands
+
+            try:
+                if check(element):
+                    self.avoided += max(0, cost - (self.commands - commands))
+                    return element
+            except (StaleElementReferenceException, NoSuchElementException):
+                pass
+
+            del self.elements[key]
+
+        if wait is None:
+            wait = WebDriverWait(self.driver, timeout)
+
+        commands = self.commands
+        element = wait.until(method or WAIT_CONDITIONS[condition](locator))
+
+        # Elements located while current frame is unknown can't be told apart from other frames' ones
+        if self.frame is not None:
+            self.elements[key] = (element, self.commands - commands)
+
+        return element
@@ -0,0 +1,293 @@
+""" ITAU UI element locators
+
+    Every element Ninja interacts with is declared once in LOCATORS, as an ordered list of strategies (ID, then CSS,
+    then link text, then XPath). Values may hold '{}' placeholders, filled in with the arguments given to find().
+
+    The registry records hit rate and resolution latency of each strategy and, once enough samples were collected,
+    tries the fastest reliable strategy first. Elements matched by their text keep an XPath only: there's no
+    equivalent ID/CSS selector, add one here when the bank's markup provides it.
+"""
+import logging
+import time
+from threading import Lock
+
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.wait import WebDriverWait
+
+from itau.driver_state import CONDITIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+
+LOCATORS = {
+    # Login
+    'login_branch': [(By.ID, 'campo_agencia'), (By.CSS_SELECTOR, '#campo_agencia')],
+    'login_account': [(By.ID, 'campo_conta'), (By.CSS_SELECTOR, '#campo_conta')],
+    'login_submit': [(By.CSS_SELECTOR, 'a.btnSubmit'), (By.XPATH, "//a[@class='btnSubmit']")],
+    'login_document_cpf': [(By.CSS_SELECTOR, '#tipoDocumento > option[value="CPF"]'),
+                           (By.XPATH, '//select[@id="tipoDocumento"]/option[@value="CPF"]')],
+    'login_cpf': [(By.ID, 'campoCpf'), (By.XPATH, '//input[@id="campoCpf"]')],
+    'login_continue': [(By.ID, 'botao-continuar'), (By.XPATH, '//a[@id="botao-continuar"]')],
+    'login_pin_digit': [(By.XPATH, '//a[@id="campoTeclado" and contains(text(), "{}")]')],
+    'login_access': [(By.ID, 'acessar'), (By.XPATH, '//a[@id="acessar"]')],
+    'login_sms_request': [(By.ID, 'sms-gerarCodigo'), (By.XPATH, '//a[@id="sms-gerarCodigo"]')],
+    'login_sms_code': [(By.ID, 'sms-codigoRecebido'), (By.XPATH, '//input[@id="sms-codigoRecebido"]')],
+    'login_sms_submit': [(By.ID, 'sms-codigoOk'), (By.XPATH, '//a[@id="sms-codigoOk"]')],
+
+    # Navigation
+    'frame': [(By.CSS_SELECTOR, 'frame[name="{}"]'), (By.XPATH, '//frame[@name="{}"]')],
+    'menu_search': [(By.ID, 'input-busca'), (By.XPATH, '//input[@id="input-busca"]')],
+    'menu_search_result': [(By.XPATH, '//div[contains(text(),"{}")]/parent::a')],
+    'menu_button': [(By.XPATH, '//a[@class="btn-nav"][contains(text(),"menu")]')],
+    'menu_item': [(By.LINK_TEXT, '{}'), (By.XPATH, '//a[text()="{}"]')],
+    'menu_link': [(By.PARTIAL_LINK_TEXT, '{}'), (By.XPATH, '//a[contains(text(),"{}")]')],
+    'transfers_tab': [(By.XPATH, '//td[contains(text(), "Transfer") and @class="TRNdado"]')],
+
+    # Operations (TEF/TED)
+    'tef_search': [(By.CSS_SELECTOR, 'input[name="FOCO"]'), (By.XPATH, '//input[@name="FOCO"]')],
+    'tef_search_submit': [(By.CSS_SELECTOR, 'input[name="Sub1"]'), (By.XPATH, '//input[@name="Sub1"]')],
+    'tef_customer_select': [(By.XPATH, '//*[text()="{}"]/../..//a[@class="TabelaSelecionar"]')],
+    'tef_customer_missing': [(By.XPATH, '//span[contains(text(), "o existe favorecido cadastrado") and '
+                                        '@class="MsgTxt"]')],
+    'tef_day': [(By.ID, 'FOCO'), (By.XPATH, '//input[@id="FOCO"]')],
+    'tef_month': [(By.CSS_SELECTOR, 'input[name="mes"]'), (By.XPATH, '//input[@name="mes"]')],
+    'tef_year': [(By.CSS_SELECTOR, 'input[name="ano"]'), (By.XPATH, '//input[@name="ano"]')],
+    'tef_submit': [(By.CSS_SELECTOR, 'input[name="Enviar"][type="button"]'),
+                   (By.XPATH, '//input[@name="Enviar" and @type="button"]')],
+    'ted_search': [(By.ID, 'nome'), (By.XPATH, '//input[@id="nome"]')],
+    'ted_customer_missing': [(By.XPATH, '//span[contains(text(), "o existe favorecido cadastrado") and '
+                                        '@class="MsgTxt"]')],
+    'ted_search_submit': [(By.PARTIAL_LINK_TEXT, 'buscar'), (By.XPATH, '//a[contains(text(), "buscar")]')],
+    'ted_customer_select': [(By.XPATH, '//td[contains(text(), "{}")]/..//a[contains(text(), "selecionar")]')],
+    'ted_day': [(By.ID, 'dia'), (By.XPATH, '//input[@id="dia"]')],
+    'ted_month': [(By.ID, 'mes'), (By.XPATH, '//input[@id="mes"]')],
+    'ted_year': [(By.ID, 'ano'), (By.XPATH, '//input[@id="ano"]')],
+    'ted_purpose_credit': [(By.CSS_SELECTOR, '#Finalidade > option[value="9"]'),
+                           (By.XPATH, '//select[@id="Finalidade"]/option[@value="9"]')],
+    'amount': [(By.CSS_SELECTOR, 'input[name="valor"][size="16"]'),
+               (By.XPATH, '//input[@name="valor" and @size="16"]')],
+    'include_submit': [(By.CSS_SELECTOR, 'input[name="Incluir"][type="button"]'),
+                       (By.XPATH, '//input[@name="Incluir" and @type="button"]')],
+    'success_message': [(By.XPATH, '//*[contains(text(), "sucesso")]')],
+
+    # Beneficiary registration
+    'beneficiary_register': [(By.PARTIAL_LINK_TEXT, 'incluir favorecido'),
+                             (By.XPATH, '//a[contains(text(), "incluir favorecido")]')],
+    'beneficiary_name': [(By.CSS_SELECTOR, 'input[name="nome"]'), (By.XPATH, '//input[@name="nome"]')],
+    'beneficiary_cpf': [(By.CSS_SELECTOR, 'input[name="cpf"]'), (By.XPATH, '//input[@name="cpf"]')],
+    'beneficiary_bank': [(By.CSS_SELECTOR, 'input[name="banco"]'), (By.XPATH, '//input[@name="banco"]')],
+    'beneficiary_branch': [(By.CSS_SELECTOR, 'input[name="agencia"]'), (By.XPATH, '//input[@name="agencia"]')],
+    'beneficiary_account': [(By.CSS_SELECTOR, 'input[name="conta"]'), (By.XPATH, '//input[@name="conta"]')],
+    'beneficiary_digit': [(By.CSS_SELECTOR, 'input[name="dac"]'), (By.XPATH, '//input[@name="dac"]')],
+    'beneficiary_nick': [(By.CSS_SELECTOR, 'input[name="apelido"]'), (By.XPATH, '//input[@name="apelido"]')],
+    'beneficiary_account_type': [(By.CSS_SELECTOR, 'select[name="tipoConta"] > option[value="{}"]'),
+                                 (By.XPATH, '//select[@name="tipoConta"]/option[@value="{}"]')],
+}
+
+
+class _LookupOnce:
+    """WebDriverWait stand-in for timeout=0: WebDriverWait always sleeps a poll interval before giving up."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def until(self, method, message=''):
+        value = method(self.driver)
+        if not value:
+            raise TimeoutException(message)
+        return value
+
+
+class StrategyStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.elapsed = 0.0      # Seconds spent on hits
+
+    @property
+    def hit_rate(self):
+        attempts = self.hits + self.misses
+        return self.hits / attempts if attempts else 0.0
+
+    @property
+    def latency(self):
+        return self.elapsed / self.hits if self.hits else None
+
+
+class LocatorRegistry:
+    """Resolve elements by name, learning which strategy of each locator works best."""
+
+    # Samples a strategy needs before it can be promoted
+    MIN_SAMPLES = 5
+    # Hit rate a strategy needs to be promoted
+    MIN_HIT_RATE = 0.9
+    # Every N resolutions of a locator (and until they have MIN_SAMPLES), strategies behind the winning one are
+    # timed too
+    EXPLORE_EVERY = 20
+
+    def __init__(self, locators):
+        self.locators = locators
+        self.stats = {name: [StrategyStats() for _ in strategies] for name, strategies in locators.items()}
+        self.order = {name: list(range(len(strategies))) for name, strategies in locators.items()}
+        self.resolutions = {name: 0 for name in locators}
+        self.mutex = Lock()
+
+    def describe(self, name, *args):
+        """Human readable locator, for log messages."""
+        return '{} ({})'.format(name, ' | '.join(value.format(*args) for _, value in self.locators[name]))
+
+    def find(self, driver, name, *args, condition='clickable', timeout=None, floor=False):
+        """Wait for an element, trying the strategies of locator `name` in order on each poll.
+
+        :param args: Values for the locator's '{}' placeholders.
+        :param condition: 'present', 'visible' or 'clickable'.
+        :param timeout: Seconds to wait for the element, 0 to look it up once. Once enough latencies of this locator
+                        were observed, the driver's adaptive timeouts (driver.timeouts) override it.
+        :param floor: Adaptive timeouts may grow `timeout`, never shrink it: for steps where giving up early costs
+                      more than waiting, e.g. checking a submitted transfer was approved.
+        :raise TimeoutException: Element wasn't found (fulfilling condition) in time.
+        """
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+
+        timeouts = getattr(driver, 'timeouts', None)
+        if timeout and timeouts is not None:
+            learned = timeouts.timeout(name, timeout)
+            timeout = max(timeout, learned) if floor else learned
+
+        key = (name,) + args
+        state = getattr(driver, 'state', None)
+        method = self._resolver(name, args, CONDITIONS[condition])
+        wait = WebDriverWait(driver, timeout) if timeout else _LookupOnce(driver)
+        started = time.time()
+
+        try:
+            if state is not None:
+                element = state.find(key, condition, method=method, wait=wait)
+            else:
+                element = wait.until(method)
+        except TimeoutException:
+            if timeout and timeouts is not None:
+                timeouts.record_timeout(name, timeout)
+
+            logger.warning("Locator {} not found within {:.1f}s timeout.".format(name, timeout))
+            raise TimeoutException("{} not found within {:.1f}s timeout".format(self.describe(name, *args), timeout))
+
+        if timeout and timeouts is not None:
+            timeouts.record(name, time.time() - started)
+
+        return element
+
+    def _resolver(self, name, args, check):
+        strategies = self.locators[name]
+
+        def resolve(driver):
+            # Strategies tried in this poll before one hit are misses, polls where none hit mean the page isn't ready
+            missed = []
+
+            for index in self.order[name]:
+                by, value = strategies[index]
+                started = time.time()
+                element = self._lookup(driver, by, value.format(*args), check)
+
+                if element is not None:
+                    self._record(name, index, time.time() - started, missed)
+                    self._explore(driver, name, args, check, index)
+                    return element
+
+                missed.append(index)
+
+            return False
+
+        return resolve
+
+    @staticmethod
+    def _lookup(driver, by, value, check):
+        try:
+            element = driver.find_element(by, value)
+            return element if check(element) else None
+        except (NoSuchElementException, StaleElementReferenceException):
+            return None
+
+    def _explore(self, driver, name, args, check, winner):
+        strategies = self.locators[name]
+        behind = self.order[name][self.order[name].index(winner) + 1:]
+        sampled = all(self.stats[name][index].hits + self.stats[name][index].misses >= LocatorRegistry.MIN_SAMPLES
+                      for index in behind)
+
+        if sampled and self.resolutions[name] % LocatorRegistry.EXPLORE_EVERY != 1:
+            return
+
+        for index in behind:
+            by, value = strategies[index]
+            started = time.time()
+            element = self._lookup(driver, by, value.format(*args), check)
+
+            with self.mutex:
+                stats = self.stats[name][index]
+                if element is not None:
+                    stats.hits += 1
+                    stats.elapsed += time.time() - started
+                else:
+                    stats.misses += 1
+
+    def _record(self, name, winner, elapsed, missed):
+        with self.mutex:
+            self.resolutions[name] += 1
+            self.stats[name][winner].hits += 1
+            self.stats[name][winner].elapsed += elapsed
+
+            for index in missed:
+                self.stats[name][index].misses += 1
+
+            self._promote(name)
+
+    def _promote(self, name):
+        stats = self.stats[name]
+
+        def rank(index):
+            strategy = stats[index]
+            reliable = (strategy.hits + strategy.misses >= LocatorRegistry.MIN_SAMPLES and
+                        strategy.hit_rate >= LocatorRegistry.MIN_HIT_RATE)
+            # Reliable strategies first, fastest first, then the declared order
+            return (0, strategy.latency, index) if reliable else (1, 0, index)
+
+        order = sorted(range(len(stats)), key=rank)
+        if order != self.order[name]:
+            by, value = self.locators[name][order[0]]
+            logger.info("Locator {}: promoting strategy {} {}".format(name, by, value))
+            self.order[name] = order
+
+    def report(self):
+        """Per strategy statistics, in the order strategies are currently tried.
+
+        :return: dict {name: [{"by", "value", "hits", "misses", "hit_rate", "latency_ms"}, ...]}
+        """
+        with self.mutex:
+            return {
+                name: [{
+                    'by': self.locators[name][index][0],
+                    'value': self.locators[name][index][1],
+                    'hits': self.stats[name][index].hits,
+                    'misses': self.stats[name][index].misses,
+                    'hit_rate': round(self.stats[name][index].hit_rate, 3),
+                    'latency_ms': (round(self.stats[name][index].latency * 1000, 1)
+                                   if self.stats[name][index].hits else None)
+                } for index in self.order[name]]
+                for name in self.locators if self.resolutions[name]
+            }
+
+
+registry = LocatorRegistry(LOCATORS)
+
+
+def find(driver, name, *args, condition='clickable', timeout=None):
+    """Locate an element through the shared registry (see LocatorRegistry.find())."""
+    return registry.find(driver, name, *args, condition=condition, timeout=timeout)
+
+
+def describe(name, *args):
+    return registry.describe(name, *args)
@@ -3,18 +3,19 @@ import time
 import logging
 
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 
-from itau import token_watcher
+from itau import token_watcher, locators
 
 ITAU_LOGIN_PAGE = "https://www.itau.com.br"
 
+# Seconds to wait for the SMS token, until its latency is learned (see timeouts), and at least once it is
+TOKEN_TIMEOUT = 10
+
 
 # PAGE 1: account / branch
 def login_page_1(log, config, driver):
-    branch_field = driver.wait.until(EC.visibility_of_element_located((By.ID, "campo_agencia")))
-    account_field = driver.wait.until(EC.visibility_of_element_located((By.ID, "campo_conta")))
+    branch_field = locators.find(driver, 'login_branch', condition='visible')
+    account_field = locators.find(driver, 'login_account', condition='visible')
 
     branch_field.click()
     branch_field.send_keys(config['account_branch_itau'])
@@ -22,7 +23,7 @@ def login_page_1(log, config, driver):
     account_field.click()
     account_field.send_keys(config['account_number_itau'])
 
-    submit_btn = driver.wait.until(EC.presence_of_element_located((By.XPATH, "//a[@class='btnSubmit']")))
+    submit_btn = locators.find(driver, 'login_submit', condition='present')
 
     log.info("Submiting account/branch credentials...")
     submit_btn.click()
@@ -30,8 +31,7 @@ def login_page_1(log, config, driver):
 
 # PAGE 2: Identification Method (CPF Preferred)
 def login_page_2(log, config, driver):
-    ident_type_field = driver.wait.until(EC.visibility_of_element_located(
-        (By.XPATH, '//select[@id="tipoDocumento"]/option[@value="CPF"]')))
+    ident_type_field = locators.find(driver, 'login_document_cpf', condition='visible')
 
     if not ident_type_field.is_selected():
         ident_type_field.click()
@@ -39,14 +39,12 @@ def login_page_2(log, config, driver):
 
     log.info("Locating CPF field...")
 
-    cpf_field = driver.wait.until(EC.element_to_be_clickable(
-        (By.XPATH, '//input[@id="campoCpf"]')))
+    cpf_field = locators.find(driver, 'login_cpf')
     cpf_field.click()
     time.sleep(1)
     cpf_field.send_keys(config['account_cpf_itau'])
 
-    submit_btn = driver.wait.until(EC.element_to_be_clickable(
-        (By.XPATH, '//a[@id="botao-continuar"]')))
+    submit_btn = locators.find(driver, 'login_continue')
 
     log.info("Submiting CPF credentials...")
     submit_btn.click()
@@ -60,15 +58,14 @@ def login_page_3(log, config, driver):
     log.info("Mapping PIN buttons...")
 
     for pin_digit in pin_unique_digits:
-        pin_btn = driver.wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//a[@id="campoTeclado" and contains(text(), "{}")]'.format(pin_digit))))
+        pin_btn = locators.find(driver, 'login_pin_digit', pin_digit)
         pin_buttons[pin_digit] = pin_btn
 
     for pin_digit in config['account_pin_itau']:
         pin_buttons[pin_digit].click()
         time.sleep(1)
 
-    submit_btn = driver.wait.until(EC.element_to_be_clickable((By.XPATH, '//a[@id="acessar"]')))
+    submit_btn = locators.find(driver, 'login_access')
     submit_btn.click()
 
 
@@ -77,23 +74,29 @@ def login_page_4(log, config, driver):
     time.sleep(1)
     token_watcher.clear_token(config['token_path'])
 
-    sms_btn = driver.wait.until(EC.element_to_be_clickable((By.XPATH, '//a[@id="sms-gerarCodigo"]')))
+    sms_btn = locators.find(driver, 'login_sms_request')
     sms_btn.click()
 
     time.sleep(5)
 
-    token = token_watcher.read_token(config['token_path'])
+    started = time.time()
+    timeout = max(TOKEN_TIMEOUT, driver.timeouts.timeout('sms_token', TOKEN_TIMEOUT))
+
+    token = token_watcher.read_token(config['token_path'], timeout=timeout)
     if token == '':
-        raise TimeoutException()
+        driver.timeouts.record_timeout('sms_token', timeout)
+        raise TimeoutException("SMS token not received within {:.1f}s timeout".format(timeout))
+
+    driver.timeouts.record('sms_token', time.time() - started)
 
-    sms_input = driver.wait.until(EC.element_to_be_clickable((By.XPATH, '//input[@id="sms-codigoRecebido"]')))
+    sms_input = locators.find(driver, 'login_sms_code')
     sms_input.click()
     sms_input.clear()
     sms_input.send_keys(token)
 
     time.sleep(1)
 
-    submit_btn = driver.find_element_by_xpath('//a[@id="sms-codigoOk"]')
+    submit_btn = locators.find(driver, 'login_sms_submit', condition='present', timeout=0)
     submit_btn.click()
 
 
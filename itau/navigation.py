@@ -1,11 +1,10 @@
 import logging
 
 import time
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from itau import locators
 
 # Dictionary mapping how to navigate between ITAU screens according to operation requested by the current JOB.
 ITAU_NAVIGATION = {
@@ -17,20 +16,24 @@ ITAU_NAVIGATION = {
 
 
 def switch_to_frame(driver, frame_name):
+    # Already there, nothing to do
+    if driver.state.in_frame(frame_name):
+        return
+
     driver.switch_to.default_content()
 
     try:
-        frame = driver.find_element(By.XPATH, '//frame[@name="{}"]'.format(frame_name))
-    except NoSuchElementException:
+        frame = locators.find(driver, 'frame', frame_name, condition='present', timeout=0)
+    except TimeoutException:
         pass
     else:
         logging.getLogger(__name__).info("Switching to frame {}".format(frame_name))
         driver.switch_to.frame(frame)
+        driver.state.entered_frame(frame_name)
 
 
 def goto_screen(driver, screen_name):
     log = logging.getLogger(__name__)
-    wait = WebDriverWait(driver, 8)
 
     if screen_name not in ITAU_NAVIGATION:
         log.critical("There is no configured navigation for the screen '{}'.".format(screen_name))
@@ -48,9 +51,9 @@ def goto_screen(driver, screen_name):
         log.info("Locating search field...")
 
         try:
-            search_element = wait.until(EC.visibility_of_element_located((By.XPATH, '//input[@id="input-busca"]')))
+            search_element = locators.find(driver, 'menu_search', condition='visible', timeout=8)
         except TimeoutException:
-            log.info('Search field not found: //input[@id="input-busca"]')
+            log.info('Search field not found: {}'.format(locators.describe('menu_search')))
             # return False
         else:
             log.info("Search field was successfully found!")
@@ -70,9 +73,9 @@ def goto_screen(driver, screen_name):
         time.sleep(1)
 
         try:
-            target = '//div[contains(text(),"{}")]/parent::a'.format(nav['search'][-30:])
+            target = locators.describe('menu_search_result', nav['search'][-30:])
             log.info("Waiting for element to appear: {}".format(target))
-            link = wait.until(EC.element_to_be_clickable((By.XPATH, target)))
+            link = locators.find(driver, 'menu_search_result', nav['search'][-30:], timeout=8)
         except TimeoutException:
             log.error('Unable to locate element: {}'.format(target))
             # return False
@@ -84,13 +87,12 @@ def goto_screen(driver, screen_name):
             return True
 
     elif nav['menu'] is not None:  # Navigate by MENU button
-        menu_xpath = '//a[@class="btn-nav"][contains(text(),"menu")]'
-        log.info("Trying to locate MENU: {}".format(menu_xpath))
+        log.info("Trying to locate MENU: {}".format(locators.describe('menu_button')))
 
         try:
-            menu_element = wait.until(EC.visibility_of_element_located((By.XPATH, menu_xpath)))
+            menu_element = locators.find(driver, 'menu_button', condition='visible', timeout=8)
         except TimeoutException:
-            log.critical('Unable to locate MENU: {}'.format(menu_xpath))
+            log.critical('Unable to locate MENU: {}'.format(locators.describe('menu_button')))
             return False
 
         log.info("MENU successfully found! hovering over it...")
@@ -99,12 +101,12 @@ def goto_screen(driver, screen_name):
         hover.perform()
         time.sleep(1)
 
-        link_xtag = '//a[text()="{}"]'.format(nav['menu'][0])
+        link_xtag = locators.describe('menu_item', nav['menu'][0])
         log.debug("Trying to locate link {} ...".format(link_xtag))
 
         try:
-            menu_element = wait.until(EC.element_to_be_clickable((By.XPATH, link_xtag)))
-        except NoSuchElementException:
+            menu_element = locators.find(driver, 'menu_item', nav['menu'][0], timeout=8)
+        except TimeoutException:
             log.critical("Unable to locate menu item: {}".format(link_xtag))
             return False
 
@@ -113,11 +115,11 @@ def goto_screen(driver, screen_name):
 
         driver.switch_to.default_content()
 
-        link_xtag = '//a[contains(text(),"{}")]'.format(nav['menu'][1])
+        link_xtag = locators.describe('menu_link', nav['menu'][1])
         log.debug("Trying to locate element: {}".format(link_xtag))
         try:
-            link = wait.until(EC.element_to_be_clickable((By.XPATH, link_xtag)))
-        except NoSuchElementException:
+            link = locators.find(driver, 'menu_link', nav['menu'][1], timeout=8)
+        except TimeoutException:
             log.critical("Unable to locate link: {}".format(link_xtag))
             return False
 
@@ -127,7 +129,7 @@ def goto_screen(driver, screen_name):
         return True
 
     else:
-        log.critical('Unable to locate search field: //input[@id="input-busca"].')
+        log.critical('Unable to locate search field: {}.'.format(locators.describe('menu_search')))
         return False
 
 
@@ -2,9 +2,11 @@
 
     If any operation returns OP_CUSTOMER_NOT_FOUND,
     that means customer must be added and the operation must be run again.
+    OP_CUSTOMER_REGISTER_FAILED is returned when automatic registration of that customer failed.
 """
 
 OP_SUCCESS = 0
 OP_CUSTOMER_NOT_FOUND = 1
 OP_TIMEOUT = 2
 OP_FAILED = 3
+OP_CUSTOMER_REGISTER_FAILED = 4
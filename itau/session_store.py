@@ -0,0 +1,155 @@
+""" ITAU session persistence
+
+    Saves authenticated cookies and sessionStorage (encrypted at rest) right after a successful login, so new drivers
+    (even after a process restart) can restore the session instead of running the whole login + SMS token flow.
+
+    Encryption relies on the optional `cryptography` package (Fernet). Without it, or without a valid configured key,
+    session persistence is disabled.
+"""
+import json
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import WebDriverException, TimeoutException
+
+from itau import locators
+from utils import atomic_write
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+
+def enabled(key, param='session_key'):
+    """Whether data can be persisted encrypted with key (configuration parameter `param`)."""
+    if not key:
+        return False
+
+    if Fernet is None:
+        logger.warning("Session persistence disabled: python package 'cryptography' is not installed.")
+        return False
+
+    try:
+        Fernet(key)
+    except (TypeError, ValueError) as err:
+        logger.error("Invalid configuration param <{}>, persistence disabled: {}".format(param, str(err)))
+        return False
+
+    return True
+
+
+def is_logged_in(driver):
+    """Cheap probe: logged in Itau pages are built on top of the MENU/CORPO frames."""
+    if not driver.state.in_frame(''):
+        driver.switch_to.default_content()
+
+    try:
+        locators.find(driver, 'frame', 'MENU', condition='present', timeout=0)
+    except TimeoutException:
+        return False
+
+    return True
+
+
+def snapshot(driver):
+    """Logged in session of driver: current url, cookies and sessionStorage."""
+    return {
+        'url': driver.current_url,
+        'cookies': driver.get_cookies(),
+        'session_storage': driver.execute_script("return Object.assign({}, window.sessionStorage);"),
+        'saved_at': time.time()
+    }
+
+
+def save(driver, session_file, key):
+    session = snapshot(driver)
+
+    data = Fernet(key).encrypt(json.dumps(session, separators=(',', ':')).encode()).decode()
+
+    if atomic_write(data, session_file):
+        logger.info("Session saved: {}".format(session_file))
+        return True
+
+    logger.critical("Failed to save session file: {}".format(session_file))
+    return False
+
+
+def _load(session_file, key):
+    try:
+        with open(session_file) as fp:
+            data = fp.read()
+    except IOError:
+        return None
+
+    try:
+        return json.loads(Fernet(key).decrypt(data.encode()).decode())
+    except (InvalidToken, ValueError) as err:
+        logger.warning("Discarding unreadable session file {}: {}".format(session_file, type(err).__name__))
+        return None
+
+
+def discard(session_file):
+    try:
+        os.unlink(session_file)
+    except OSError:
+        pass
+
+
+def load(driver, session):
+    """Load a session (see snapshot()) into driver, e.g. into another tab of the browser it was taken from.
+
+    :return: bool True if driver is logged in with it.
+    """
+    url = urlparse(session['url'])
+
+    try:
+        # Cookies can only be set for the domain currently loaded
+        driver.get("{}://{}/".format(url.scheme, url.netloc))
+
+        for cookie in session['cookies']:
+            if not url.netloc.endswith(cookie.get('domain', url.netloc).lstrip('.')):
+                continue
+
+            # Session cookies have no expiry, some drivers reject it being null
+            if cookie.get('expiry') is None:
+                cookie.pop('expiry', None)
+
+            driver.add_cookie(cookie)
+
+        driver.execute_script("for (var k in arguments[0]) { window.sessionStorage.setItem(k, arguments[0][k]); }",
+                              session['session_storage'] or {})
+
+        driver.get(session['url'])
+
+        return is_logged_in(driver)
+
+    except WebDriverException as err:
+        logger.warning("Failed to load session: {}".format(str(err)))
+
+    return False
+
+
+def restore(driver, session_file, key):
+    """Restore a saved session into driver.
+
+    :return: bool True if the restored session is still valid (logged in), False if a full login is required.
+    """
+    session = _load(session_file, key)
+    if session is None:
+        return False
+
+    logger.info("Restoring session saved at {}...".format(time.ctime(session['saved_at'])))
+
+    if load(driver, session):
+        logger.info("Session restored successfully, skipping login.")
+        return True
+
+    logger.info("Saved session has expired.")
+    discard(session_file)
+
+    return False
@@ -0,0 +1,149 @@
+""" Browser health supervisor
+
+    Keeps track of the Firefox process behind a web driver (memory, responsiveness, jobs served), telling when it
+    must be recycled, and kills it when it hangs.
+"""
+import logging
+import os
+import signal
+from threading import Thread
+
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import HTTPError
+
+logger = logging.getLogger(__name__)
+
+# Browser failures: WebDriver errors, and connection errors (MaxRetryError, ConnectionRefusedError, ...) once its
+# driver service (geckodriver) is gone, e.g. killed by kill()
+BROWSER_ERRORS = (WebDriverException, HTTPError, OSError)
+
+
+def _process_tree(root_pid):
+    """Return root_pid and all its descendants' pids (Linux /proc based)."""
+    children = {}
+
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open('/proc/{}/stat'.format(entry)) as stat_file:
+                stat = stat_file.read()
+        except IOError:
+            continue
+
+        # Process name (2nd field) may contain spaces, ppid is the 2nd field after it.
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [root_pid]
+    for pid in tree:
+        tree.extend(children.get(pid, []))
+
+    return tree
+
+
+def _rss_kb(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+
+    return 0
+
+
+class BrowserSupervisor:
+
+    def __init__(self, max_jobs=50, max_rss_mb=1500, ping_timeout=5):
+        self.max_jobs = max_jobs            # Recycle browser after this many jobs
+        self.max_rss_mb = max_rss_mb        # Recycle browser when its processes use more memory than this
+        self.ping_timeout = ping_timeout    # Seconds a healthy browser takes, at most, to answer a trivial command
+        self.driver = None
+        self.pid = None
+        self.jobs = 0
+
+    def attach(self, driver):
+        self.driver = driver
+        self.pid = driver.capabilities.get('moz:processID')
+        self.jobs = 0
+
+        if self.pid is None:
+            logger.warning("Unable to find out browser process id, memory won't be tracked.")
+
+    def job_done(self):
+        self.jobs += 1
+
+    def rss_mb(self):
+        if self.pid is None:
+            return 0
+
+        return sum(_rss_kb(pid) for pid in _process_tree(self.pid)) // 1024
+
+    def responsive(self):
+        """Check if browser answers a trivial command within ping_timeout."""
+        answered = []
+
+        def ping():
+            try:
+                answered.append(self.driver.title is not None)
+            except BROWSER_ERRORS:
+                pass
+
+        ping_thread = Thread(target=ping, daemon=True)
+        ping_thread.start()
+        ping_thread.join(self.ping_timeout)
+
+        return bool(answered)
+
+    def recycle_reason(self):
+        """Tell whether current browser must be replaced before the next job.
+
+        :return: str Reason why the browser should be recycled, None if it's fine to be reused.
+        """
+        if self.jobs >= self.max_jobs:
+            return "served {} jobs".format(self.jobs)
+
+        rss = self.rss_mb()
+        if rss > self.max_rss_mb:
+            return "using {}MB of memory".format(rss)
+
+        if not self.responsive():
+            return "unresponsive"
+
+        return None
+
+    def kill(self):
+        """Kill browser and its driver service, any command blocked on them fails right away."""
+        pids = _process_tree(self.pid) if self.pid is not None else []
+
+        service = getattr(self.driver, 'service', None)
+        if service is not None and getattr(service, 'process', None) is not None:
+            pids.append(service.process.pid)
+
+        logger.warning("Killing browser processes: {}".format(pids))
+
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def release(self, kill=False):
+        """Quit (or kill, if it's hung) current browser."""
+        if self.driver is None:
+            return
+
+        if kill:
+            self.kill()
+        else:
+            try:
+                self.driver.quit()
+            except BROWSER_ERRORS as err:
+                logger.warning("Failed to quit browser, killing it: {}".format(str(err)))
+                self.kill()
+
+        self.driver = None
+        self.pid = None
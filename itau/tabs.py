@@ -0,0 +1,171 @@
+""" Browser tabs multiplexing
+
+    Lets several jobs share one logged in browser, each one running in its own tab (window handle). A tab is a view of
+    the browser's WebDriver session (a shallow copy of the driver, with its own DriverState), so elements it locates
+    belong to it and every command it sends goes through TabPool: commands of all tabs are serialized by one lock, and
+    before a tab's command is sent the browser is switched to the tab's window and back into the frame the tab was in.
+
+    Jobs make progress concurrently whenever another one is waiting for the page (WebDriverWait polling, sleeps),
+    which is most of a job's time. A job can be aborted on its own (see abort()), leaving the browser and the jobs
+    running in the other tabs alone.
+"""
+import copy
+import functools
+import logging
+from threading import Condition, RLock
+
+from selenium.common.exceptions import NoSuchFrameException, NoSuchElementException, StaleElementReferenceException, \
+    WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.mobile import Mobile
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from itau.driver_state import DriverState
+from itau.supervisor import BROWSER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Commands leaving the current window at its top level document
+TOP_LEVEL_COMMANDS = {Command.GET, Command.REFRESH, Command.GO_BACK, Command.GO_FORWARD}
+
+
+class TabAborted(WebDriverException):
+    """Raised by every command of an aborted tab."""
+
+
+class TabPool:
+
+    def __init__(self, driver, count):
+        """
+        :param driver: Driver whose browser is multiplexed, it mustn't be used directly anymore (use its tabs).
+        :param count: Tabs wanted, fewer may be opened if the browser refuses to open new windows.
+        """
+        self.driver = driver
+        self.lock = RLock()     # Serializes commands of every tab
+        self.current = None     # Tab the browser is switched to
+        self.sending = None     # Tab whose command is being sent
+        self.switches = 0       # Tab switches performed
+        self.tabs = [self._tab(handle) for handle in self._open(count)]
+        self.free = list(self.tabs)
+        self.mutex = Condition()
+
+    def _open(self, count):
+        handles = list(self.driver.window_handles)
+
+        while len(handles) < count:
+            self.driver.execute_script("window.open('about:blank', '_blank');")
+            opened = [handle for handle in self.driver.window_handles if handle not in handles]
+            if not opened:
+                logger.warning("Browser refused to open a new tab, running {} tabs.".format(len(handles)))
+                break
+            handles.extend(opened)
+
+        self.driver.switch_to.window(handles[0])
+        return handles
+
+    def _tab(self, handle):
+        tab = copy.copy(self.driver)
+
+        # Tab gets its own command hooks and state, objects bound to the original driver are rebound to the tab
+        tab.__dict__.pop('execute', None)
+        tab._switch_to = SwitchTo(tab)
+        tab._mobile = Mobile(tab)
+        tab.handle = handle
+        tab.frames = []         # Frame switches (command params) leading from the window to the tab's frame
+        tab.pool = self
+        tab.aborted = False     # Set by abort(), until the tab is released
+
+        tab.execute = functools.partial(self._execute, tab)
+        tab.state = DriverState(tab)
+
+        if self.current is None:
+            self.current = tab
+
+        return tab
+
+    def acquire(self):
+        """Take a free tab, waiting for one to be released if all of them are in use."""
+        with self.mutex:
+            while not self.free:
+                self.mutex.wait()
+
+            return self.free.pop(0)
+
+    def release(self, tab):
+        if tab.aborted:
+            self._reset(tab)
+
+        with self.mutex:
+            self.free.append(tab)
+            self.mutex.notify()
+
+    def busy(self):
+        """Tabs in use."""
+        with self.mutex:
+            return len(self.tabs) - len(self.free)
+
+    def abort(self, tab):
+        """Make the tab's commands fail (TabAborted), from its next one on. A command being sent isn't interrupted."""
+        tab.aborted = True
+
+    def _reset(self, tab):
+        """Leave the page an aborted job left its tab on, for the next job to start afresh."""
+        try:
+            with self.lock:
+                if self.current is not tab:
+                    self._activate(tab)
+                WebDriver.execute(tab, Command.GET, {'url': 'about:blank'})
+        except BROWSER_ERRORS as err:
+            logger.warning("Tab {}: failed to reset it after abort: {}".format(tab.handle, str(err)))
+
+        del tab.frames[:]
+        tab.state.invalidate()
+        tab.aborted = False
+
+    def _execute(self, tab, driver_command, params=None):
+        with self.lock:
+            if tab.aborted:
+                raise TabAborted("Tab {} was aborted".format(tab.handle))
+
+            if self.current is not tab:
+                self._activate(tab)
+
+            self.sending = tab
+            try:
+                response = WebDriver.execute(tab, driver_command, params)
+            finally:
+                self.sending = None
+
+            if driver_command == Command.SWITCH_TO_FRAME:
+                if (params or {}).get('id') is None:
+                    del tab.frames[:]
+                else:
+                    tab.frames.append(params)
+            elif driver_command == Command.SWITCH_TO_PARENT_FRAME:
+                del tab.frames[-1:]
+            elif driver_command in TOP_LEVEL_COMMANDS:
+                del tab.frames[:]
+            elif driver_command == Command.SWITCH_TO_WINDOW:
+                # Job moved its tab to another window (e.g. a popup)
+                tab.handle = (params or {}).get('handle', (params or {}).get('name'))
+                del tab.frames[:]
+
+            return response
+
+    def _activate(self, tab):
+        """Switch browser to a tab's window, then into the tab's frame."""
+        WebDriver.execute(tab, Command.SWITCH_TO_WINDOW,
+                          {'handle': tab.handle} if tab.w3c else {'name': tab.handle})
+        self.current = tab
+        self.switches += 1
+
+        for depth, params in enumerate(tab.frames):
+            try:
+                WebDriver.execute(tab, Command.SWITCH_TO_FRAME, params)
+            except (NoSuchFrameException, NoSuchElementException, StaleElementReferenceException):
+                # Frame went away along with its document while the tab was in background
+                logger.warning("Tab {}: frame lost while in background.".format(tab.handle))
+                del tab.frames[depth:]
+                tab.state.invalidate()
+                break
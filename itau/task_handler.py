@@ -1,15 +1,20 @@
 import logging
 
 import time
+from os.path import join
+from threading import Lock, RLock, Thread, Timer, local
+
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.remote.remote_connection import LOGGER
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 
-from itau import command_validator, navigation, tef_ch, operation_codes, ted_doc
-from itau.login import login
+from itau import command_validator, navigation, tef_ch, operation_codes, ted_doc, session_store, locators
+from itau.driver_state import DriverState
+from itau.supervisor import BrowserSupervisor, BROWSER_ERRORS
+from itau.tabs import TabPool, TabAborted
+from itau.timeouts import AdaptiveTimeouts
+from itau.trace import Tracer
+from itau.login import login, ITAU_LOGIN_PAGE
 
 
 class TaskHandler:
@@ -17,18 +22,365 @@ class TaskHandler:
     REQUIRED_CFG_PARAMS = ('account_branch_itau', 'account_number_itau',
                            'account_pin_itau', 'account_cpf_itau', 'token_path')
 
+    # Default file where logged in session is persisted (config: session_file, encrypted with config: session_key)
+    SESSION_FILE = 'itau_session.dat'
+
+    # Default browser recycling policy (config: driver_max_jobs, driver_max_rss_mb, driver_ping_timeout)
+    DRIVER_MAX_JOBS = 50
+    DRIVER_MAX_RSS_MB = 1500
+    DRIVER_PING_TIMEOUT = 5
+
+    # Whether browser is started in background right away, instead of by the first job (config: browser_prelaunch)
+    BROWSER_PRELAUNCH = True
+
+    # Default tabs of the browser, each one running a job concurrently with the other ones (config: browser_tabs)
+    BROWSER_TABS = 1
+
+    # Seconds an aborted tab's command in flight is given to return, before the whole browser is killed
+    TAB_ABORT_GRACE = 30
+
+    # Default adaptive timeouts: p99 of last TIMEOUT_WINDOW latencies of each step x TIMEOUT_FACTOR, clamped to
+    # [TIMEOUT_MIN, TIMEOUT_MAX] (config: timeouts_file, timeout_factor, timeout_min, timeout_max, timeout_window)
+    TIMEOUTS_FILE = 'itau_timeouts.json'
+    TIMEOUT_FACTOR = 2.0
+    TIMEOUT_MIN = 2
+    TIMEOUT_MAX = 60
+    TIMEOUT_WINDOW = 200
+
+    # Default folder of WebDriver command traces (config: trace_folder, enabled by config: trace_jobs or job field
+    # "trace", encrypted with config: trace_key or session_key)
+    TRACE_FOLDER = 'traces'
+
+    # Default deadline added to Ninja's job deadline (config: job_deadline) for every transfer of a batch but the
+    # first one, each takes ~12s of fixed sleeps and lookups (config: batch_transfer_deadline)
+    BATCH_TRANSFER_DEADLINE = 120
+
+    # Default idle keep-alive: KEEPALIVE_ACTION ('script' to run config: keepalive_script, no default: an async script
+    # sending a request to the bank and calling back whether the session is still logged in; 'navigate' to transfers
+    # screen, which keeps the dispatcher busy for several seconds; '' to disable) is performed every
+    # KEEPALIVE_INTERVAL seconds while no job is running, interval adapting within [KEEPALIVE_MIN, KEEPALIVE_MAX] to
+    # how long sessions survive idle (config: keepalive_action, keepalive_interval, keepalive_min, keepalive_max).
+    # SESSION_IDLE_TIMEOUT is how long an idle session is assumed to survive without keep-alive, until an expiry is
+    # observed (config: session_idle_timeout).
+    KEEPALIVE_ACTIONS = ('navigate', 'script')
+    KEEPALIVE_ACTION = 'script'
+    KEEPALIVE_INTERVAL = 240
+    KEEPALIVE_MIN = 60
+    KEEPALIVE_MAX = 1200
+    SESSION_IDLE_TIMEOUT = 600
+
     def __init__(self, *args, **kwargs):
         self.ninja = kwargs['ninja']
         self.logger = logging.getLogger(__name__)
-        self.web_driver = None
+        self.browser = None      # Web driver, use web_driver (the calling job's tab when browser is multiplexed)
+        self.tabs = None         # Tabs of browser, when configured with several ones (config: browser_tabs)
+        self.job_tabs = {}       # Tab of each running job (by job name), jobs are aborted through their tab
+        self.local = local()     # Per job (thread) state: tab and stage of the job
+        self.driver_mutex = RLock()  # Browser (re)starts, jobs running in other tabs may be sharing it
+        self.login_mutex = Lock()    # Jobs running in other tabs wait for the login to be done once
+        self.session = None      # Logged in session of browser, loaded into other tabs
+        self.session_file = ''
+        self.session_key = None
+        self.supervisor = None   # Browser health supervisor, recycles web_driver
+        self.timeouts = None     # Adaptive per-step timeouts, shared by every web_driver
+        self.tracer = None       # Records WebDriver commands of traced jobs, None if no trace key is configured
+        self.logged_in = False   # Whether web_driver is currently logged in
+        self.aborted = False     # Whether current browser was killed to abort a job (deadline expired)
+
+        self.keepalive_action = ''      # Idle keep-alive action, '' when disabled
+        self.last_activity = 0.0        # Last time web_driver was used by a job or a keep-alive
+        self.idle_since = 0.0           # Last time a job finished
+        self.keepalive_interval = None  # Current keep-alive interval (seconds), adapted while idle
+        self.session_expiry = None      # Shortest idle time after which session was found expired (seconds)
+        self.keepalives = 0             # Keep-alives performed since last job
+        self.relogins_avoided = 0       # Jobs which found session alive thanks to keep-alives
+
+    @property
+    def web_driver(self):
+        """Driver to be used by the calling job: its own tab when browser is multiplexed (first tab between jobs)."""
+        tab = getattr(self.local, 'tab', None)
+        if tab is not None:
+            return tab
+
+        return self.tabs.tabs[0] if self.tabs is not None else self.browser
+
+    def job_slots(self):
+        """Jobs Ninja may run at once, one per browser tab."""
+        tabs = self.ninja.config.get('browser_tabs', TaskHandler.BROWSER_TABS)
+        if isinstance(tabs, bool) or not isinstance(tabs, int) or tabs < 1:
+            self.logger.error("Invalid configuration param <browser_tabs>: {}, using a single tab.".format(tabs))
+            return 1
+
+        return tabs
 
     def init_driver(self):
         LOGGER.setLevel(logging.WARNING)
 
-        self.web_driver = webdriver.Firefox(firefox_profile=self.ninja.config['firefox_profile'],
-                                            firefox_binary=self.ninja.config['firefox_binary'])
-        # self.web_driver.implicitly_wait(30)
-        self.web_driver.wait = WebDriverWait(self.web_driver, 30)
+        self.browser = webdriver.Firefox(firefox_profile=self.ninja.config['firefox_profile'],
+                                         firefox_binary=self.ninja.config['firefox_binary'])
+        # self.browser.implicitly_wait(30)
+        self.browser.state = DriverState(self.browser)
+        self.browser.timeouts = self.timeouts
+        self.supervisor.attach(self.browser)
+        if self.tracer is not None:
+            self.tracer.attach(self.browser)
+        self.logged_in = False
+        self.aborted = False
+
+        tabs = self.job_slots()
+        if tabs > 1:
+            self.tabs = TabPool(self.browser, tabs)
+            self.logger.info("Browser multiplexed across {} tabs.".format(len(self.tabs.tabs)))
+
+    def release_driver(self, kill=False):
+        with self.driver_mutex:
+            if self.tabs is not None:
+                self.logger.info("Tab switches: {}".format(self.tabs.switches))
+
+            self.supervisor.release(kill=kill)
+            self.browser = None
+            self.tabs = None
+            self.session = None
+            self.logged_in = False
+
+    def _ensure_driver(self):
+        """Reuse current browser while it's healthy, replace it otherwise.
+
+        A multiplexed browser is only recycled once no other job is running in it, unless it's gone.
+        """
+        with self.driver_mutex:
+            if self.browser is not None:
+                if self.tabs is not None and self.tabs.busy():
+                    return
+
+                reason = self.supervisor.recycle_reason()
+                if reason is None:
+                    return
+
+                self.logger.info("Recycling browser: {}".format(reason))
+                self.release_driver(kill=(reason == 'unresponsive'))
+
+            self.init_driver()
+
+    def reconfigure(self, changed):
+        """Apply a reloaded configuration (called by Ninja between jobs).
+
+        Driver settings (firefox_binary, firefox_profile) are read when a browser is started, so they're applied once
+        the current browser is recycled.
+        """
+        config = self.ninja.config
+
+        self.supervisor.max_jobs = config.get('driver_max_jobs', TaskHandler.DRIVER_MAX_JOBS)
+        self.supervisor.max_rss_mb = config.get('driver_max_rss_mb', TaskHandler.DRIVER_MAX_RSS_MB)
+        self.supervisor.ping_timeout = config.get('driver_ping_timeout', TaskHandler.DRIVER_PING_TIMEOUT)
+
+        self.timeouts.configure(factor=config.get('timeout_factor', TaskHandler.TIMEOUT_FACTOR),
+                                min_timeout=config.get('timeout_min', TaskHandler.TIMEOUT_MIN),
+                                max_timeout=config.get('timeout_max', TaskHandler.TIMEOUT_MAX),
+                                window=config.get('timeout_window', TaskHandler.TIMEOUT_WINDOW))
+
+        if 'session_file' in changed or 'session_key' in changed:
+            self.session_file = config.get('session_file', join(self.ninja.app_root_dir, TaskHandler.SESSION_FILE))
+            self.session_key = config['session_key'] if session_store.enabled(config.get('session_key')) else None
+
+        # Ninja runs one job per tab, current browser's tabs must match
+        if 'browser_tabs' in changed and self.browser is not None:
+            self.logger.info("Browser tabs changed, restarting browser...")
+            self.release_driver()
+
+        if 'keepalive_interval' in changed:
+            self.keepalive_interval = None
+
+        if {'trace_folder', 'trace_key', 'session_key'} & set(changed):
+            self._setup_tracer()
+
+        if {'keepalive_action', 'keepalive_script'} & set(changed) and not self._setup_keepalive():
+            self.logger.warning("Keep-alive disabled.")
+
+        if 'timeouts_file' in changed:
+            self.logger.warning("Configuration parameter <timeouts_file> changed, restart Ninja to apply it.")
+
+        if self.web_driver is not None and ('firefox_binary' in changed or 'firefox_profile' in changed):
+            self.logger.info("Browser settings changed, they'll be applied when the browser is recycled.")
+
+    def shutdown(self):
+        if self.browser is not None:
+            self.release_driver()
+
+        if self.timeouts is not None:
+            self.timeouts.save()
+
+        self.logger.info("Keep-alive: {} re-logins avoided, interval {}s.".format(
+            self.relogins_avoided, self._keepalive_interval()))
+
+        for name, strategies in locators.registry.report().items():
+            self.logger.info("Locator {}: {}".format(name, ', '.join(
+                '{by} {value!r} hits={hits} misses={misses} latency={latency_ms}ms'.format(**strategy)
+                for strategy in strategies)))
+
+    def abort(self, job=None):
+        """Abort a running job once its deadline expires, or every running job (no job given, on shutdown). Called by
+        Ninja from another thread.
+
+        A job running in a tab of a multiplexed browser is aborted through its tab, jobs running in the other tabs
+        carry on. Otherwise, or if the tab's command in flight doesn't return within TAB_ABORT_GRACE, the browser is
+        killed: whatever WebDriver command the job is blocked on fails right away.
+        """
+        tab = self.job_tabs.get(job.name) if job is not None else None
+        if tab is not None:
+            tab.pool.abort(tab)
+            timer = Timer(TaskHandler.TAB_ABORT_GRACE, self._abort_hung_tab, args=(tab,))
+            timer.daemon = True
+            timer.start()
+            return
+
+        self.aborted = True
+        if self.browser is not None:
+            self.supervisor.kill()
+
+    def _abort_hung_tab(self, tab):
+        if tab.aborted and tab.pool.sending is tab:
+            self.logger.critical("Aborted tab {} is blocked on a command, killing browser...".format(tab.handle))
+            self.aborted = True
+            self.supervisor.kill()
+
+    def _run(self, operation, job_data):
+        self.local.stage = ''
+
+        traced = self.ninja.config.get('trace_jobs', False) or job_data.get('trace', False)
+        if traced and self.tracer is None:
+            self.logger.warning("Job trace requested, but traces are disabled (no trace_key nor session_key).")
+        elif traced:
+            self.tracer.start(self.ninja.local.job.name, job_data, self.logged_in)
+
+        try:
+            operation(job_data)
+        except BROWSER_ERRORS as err:
+            self._interrupted(job_data, err)
+        finally:
+            self._job_done()
+            if traced and self.tracer is not None:
+                self.tracer.stop()
+
+    def _job_done(self):
+        if self.web_driver is not None:
+            self.logger.info("WebDriver commands: {} sent, {} avoided by cached driver state.".format(
+                self.web_driver.state.commands, self.web_driver.state.avoided))
+            self.web_driver.state.reset_stats()
+
+        tab = getattr(self.local, 'tab', None)
+        if tab is not None:
+            self.local.tab = None
+            self.job_tabs.pop(self.ninja.local.job.name, None)
+            tab.pool.release(tab)
+
+        self.supervisor.job_done()
+        self.timeouts.save()
+
+        self.last_activity = self.idle_since = time.time()
+        self.keepalives = 0
+
+    def _keepalive_interval(self):
+        config = self.ninja.config
+        if self.keepalive_interval is None:
+            self.keepalive_interval = config.get('keepalive_interval', TaskHandler.KEEPALIVE_INTERVAL)
+
+        ceiling = config.get('keepalive_max', TaskHandler.KEEPALIVE_MAX)
+        if self.session_expiry is not None:
+            ceiling = min(ceiling, self.session_expiry / 2)
+
+        return max(config.get('keepalive_min', TaskHandler.KEEPALIVE_MIN), min(ceiling, self.keepalive_interval))
+
+    def idle(self):
+        """Keep logged in session alive while no job is running (called by Ninja whenever its queue is empty).
+
+        Interval grows while session survives keep-alives, and drops to half the idle time after which it was found
+        expired otherwise.
+        """
+        if not self.keepalive_action or not self.logged_in or self.web_driver is None:
+            return
+
+        idle_time = time.time() - self.last_activity
+        interval = self._keepalive_interval()
+        if idle_time < interval:
+            return
+
+        try:
+            alive = self._keepalive()
+        except BROWSER_ERRORS as err:
+            self.logger.warning("Keep-alive failed, browser failure: {}".format(str(err)))
+            self.release_driver(kill=True)
+            return
+
+        self.last_activity = time.time()
+        self.web_driver.state.reset_stats()
+
+        if alive is None:
+            self.logger.warning("Keep-alive: navigation failed after {:.0f}s idle, session state unknown.".format(
+                idle_time))
+            return
+
+        if alive:
+            self.keepalives += 1
+            self.keepalive_interval = interval * 1.25
+            self.logger.debug("Keep-alive: session alive after {:.0f}s idle, next in {:.0f}s.".format(
+                idle_time, self._keepalive_interval()))
+            return
+
+        self.logged_in = False
+        self.session_expiry = idle_time if self.session_expiry is None else min(self.session_expiry, idle_time)
+        self.keepalive_interval = idle_time / 2
+        self.logger.warning("Keep-alive: session expired after {:.0f}s idle, interval lowered to {:.0f}s.".format(
+            idle_time, self._keepalive_interval()))
+
+    def _keepalive(self):
+        """Perform keep-alive action.
+
+        Session state is told by the bank's answer: the page navigated to, or the script's own request.
+        :return: bool True if session is still logged in, None if keep-alive navigation failed.
+        """
+        if self.keepalive_action == 'navigate':
+            if not session_store.is_logged_in(self.web_driver):
+                return False
+            if not navigation.goto_screen(self.web_driver, 'transfer_bank'):
+                return None
+            if not session_store.is_logged_in(self.web_driver):
+                return False
+        elif not self.web_driver.execute_async_script(self.ninja.config['keepalive_script']):
+            return False
+
+        if self.session_key is not None:
+            session_store.save(self.web_driver, self.session_file, self.session_key)
+
+        return True
+
+    def _interrupted(self, job_data, err):
+        """Job was interrupted by a browser failure (hung/killed/crashed browser).
+
+        Before the operation starts nothing was submitted, job is just retried. Once it started, we can't tell
+        whether the transfer went through, so job is confirmed as interrupted to be checked by hand.
+        """
+        tab_aborted = isinstance(err, TabAborted)
+        reason = "deadline expired" if self.aborted or tab_aborted else "browser failure"
+        stage = self.local.stage
+        self.logger.critical("Job interrupted during {} ({}): {}".format(stage, reason, str(err)))
+
+        # Only the job's own tab was aborted, browser is fine. Otherwise jobs running in other tabs fail along, browser
+        # is only released once.
+        tab = getattr(self.local, 'tab', None)
+        with self.driver_mutex:
+            if not tab_aborted and (tab is None or tab.pool is self.tabs):
+                self.release_driver(kill=True)
+
+        if stage == 'operation':
+            self.ninja.confirm_job(job_data, status='err_job_interrupted',
+                                   status_message='Operation interrupted: {}'.format(reason),
+                                   admin_message='Job interrupted during operation ({}), check account statement '
+                                                 'before resubmitting it.'.format(reason))
+        else:
+            self.ninja.retry_job(job_data, status='err_job_interrupted',
+                                 status_message='Operation interrupted: {}'.format(reason),
+                                 admin_message='Job interrupted during {} ({})'.format(stage, reason))
 
     def setup(self):
         self.logger.info("Checking required configuration parameters...")
@@ -38,8 +390,166 @@ class TaskHandler:
                 self.logger.critical("Required configuration param is missing: <{}>".format(cfg))
                 return False
 
+        tabs = self.ninja.config.get('browser_tabs', TaskHandler.BROWSER_TABS)
+        if isinstance(tabs, bool) or not isinstance(tabs, int) or tabs < 1:
+            self.logger.critical("Invalid configuration param <browser_tabs>: {} (expected a number >= 1)".format(tabs))
+            return False
+
         self.logger.info("Configuration is correct.")
 
+        self.supervisor = BrowserSupervisor(
+            max_jobs=self.ninja.config.get('driver_max_jobs', TaskHandler.DRIVER_MAX_JOBS),
+            max_rss_mb=self.ninja.config.get('driver_max_rss_mb', TaskHandler.DRIVER_MAX_RSS_MB),
+            ping_timeout=self.ninja.config.get('driver_ping_timeout', TaskHandler.DRIVER_PING_TIMEOUT))
+
+        self.session_file = self.ninja.config.get('session_file', join(self.ninja.app_root_dir,
+                                                                         TaskHandler.SESSION_FILE))
+        if session_store.enabled(self.ninja.config.get('session_key')):
+            self.session_key = self.ninja.config['session_key']
+
+        self.timeouts = AdaptiveTimeouts(
+            self.ninja.config.get('timeouts_file', join(self.ninja.app_root_dir, TaskHandler.TIMEOUTS_FILE)),
+            factor=self.ninja.config.get('timeout_factor', TaskHandler.TIMEOUT_FACTOR),
+            min_timeout=self.ninja.config.get('timeout_min', TaskHandler.TIMEOUT_MIN),
+            max_timeout=self.ninja.config.get('timeout_max', TaskHandler.TIMEOUT_MAX),
+            window=self.ninja.config.get('timeout_window', TaskHandler.TIMEOUT_WINDOW))
+
+        if not self._setup_keepalive():
+            return False
+
+        self._setup_tracer()
+
+        return True
+
+    def started(self):
+        """Called by Ninja once started, start-up checks passed."""
+        # First job waits for the browser in _ensure_driver(), if it's not ready yet
+        if self.ninja.config.get('browser_prelaunch', TaskHandler.BROWSER_PRELAUNCH):
+            Thread(target=self._prelaunch, name='BrowserLaunch', daemon=True).start()
+
+    def _setup_tracer(self):
+        param = 'trace_key' if self.ninja.config.get('trace_key') else 'session_key'
+        key = self.ninja.config.get(param)
+        trace_folder = self.ninja.config.get('trace_folder', join(self.ninja.app_root_dir, TaskHandler.TRACE_FOLDER))
+
+        # Traces hold credentials typed during login: like sessions, they're only persisted encrypted
+        if not session_store.enabled(key, param):
+            self.tracer = None
+        elif self.tracer is not None:
+            self.tracer.configure(trace_folder, key)
+        else:
+            self.tracer = Tracer(trace_folder, key)
+            if self.browser is not None:
+                self.tracer.attach(self.browser)
+
+    def _prelaunch(self):
+        started = time.time()
+        try:
+            with self.driver_mutex:
+                if self.browser is None:
+                    self.init_driver()
+        except BROWSER_ERRORS as err:
+            self.logger.warning("Failed to start browser, first job will retry: {}".format(str(err)))
+        else:
+            self.logger.info("Browser started in {:.1f}s.".format(time.time() - started))
+
+    def _setup_keepalive(self):
+        action = self.ninja.config.get('keepalive_action', TaskHandler.KEEPALIVE_ACTION)
+        if action and action not in TaskHandler.KEEPALIVE_ACTIONS:
+            self.logger.critical("Invalid configuration param <keepalive_action>: {} (expected one of: {})".format(
+                action, ', '.join(TaskHandler.KEEPALIVE_ACTIONS)))
+            self.keepalive_action = ''
+            return False
+
+        # A script which doesn't reach the bank (e.g. a no-op) would find every session alive
+        if action == 'script' and not self.ninja.config.get('keepalive_script'):
+            self.logger.info("Keep-alive disabled: <keepalive_action> 'script' requires <keepalive_script>.")
+            action = ''
+
+        self.keepalive_action = action
+        return True
+
+    def _login(self):
+        """Restore persisted session if still valid, run the full login flow otherwise.
+
+        Jobs running in other tabs join the session of the browser, once it's logged in.
+        """
+        with self.login_mutex:
+            if self.logged_in and session_store.is_logged_in(self.web_driver):
+                self._relogin_avoided()
+                return True
+
+            if self.logged_in and self.session is not None and session_store.load(self.web_driver, self.session):
+                return True
+
+            if self.session_key is not None and session_store.restore(self.web_driver, self.session_file,
+                                                                      self.session_key):
+                self._logged_in()
+                return True
+
+            if not login(self.ninja.config, self.web_driver):
+                return False
+
+            time.sleep(4)
+
+            if self.session_key is not None:
+                session_store.save(self.web_driver, self.session_file, self.session_key)
+
+            self._logged_in()
+            return True
+
+    def _logged_in(self):
+        self.logged_in = True
+        if self.tabs is not None:
+            self.session = session_store.snapshot(self.web_driver)
+
+    def _relogin_avoided(self):
+        idle_time = time.time() - self.idle_since
+        session_idle_timeout = self.session_expiry or self.ninja.config.get('session_idle_timeout',
+                                                                             TaskHandler.SESSION_IDLE_TIMEOUT)
+        if self.keepalives and idle_time > session_idle_timeout:
+            self.relogins_avoided += 1
+            self.logger.info("Session kept alive by {} keep-alives over {:.0f}s idle, re-login avoided ({} so "
+                             "far).".format(self.keepalives, idle_time, self.relogins_avoided))
+
+    def job_deadline(self, job_data, deadline):
+        """Seconds a job may run before being aborted: Ninja's job deadline, extended for each transfer of a batch."""
+        if job_data['operation'] != 'transfer_batch':
+            return deadline
+
+        per_transfer = self.ninja.config.get('batch_transfer_deadline', TaskHandler.BATCH_TRANSFER_DEADLINE)
+        return deadline + per_transfer * (len(job_data['transfers']) - 1)
+
+    def rate_limit_requirements(self, job_data):
+        """Actions a job is going to perform on Itau site, paced by Ninja's rate limiter (config: rate_limits).
+
+        A login (and its SMS token) is accounted for whenever current browser isn't logged in yet.
+        :return: list of (action, account, count) tuples.
+        """
+        account = '{}-{}'.format(self.ninja.config['account_branch_itau'], self.ninja.config['account_number_itau'])
+        transfers = len(job_data['transfers']) if job_data['operation'] == 'transfer_batch' else 1
+
+        requirements = [('transfer', account, transfers)]
+        if not self.logged_in:
+            requirements += [('login', account, 1), ('sms_token', account, 1)]
+
+        return requirements
+
+    def probe(self):
+        """Check whether Itau site is up, without logging in (no SMS token is spent)."""
+        try:
+            self._ensure_driver()
+            self.logged_in = False
+            self.web_driver.get(ITAU_LOGIN_PAGE)
+            locators.find(self.web_driver, 'login_branch', condition='visible', timeout=10)
+        except TimeoutException as err:
+            self.logger.warning("Itau site probe failed: {}".format(str(err)))
+            return False
+        except BROWSER_ERRORS as err:
+            self.logger.warning("Itau site probe failed, browser failure: {}".format(str(err)))
+            self.release_driver(kill=True)
+            return False
+
         return True
 
     def validate(self, job_data):
@@ -56,6 +566,9 @@ class TaskHandler:
                                        status_message="Required field is missing -> '{}'".format(required_field))
                 return False
 
+        if operation == 'transfer_batch':
+            return self._validate_batch(job_data)
+
         if job_data['account_type'] not in ('SV', 'CH'):
             self.ninja.confirm_job(job_data,
                                    status="err_invalid_account_type",
@@ -65,69 +578,197 @@ class TaskHandler:
 
         return True
 
-    def transfer_bank(self, job_data):
-        self.init_driver()
+    def _validate_batch(self, job_data):
+        # Whole batch is rejected if any of its transfers is invalid, before any money is moved.
+        transfers = job_data['transfers']
+        if not isinstance(transfers, list) or not transfers:
+            self.ninja.confirm_job(job_data, status='err_sys_invalid_job',
+                                   status_message="'transfers' must be a non empty list")
+            return False
+
+        for index, transfer in enumerate(transfers):
+            if not isinstance(transfer, dict):
+                self.logger.critical("Invalid JOB: transfers[{}]: json object expected".format(index))
+                self.ninja.confirm_job(job_data, status='err_sys_invalid_job',
+                                       status_message="transfers[{}]: must be a json object".format(index))
+                return False
+
+            for required_field in command_validator.REQUIRED_FIELDS_BY_COMMAND['transfer_bank']:
+                if required_field not in transfer:
+                    self.logger.critical("Invalid JOB: transfers[{}]: Required field is missing -> '{}'".format(
+                        index, required_field))
+                    self.ninja.confirm_job(job_data, status='err_sys_invalid_job',
+                                           status_message="transfers[{}]: Required field is missing -> '{}'".format(
+                                               index, required_field))
+                    return False
+
+            if transfer['account_type'] not in ('SV', 'CH'):
+                self.ninja.confirm_job(job_data,
+                                       status="err_invalid_account_type",
+                                       status_message="transfers[{}]: account_type must be either 'CH' or 'SV'".format(
+                                           index),
+                                       admin_message="Could not process job sent from API. (Invalid account_type)")
+                return False
+
+        return True
+
+    def _open_transfers(self, job_data):
+        """Login and navigate to <Transferencias> screen.
+
+        On failure, job is rescheduled/confirmed accordingly.
+        :return: bool True if transfers form is ready to be used.
+        """
+        self._stage('login')
+        with self.driver_mutex:
+            self._ensure_driver()
+            tabs = self.tabs
+
+        # Browser may be released (by a job interrupted in another tab) meanwhile: this tab's commands fail then
+        if tabs is not None:
+            self.local.tab = tabs.acquire()
+            self.job_tabs[self.ninja.local.job.name] = self.local.tab
+
+        if not self._login():
+            self.ninja.take_ss(self.web_driver)
+            self.ninja.retry_job(job_data, status='err_itau_login', status_message='Unable to login',
+                                 admin_message='Failed to login on Itau.', site_failure=True)
+            return False
+
+        self._stage('navigation')
+        if not navigation.goto_screen(self.web_driver, 'transfer_bank'):
+            self.logger.critical("Unable to navigate on ITAU web page as expected. Aborting...")
+            self.ninja.take_ss(self.web_driver)
+            self.ninja.retry_job(job_data, status='err_itau_navigation', status_message='Unable to navigate',
+                                 admin_message='Failed to navigate to <Transferencias> screen',
+                                 site_failure=True)
+            return False
+
+        if not self._open_transfers_tab():
+            self.ninja.take_ss(self.web_driver)
+            self.ninja.retry_job(job_data, status='err_itau_navigation',
+                                 status_message='Unable find TAB <Transferencias>',
+                                 admin_message='Unable find TAB <Transferencias>', site_failure=True)
+            return False
+
+        self._stage('operation')
+        return True
+
+    def _stage(self, stage):
+        """Enter a job stage: from 'operation' on, the job may have been submitted and mustn't be run again."""
+        self.local.stage = stage
+        self.ninja.job_stage(stage)
+
+    def _open_transfers_tab(self):
+        self.logger.debug("Trying to locate TAB Transferencias...")
+
+        navigation.switch_to_frame(self.web_driver, 'CORPO')
+        # Locate Transferencias TAB
         try:
-            if not login(self.ninja.config, self.web_driver):
-                self.ninja.confirm_job(job_data, status='err_itau_login', status_message='Unable to login',
-                                       admin_message='Failed to login on Itau.')
-                self.ninja.take_ss(self.web_driver)
-                return
+            tab_element = locators.find(self.web_driver, 'transfers_tab')
+            tab_element.click()
+        except TimeoutException:
+            self.logger.error('Unable to locate element: {}'.format(locators.describe('transfers_tab')))
+            return False
 
-            time.sleep(4)
+        return True
 
-            if not navigation.goto_screen(self.web_driver, 'transfer_bank'):
-                self.ninja.confirm_job(job_data, status='err_itau_navigation', status_message='Unable to navigate',
-                                       admin_message='Failed to navigate to <Transferencias> screen')
-                self.logger.critical("Unable to navigate on ITAU web page as expected. Aborting...")
-                self.ninja.take_ss(self.web_driver)
-                return
-
-            self.logger.debug("Trying to locate TAB Transferencias...")
-
-            navigation.switch_to_frame(self.web_driver, 'CORPO')
-            # Locate Transferencias TAB
-            try:
-                tab_xpath = '//td[contains(text(), "Transfer") and @class="TRNdado"]'
-                tab_element = self.web_driver.wait.until(EC.element_to_be_clickable((By.XPATH, tab_xpath)))
-                tab_element.click()
-            except TimeoutException:
-                self.logger.error('Unable to locate element: {}'.format(tab_xpath))
-                self.ninja.confirm_job(job_data, status='err_itau_navigation',
-                                       status_message='Unable find TAB <Transferencias>',
-                                       admin_message='Unable find TAB <Transferencias>')
-                self.ninja.take_ss(self.web_driver)
-                return
+    def _transfer(self, transfer_data):
+        """Run a single TED/TEF from <Transferencias> form.
 
-            # -----------------------------------------------
-            #  PROCESS TED/TEF/DOC
-            # -----------------------------------------------
-            op_code = operation_codes.OP_FAILED
+        :return: operation_codes result.
+        """
+        op_code = operation_codes.OP_FAILED
 
-            if job_data['account_type'] == 'CH':
-                if job_data['bank_id'] == "341":
-                    op_code = tef_ch.execute(self.web_driver, job_data)  # ITAU: TEF between checking accoun
-                else:
-                    op_code = ted_doc.execute(self.web_driver, job_data)  # TED
+        # Unknown customers are registered in the same session, when enabled
+        register_customer = self.ninja.config.get('auto_register_customer', False)
 
-            elif job_data['account_type'] == 'SV':
-                if job_data['bank_id'] == "341":
-                    op_code = operation_codes.OP_FAILED
-                else:
-                    op_code = operation_codes.OP_FAILED
+        if transfer_data['account_type'] == 'CH':
+            if transfer_data['bank_id'] == "341":
+                # ITAU: TEF between checking accoun
+                op_code = tef_ch.execute(self.web_driver, transfer_data, register_customer=register_customer)
+            else:
+                op_code = ted_doc.execute(self.web_driver, transfer_data, register_customer=register_customer)  # TED
 
-            if op_code == operation_codes.OP_SUCCESS:
-                self.ninja.confirm_job(job_data)
+        elif transfer_data['account_type'] == 'SV':
+            if transfer_data['bank_id'] == "341":
+                op_code = operation_codes.OP_FAILED
             else:
-                msg = "Operation Failed"
-                if op_code == operation_codes.OP_CUSTOMER_NOT_FOUND:
-                    msg += ": Customer not registered"
-                elif op_code == operation_codes.OP_TIMEOUT:
-                    msg += ": Timed out"
+                op_code = operation_codes.OP_FAILED
+
+        return op_code
+
+    @staticmethod
+    def _failure_message(op_code):
+        msg = "Operation Failed"
+        if op_code == operation_codes.OP_CUSTOMER_NOT_FOUND:
+            msg += ": Customer not registered"
+        elif op_code == operation_codes.OP_CUSTOMER_REGISTER_FAILED:
+            msg += ": Unable to register customer"
+        elif op_code == operation_codes.OP_TIMEOUT:
+            msg += ": Timed out"
+
+        return msg
+
+    def transfer_bank(self, job_data):
+        self._run(self._transfer_bank, job_data)
+
+    def _transfer_bank(self, job_data):
+        if not self._open_transfers(job_data):
+            return
+
+        # -----------------------------------------------
+        #  PROCESS TED/TEF/DOC
+        # -----------------------------------------------
+        op_code = self._transfer(job_data)
+
+        if op_code == operation_codes.OP_SUCCESS:
+            self.ninja.confirm_job(job_data)
+        elif op_code == operation_codes.OP_TIMEOUT:
+            # Operations only time out before the transfer is submitted, so it's safe to run them again.
+            self.ninja.take_ss(self.web_driver)
+            msg = self._failure_message(op_code)
+            self.ninja.retry_job(job_data, "err_operation_failed", status_message=msg, admin_message=msg)
+        else:
+            msg = self._failure_message(op_code)
+            self.ninja.confirm_job(job_data, "err_operation_failed", status_message=msg, admin_message=msg)
+            self.ninja.take_ss(self.web_driver)
+
+    def transfer_batch(self, job_data):
+        """Run several transfers (job_data['transfers']) within a single login/navigation.
 
-                self.ninja.confirm_job(job_data, "err_operation_failed", status_message=msg, admin_message=msg)
+        Each transfer gets its own status in the confirmation. Failed transfers aren't retried, since the batch as
+        a whole can't be run again without repeating the transfers that succeeded.
+        """
+        self._run(self._transfer_batch, job_data)
+
+    def _transfer_batch(self, job_data):
+        if not self._open_transfers(job_data):
+            return
+
+        transfers = job_data['transfers']
+        failed = 0
+
+        for index, transfer_data in enumerate(transfers):
+            # Back to <Transferencias> form, for every transfer but the first one.
+            if index > 0 and not self._open_transfers_tab():
                 self.ninja.take_ss(self.web_driver)
-        finally:
-            pass
-            # self.web_driver.quit()
-            # del self.web_driver
+                for pending in transfers[index:]:
+                    pending.update(status='err_itau_navigation', status_message='Unable find TAB <Transferencias>')
+                failed += len(transfers) - index
+                break
+
+            self.logger.info("Batch transfer {}/{}...".format(index + 1, len(transfers)))
+            op_code = self._transfer(transfer_data)
+
+            if op_code == operation_codes.OP_SUCCESS:
+                transfer_data['status'] = 'ok'
+            else:
+                failed += 1
+                transfer_data.update(status='err_operation_failed', status_message=self._failure_message(op_code))
+                self.ninja.take_ss(self.web_driver)
+
+        if not failed:
+            self.ninja.confirm_job(job_data)
+        else:
+            msg = "{} of {} transfers failed".format(failed, len(transfers))
+            self.ninja.confirm_job(job_data, "err_batch_failed", status_message=msg, admin_message=msg)
@@ -2,41 +2,38 @@ import logging
 
 import time
 
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver import ActionChains
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
 
-from itau import operation_codes, navigation
+from itau import operation_codes, navigation, beneficiary, locators
+from itau.driver_state import execute_navigation_script
 
 logger = logging.getLogger(__name__)
 
 
 def _locate_customer(driver, job_data):
     acc_full_name = job_data['fullname'][:30].strip()
-    small_wait = WebDriverWait(driver, 8)
 
     logger.info("Locating customer, name:{}".format(acc_full_name))
 
     # 1. First locate ITAU customer by using its nickname
     try:
-        search_box = driver.wait.until(EC.element_to_be_clickable((By.XPATH, '//input[@id="nome"]')))
+        search_box = locators.find(driver, 'ted_search')
         search_box.click()
         search_box.clear()
         search_box.send_keys(acc_full_name)
     except TimeoutException:
-        logger.critical('Unable to locate element: //input[@id="nome"]')
+        logger.critical('Unable to locate element: {}'.format(locators.describe('ted_search')))
         return operation_codes.OP_TIMEOUT
 
     logger.info("Search box found! submitting search...")
 
     # 2. Submit search
     try:
-        submit_btn = small_wait.until(EC.element_to_be_clickable((By.XPATH, '//a[contains(text(), "buscar")]')))
+        submit_btn = locators.find(driver, 'ted_search_submit', timeout=8)
         submit_btn.click()
     except TimeoutException:
-        logger.critical('Unable to locate submit button: //a[contains(text(), "buscar")]')
+        logger.critical('Unable to locate submit button: {}'.format(locators.describe('ted_search_submit')))
         return operation_codes.OP_TIMEOUT
 
     time.sleep(2)
@@ -44,11 +41,11 @@ def _locate_customer(driver, job_data):
     navigation.switch_to_frame(driver, 'CORPO')
 
     # 4. Select customer in table
-    select_xpath = '//td[contains(text(), "{}")]/..//a[contains(text(), "selecionar")]'.format(job_data['account'])
+    select_xpath = locators.describe('ted_customer_select', job_data['account'])
     logger.info("Search submitted, trying to locate customer in result table...")
     logger.info("Query xpath = {}".format(select_xpath))
     try:
-        customer = small_wait.until(EC.element_to_be_clickable((By.XPATH, select_xpath)))
+        customer = locators.find(driver, 'ted_customer_select', job_data['account'], timeout=8)
         customer.click()
     except TimeoutException:
         logger.info("Unable to select customer: {}".format(select_xpath))
@@ -68,8 +65,8 @@ def _locate_customer(driver, job_data):
     return operation_codes.OP_SUCCESS
 
 
-def _fill_input(wait, xpath, value):
-    element = wait.until(EC.element_to_be_clickable((By.XPATH, xpath)))
+def _fill_input(driver, locator_name, value):
+    element = locators.find(driver, locator_name, timeout=8)
     element.click()
     element.clear()
     element.send_keys(value)
@@ -80,16 +77,14 @@ def _register_ted(driver, job_data):
     navigation.switch_to_frame(driver, "CORPO")
     time.sleep(1)
 
-    small_wait = WebDriverWait(driver, 8)
-
     logger.info("Filling in TED form...")
     try:
         # TEF amount
-        _fill_input(small_wait, '//input[@id="dia"]', job_data['day'])
-        _fill_input(small_wait, '//input[@id="mes"]', job_data['month'])
-        _fill_input(small_wait, '//input[@id="ano"]', job_data['year'])
+        _fill_input(driver, 'ted_day', job_data['day'])
+        _fill_input(driver, 'ted_month', job_data['month'])
+        _fill_input(driver, 'ted_year', job_data['year'])
 
-        _fill_input(small_wait, '//input[@name="valor" and @size="16"]', job_data['amount'])
+        _fill_input(driver, 'amount', job_data['amount'])
 
     except TimeoutException as ex:
         logger.critical('Timeout when filling in form: {}'.format(str(ex)))
@@ -99,20 +94,20 @@ def _register_ted(driver, job_data):
     if job_data['account_type'] == 'CH':
         try:
             # Operation code: Credit on account
-            credit_op_xpath = '//select[@id="Finalidade"]/option[@value="9"]'
-            op_element = driver.find_element(By.XPATH, credit_op_xpath)
+            op_element = locators.find(driver, 'ted_purpose_credit', condition='present', timeout=0)
             op_element.click()
-        except NoSuchElementException:
-            logger.critical("Unable to select operation code element : {}".format(credit_op_xpath))
+        except TimeoutException:
+            logger.critical("Unable to select operation code element : {}".format(
+                locators.describe('ted_purpose_credit')))
             return operation_codes.OP_FAILED
 
     # navigation.switch_to_frame(driver, "CORPO")
 
     logger.info("Locating submit button...")
-    submit_xtag = '//input[@name="Incluir" and @type="button"]'
+    submit_xtag = locators.describe('include_submit')
 
     try:
-        submit_btn = small_wait.until(EC.element_to_be_clickable((By.XPATH, submit_xtag)))
+        submit_btn = locators.find(driver, 'include_submit', timeout=8)
         hover = ActionChains(driver).move_to_element(submit_btn)
         hover.perform()
         logger.info("Submitting TED...")
@@ -126,9 +121,8 @@ def _register_ted(driver, job_data):
     time.sleep(3)
 
     logger.info("TED submitted, checking if operation was approved...")
-    success_xpath = '//*[contains(text(), "sucesso")]'
     try:
-        small_wait.until(EC.visibility_of_element_located((By.XPATH, success_xpath)))
+        locators.find(driver, 'success_message', condition='visible', timeout=8, floor=True)
     except TimeoutException as ex:
         logger.critical("Unable to find operation approval status!")
         return operation_codes.OP_FAILED
@@ -138,19 +132,44 @@ def _register_ted(driver, job_data):
     return operation_codes.OP_SUCCESS
 
 
-def execute(driver, job_data):
-    logger.info("TED operation, starting...")
+def _customer_missing(driver):
+    try:
+        locators.find(driver, 'ted_customer_missing', condition='visible', timeout=0)
+    except TimeoutException:
+        return False
 
+    return True
+
+
+def _open_operation(driver, job_data):
     # This is the same as clicking on the TEF radio button and clicking on submit.
     if job_data['account_type'] == 'CH':
-        driver.execute_script("passaParam('41','','', '34')")
+        execute_navigation_script(driver, "passaParam('41','','', '34')")
     else:
-        driver.execute_script("passaParam('03','','', '32')")
+        execute_navigation_script(driver, "passaParam('03','','', '32')")
 
     time.sleep(2)
 
     # Lookup customer
-    op_code = _locate_customer(driver, job_data)
+    return _locate_customer(driver, job_data)
+
+
+def execute(driver, job_data, register_customer=False):
+    logger.info("TED operation, starting...")
+
+    op_code = _open_operation(driver, job_data)
+
+    # Unknown customer: register it in this same session and resume the operation.
+    if op_code == operation_codes.OP_CUSTOMER_NOT_FOUND and register_customer:
+        # Any customer which couldn't be selected is reported not found: only register the ones the bank says are
+        if not _customer_missing(driver):
+            logger.critical("Customer neither found nor reported missing, not registering it!")
+            return operation_codes.OP_TIMEOUT
+
+        op_code = beneficiary.register_ted(driver, job_data)
+        if op_code == operation_codes.OP_SUCCESS:
+            op_code = _open_operation(driver, job_data)
+
     if op_code != operation_codes.OP_SUCCESS:
         return op_code
 
@@ -0,0 +1,112 @@
+""" Adaptive per-step timeouts
+
+    Instead of fixed guesses, the timeout of each step (a locator name, or e.g. 'sms_token') is derived from the
+    latencies observed for it: a percentile of the last `window` samples times a safety factor, clamped to
+    [min_timeout, max_timeout]. Until a step has MIN_SAMPLES samples, the caller's default timeout is used.
+
+    Steps which time out are recorded too, as censored samples: the step took longer than the timeout it was given,
+    kept as -timeout. They're ordered by that timeout, and a censored sample at the percentile backs the timeout off
+    to its timeout times the safety factor, so timeouts grow back when a step gets slower.
+
+    Samples are persisted to a JSON file, so learned timeouts survive restarts.
+"""
+import json
+import logging
+import math
+from collections import deque
+from os.path import isfile
+from threading import Lock
+
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveTimeouts:
+
+    # Samples a step needs before its timeout is derived from them
+    MIN_SAMPLES = 20
+
+    def __init__(self, path, factor=2.0, min_timeout=2, max_timeout=60, window=200, percentile=99):
+        self.path = path
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.window = window
+        self.percentile = percentile
+        self.samples = {}       # step -> deque of latencies (seconds)
+        self.dirty = False
+        self.mutex = Lock()
+
+        self._load()
+
+    def configure(self, factor, min_timeout, max_timeout, window):
+        """Change how timeouts are derived, keeping the latencies observed so far."""
+        with self.mutex:
+            self.factor = factor
+            self.min_timeout = min_timeout
+            self.max_timeout = max_timeout
+
+            if window != self.window:
+                self.window = window
+                for step, samples in self.samples.items():
+                    self.samples[step] = deque(samples, maxlen=window)
+
+    def timeout(self, step, default):
+        """Timeout (seconds) to be used by a step.
+
+        :param default: Timeout used while not enough latencies of the step were observed.
+        """
+        with self.mutex:
+            samples = self.samples.get(step)
+            if samples is None or len(samples) < AdaptiveTimeouts.MIN_SAMPLES:
+                return default
+
+            ordered = sorted(samples, key=abs)
+
+        rank = max(0, math.ceil(len(ordered) * self.percentile / 100.0) - 1)
+        return min(self.max_timeout, max(self.min_timeout, abs(ordered[rank]) * self.factor))
+
+    def record(self, step, elapsed):
+        """Record how long (seconds) a step took to succeed."""
+        self._append(step, round(elapsed, 3))
+
+    def record_timeout(self, step, timeout):
+        """Record that a step didn't succeed within `timeout` seconds (censored sample)."""
+        self._append(step, -round(timeout, 3))
+
+    def _append(self, step, sample):
+        with self.mutex:
+            samples = self.samples.get(step)
+            if samples is None:
+                samples = self.samples[step] = deque(maxlen=self.window)
+
+            samples.append(sample)
+            self.dirty = True
+
+    def save(self):
+        with self.mutex:
+            if not self.dirty:
+                return
+
+            data = json.dumps({step: list(samples) for step, samples in self.samples.items()})
+            self.dirty = False
+
+        if not atomic_write(data, self.path):
+            logger.error("Failed to save observed step latencies: {}".format(self.path))
+
+    def _load(self):
+        if not isfile(self.path):
+            return
+
+        try:
+            with open(self.path) as timeouts_file:
+                saved = json.load(timeouts_file)
+        except (IOError, ValueError) as err:
+            logger.warning("Ignoring observed step latencies {}: {}".format(self.path, str(err)))
+            return
+
+        for step, samples in saved.items():
+            self.samples[step] = deque(samples, maxlen=self.window)
+
+        logger.info("Loaded observed latencies of {} steps from {}".format(len(self.samples), self.path))
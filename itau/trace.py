@@ -0,0 +1,417 @@
+""" WebDriver command traces: record and replay
+
+    Opt-in (config: trace_jobs, or "trace": true in a job file): every command a job sends to the browser is recorded
+    to <trace_folder>/<job name>-<timestamp>.trace, along with its response, its latency and, when it fails, the DOM
+    of the page (frame) it failed on. Commands are recorded at the browser connection, below the driver state caches,
+    so traces hold what was actually sent (tab switches included).
+
+    Traces hold whatever is typed during login (PIN, SMS token) and the session cookies, so they're only written
+    encrypted (Fernet, like persisted sessions): with config: trace_key, or config: session_key. Each line of a trace
+    file is an encrypted JSON entry, the first one being the trace header.
+
+    A trace can be replayed offline through TaskHandler itself (login, goto_screen, tef_ch/ted_doc, ...): recorded
+    responses are handed back to matching commands, on a virtual clock advanced by recorded latencies and by sleeps.
+    It tells how a code change affects the number of commands and the time a job takes, without the bank. Offline,
+    the SMS token is always there right away and sessions are never restored from session_file:
+
+        python -m itau.trace show TRACE_FILE
+        python -m itau.trace replay TRACE_FILE [--config config.json]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, deque
+from os.path import join, isdir, dirname, abspath
+from threading import local
+
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+from selenium.webdriver.remote.mobile import Mobile
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.remote.webdriver import WebDriver
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE_EXT = '.trace'
+
+DOM_SCRIPT = 'return document.documentElement.outerHTML;'
+
+# Command params which don't tell commands apart when matched against a trace: typed text may differ offline
+IGNORED_PARAMS = {
+    Command.SEND_KEYS_TO_ELEMENT: ('text', 'value'),
+    Command.SEND_KEYS_TO_ACTIVE_ELEMENT: ('text', 'value'),
+}
+
+FIND_COMMANDS = {Command.FIND_ELEMENT, Command.FIND_ELEMENTS, Command.FIND_CHILD_ELEMENT,
+                 Command.FIND_CHILD_ELEMENTS}
+
+
+def _key(driver_command, params):
+    params = {name: value for name, value in (params or {}).items()
+              if name != 'sessionId' and name not in IGNORED_PARAMS.get(driver_command, ())}
+    return driver_command, json.dumps(params, sort_keys=True)
+
+
+def _error(response):
+    """WebDriver error of a response (e.g. 'no such element'), None if the command succeeded."""
+    if not isinstance(response, dict) or response.get('status') in (None, 0):
+        return None
+
+    # Failed commands get the raw JSON body of the response as value
+    value = response.get('value')
+    try:
+        value = json.loads(value) if isinstance(value, str) else value
+        return value['value']['error'] if 'value' in value else value['error']
+    except (ValueError, TypeError, KeyError):
+        return 'unknown error'
+
+
+def _response_error(status, error):
+    return {'status': status, 'value': json.dumps({'value': {'error': error, 'message': 'Not in trace'}})}
+
+
+class Tracer:
+
+    def __init__(self, trace_folder, key):
+        self.trace_folder = trace_folder
+        self.fernet = Fernet(key)
+        self.local = local()        # Trace of the job run by each thread
+
+    def configure(self, trace_folder, key):
+        """Change where (and with which key) traces started from now on are written."""
+        self.trace_folder = trace_folder
+        self.fernet = Fernet(key)
+
+    def attach(self, driver):
+        """Record the commands sent by a new browser (and by all of its tabs)."""
+        connection = driver.command_executor
+        connection.execute = functools.partial(self._execute, connection.execute)
+
+    def start(self, job_name, job_data, logged_in):
+        """Start recording the job run by the calling thread."""
+        if not isdir(self.trace_folder):
+            os.makedirs(self.trace_folder, exist_ok=True)
+
+        path = join(self.trace_folder, '{}-{}{}'.format(job_name, time.strftime('%Y%m%d%H%M%S'), TRACE_FILE_EXT))
+        try:
+            trace_file = open(path, 'w')
+        except IOError as err:
+            logger.error("Unable to record trace {}: {}".format(path, str(err)))
+            return
+
+        self.local.trace = trace_file
+        self.local.started = time.time()
+        self.local.last = None
+        self._write({'job': job_name, 'operation': job_data.get('operation'), 'job_data': job_data,
+                     'logged_in': logged_in, 'started': self.local.started})
+
+    def stop(self):
+        trace_file = getattr(self.local, 'trace', None)
+        if trace_file is None:
+            return
+
+        self.local.trace = None
+        trace_file.close()
+        logger.info("Trace recorded: {}".format(trace_file.name))
+
+    def _write(self, entry):
+        self.local.trace.write(self.fernet.encrypt(json.dumps(entry, separators=(',', ':')).encode()).decode())
+        self.local.trace.write('\n')
+        self.local.trace.flush()
+
+    def _execute(self, execute, driver_command, params):
+        if getattr(self.local, 'trace', None) is None:
+            return execute(driver_command, params)
+
+        entry = {'t': round(time.time() - self.local.started, 4), 'command': driver_command, 'params': params}
+        started = time.time()
+        try:
+            response = execute(driver_command, params)
+        except Exception as err:
+            entry.update(latency=round(time.time() - started, 4), raised=str(err))
+            self._write(entry)
+            raise
+
+        entry.update(latency=round(time.time() - started, 4), response=response)
+
+        # DOM is captured once per run of failures of a command (e.g. lookups polled until they time out)
+        key = _key(driver_command, params)
+        failed = _error(response) is not None
+        if failed and self.local.last != key:
+            dom = execute(Command.W3C_EXECUTE_SCRIPT, {'script': DOM_SCRIPT, 'args': [],
+                                                       'sessionId': (params or {}).get('sessionId')})
+            if _error(dom) is None:
+                entry['dom'] = dom.get('value')
+
+        self.local.last = key if failed else None
+        self._write(entry)
+        return response
+
+
+def load(path, key):
+    """Read a trace file.
+
+    :return: (header, entries)
+    """
+    fernet = Fernet(key)
+    with open(path) as trace_file:
+        entries = [json.loads(fernet.decrypt(line.strip().encode()).decode()) for line in trace_file if line.strip()]
+
+    return entries[0], entries[1:]
+
+
+class VirtualClock:
+    """Replaces time.time() and time.sleep() while replaying: sleeps and recorded latencies advance the clock."""
+
+    def __init__(self):
+        self.now = time.time()
+        self.started = self.now
+        self.slept = 0.0
+
+    def sleep(self, seconds):
+        self.slept += max(0.0, seconds)
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += max(0.0, seconds)
+
+    def __enter__(self):
+        self._time, self._sleep = time.time, time.sleep
+        time.time, time.sleep = lambda: self.now, self.sleep
+        return self
+
+    def __exit__(self, *exc_info):
+        time.time, time.sleep = self._time, self._sleep
+
+
+class ReplayConnection:
+    """Stands for the browser connection: commands get the recorded responses of matching commands, in order.
+
+    Once the responses recorded for a command are used up, the last one is repeated (page didn't change). Commands
+    never recorded are unmatched: lookups find nothing, anything else fails.
+    """
+
+    def __init__(self, entries, clock):
+        self.clock = clock
+        self.recorded = {}          # command key -> deque of (response, latency)
+        for entry in entries:
+            if 'response' in entry:
+                self.recorded.setdefault(_key(entry['command'], entry['params']), deque()).append(
+                    (entry['response'], entry['latency']))
+
+        self.commands = Counter()   # Commands replayed, by command name
+        self.unmatched = Counter()  # Commands missing from the trace, by command name
+        self.missing = set()        # Keys of the commands missing from the trace
+        self.latency = 0.0          # Recorded latency of the commands replayed
+
+    def execute(self, driver_command, params):
+        self.commands[driver_command] += 1
+
+        key = _key(driver_command, params)
+        responses = self.recorded.get(key)
+        if not responses:
+            if key not in self.missing:
+                logger.warning("Command not in trace: {} {}".format(*key))
+                self.missing.add(key)
+
+            self.unmatched[driver_command] += 1
+
+            if driver_command in (Command.FIND_ELEMENTS, Command.FIND_CHILD_ELEMENTS):
+                return {'value': []}
+            if driver_command in FIND_COMMANDS:
+                return _response_error(404, 'no such element')
+            return _response_error(500, 'unknown error')
+
+        response, latency = responses.popleft() if len(responses) > 1 else responses[0]
+        self.latency += latency
+        self.clock.advance(latency)
+
+        return json.loads(json.dumps(response))
+
+
+class ReplayNinja:
+    """What TaskHandler needs from Ninja, job outcome is recorded instead of confirmed."""
+
+    class Job:
+        def __init__(self, name):
+            self.name = name
+            self.path = None
+
+    def __init__(self, config, app_root_dir, job_name):
+        self.config = config
+        self.app_root_dir = app_root_dir
+        self.local = local()
+        self.local.job = ReplayNinja.Job(job_name)
+        self.outcome = None
+
+    def confirm_job(self, job_data, status='ok', status_message='', admin_message=''):
+        self.outcome = ('confirmed', status, status_message)
+
+    def retry_job(self, job_data, status, status_message='', admin_message='', site_failure=False):
+        self.outcome = ('retried', status, status_message)
+        return True
+
+    def job_stage(self, stage):
+        pass
+
+    def take_ss(self, driver):
+        driver.get_screenshot_as_png()
+
+
+def replay(path, config, app_root_dir):
+    """Replay a trace through TaskHandler.
+
+    :return: dict report.
+    """
+    # Imported here, task_handler imports this module
+    from itau import token_watcher
+    from itau.task_handler import TaskHandler
+    from itau.timeouts import AdaptiveTimeouts
+    from itau.driver_state import DriverState
+
+    header, entries = load(path, config.get('trace_key') or config['session_key'])
+
+    # Replay runs a single job in a single tab, with no persisted session nor SMS token to wait for
+    config = dict(config, browser_tabs=1, browser_prelaunch=False, trace_jobs=False)
+    config.pop('session_key', None)
+
+    clock = VirtualClock()
+    connection = ReplayConnection(entries, clock)
+    ninja = ReplayNinja(config, app_root_dir, header['job'])
+
+    class ReplayHandler(TaskHandler):
+
+        def init_driver(self):
+            driver = WebDriver.__new__(WebDriver)
+            driver.command_executor = connection
+            driver.session_id = 'replay'
+            driver.capabilities = {}
+            driver.w3c = True   # geckodriver speaks W3C WebDriver
+            driver.error_handler = ErrorHandler()
+            driver._is_remote = False
+            driver._switch_to = SwitchTo(driver)
+            driver._mobile = Mobile(driver)
+
+            driver.state = DriverState(driver)
+            driver.timeouts = self.timeouts
+            self.browser = driver
+            self.logged_in = header['logged_in']
+            self.aborted = False
+
+        def release_driver(self, kill=False):
+            self.browser = None
+            self.logged_in = False
+
+        def _ensure_driver(self):
+            if self.browser is None:
+                self.init_driver()
+
+        def _job_done(self):
+            pass
+
+    handler = ReplayHandler(ninja=ninja)
+    # Learned timeouts are used as they are, never saved
+    handler.timeouts = AdaptiveTimeouts(config.get('timeouts_file', join(app_root_dir, TaskHandler.TIMEOUTS_FILE)))
+
+    read_token, clear_token = token_watcher.read_token, token_watcher.clear_token
+    token_watcher.read_token = lambda token_path, timeout=10: '000000'
+    token_watcher.clear_token = lambda token_path: None
+    try:
+        with clock:
+            started = time.process_time()
+            getattr(handler, header['operation'])(dict(header['job_data'], trace=False))
+            cpu = time.process_time() - started
+    finally:
+        token_watcher.read_token, token_watcher.clear_token = read_token, clear_token
+
+    recorded = Counter(entry['command'] for entry in entries)
+    last = entries[-1] if entries else {'t': 0, 'latency': 0}
+
+    return {
+        'job': header['job'],
+        'operation': header['operation'],
+        'outcome': ninja.outcome,
+        'recorded_commands': sum(recorded.values()),
+        'recorded_time': last['t'] + last['latency'],
+        'recorded_webdriver': sum(entry['latency'] for entry in entries),
+        'replayed_commands': sum(connection.commands.values()),
+        'unmatched_commands': sum(connection.unmatched.values()),
+        'replayed_time': clock.now - clock.started + cpu,
+        'replayed_webdriver': connection.latency,
+        'replayed_sleep': clock.slept,
+        'replayed_cpu': cpu,
+        'commands': {command: (recorded[command], connection.commands[command], connection.unmatched[command])
+                     for command in sorted(set(recorded) | set(connection.commands))}
+    }
+
+
+def show(path, key):
+    header, entries = load(path, key)
+    print("Job {} ({}), started {}, {} commands".format(header['job'], header['operation'],
+                                                         time.ctime(header['started']), len(entries)))
+
+    for entry in entries:
+        params = {name: value for name, value in (entry['params'] or {}).items() if name != 'sessionId'}
+        if 'raised' in entry:
+            result = 'RAISED {}'.format(entry['raised'])
+        elif _error(entry['response']) is not None:
+            result = 'ERROR {}'.format(_error(entry['response']))
+        else:
+            result = 'ok'
+
+        print("{:>9.3f}s {:>7.0f}ms  {:<24} {:<60} {}{}".format(
+            entry['t'], entry['latency'] * 1000, entry['command'], json.dumps(params)[:60], result,
+            '  [DOM {} chars]'.format(len(entry['dom'])) if entry.get('dom') else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or replay a recorded WebDriver command trace")
+    parser.add_argument('action', choices=('show', 'replay'))
+    parser.add_argument('trace', help="Trace file")
+    parser.add_argument('--config', default='config.json', help="Ninja configuration file (trace key, credentials)")
+    args = parser.parse_args()
+
+    if Fernet is None:
+        print("Python package 'cryptography' is required to read traces.")
+        sys.exit(1)
+
+    with open(args.config) as cfg_file:
+        config = json.load(cfg_file)
+
+    key = config.get('trace_key') or config.get('session_key')
+    if not key:
+        print("No trace key configured (trace_key or session_key).")
+        sys.exit(1)
+
+    if args.action == 'show':
+        show(args.trace, key)
+        return
+
+    logging.basicConfig(level=os.environ.get('LOGLEVEL', 'WARNING'))
+    report = replay(args.trace, config, dirname(abspath(args.config)))
+
+    print("Job {} ({}): {}".format(report['job'], report['operation'], report['outcome']))
+    print("Recorded: {:>5} commands  {:>8.2f}s  (webdriver {:.2f}s)".format(
+        report['recorded_commands'], report['recorded_time'], report['recorded_webdriver']))
+    print("Replayed: {:>5} commands  {:>8.2f}s  (webdriver {:.2f}s, sleep {:.2f}s, cpu {:.2f}s), {} not in trace".format(
+        report['replayed_commands'], report['replayed_time'], report['replayed_webdriver'], report['replayed_sleep'],
+        report['replayed_cpu'], report['unmatched_commands']))
+
+    print("\n{:<28} {:>9} {:>9} {:>9}".format('command', 'recorded', 'replayed', 'unmatched'))
+    for command, (recorded, replayed, unmatched) in report['commands'].items():
+        print("{:<28} {:>9} {:>9} {:>9}".format(command, recorded, replayed, unmatched))
+
+    sys.exit(1 if report['unmatched_commands'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import sys
+import time
+from os.path import basename, dirname, join
+
+
+class Job:
+    """A job going through Ninja's pipeline.
+
+    Created by the intake stage, which loads and validates the job file, then handed over to the execution stage.
+    Jobs received through a stream transport (see transports) have no job file: their raw payload is kept instead,
+    and their confirmation is sent back through the channel they came from.
+
+    Backlogs may hold hundreds of thousands of jobs, so a job is a compact record (__slots__, jobs folder shared
+    among jobs): its decoded data can be dropped once validated (unload()) and it's loaded back when it's needed.
+    """
+
+    __slots__ = ('name', 'folder', 'file_name', 'raw', 'channel', 'operation', 'digest', '_data',
+                 'queued_at', 'ready_at', 'started_at', 'confirmed_at')
+
+    def __init__(self, name, path=None, raw=None, channel=None):
+        self.name = name        # Identifies the job (retries, persisted queue): job file name or transport sequence
+        self.raw = raw          # Raw job payload (bytes) of stream jobs
+        self.channel = channel  # Where stream jobs' confirmations are sent to (transports.Channel)
+        self.operation = None   # Job operation, once validated (kept while job data is unloaded)
+        self.digest = None      # Digest of the job payload last loaded, the one validated once job is validated
+        self._data = None
+
+        # Job file absolute path, as its folder (one string shared by all jobs) and its file name (usually the name)
+        self.folder = sys.intern(dirname(path)) if path is not None else None
+        self.file_name = None
+        if path is not None:
+            self.file_name = name if basename(path) == name else basename(path)
+
+        # When the job went through each stage (time.time()), e.g. for sinks.TimingsSink
+        self.queued_at = time.time()  # Queued for intake
+        self.ready_at = None          # Validated, queued for execution
+        self.started_at = None        # Handed to the module handler
+        self.confirmed_at = None      # Confirmation handed to the confirmation stage
+
+    @property
+    def path(self):
+        """Job file absolute path, None for stream jobs."""
+        return join(self.folder, self.file_name) if self.folder is not None else None
+
+    @property
+    def data(self):
+        """Decoded job data, once validated by the intake stage. Loaded back if it was unloaded.
+
+        :raise IOError: Job file can't be read anymore.
+        :raise ValueError: Job file isn't the job that was validated anymore.
+        """
+        if self._data is None and self.operation is not None:
+            payload = self.read()
+            if self._digest(payload) != self.digest:
+                raise ValueError("job changed since it was validated")
+            self._data = json.loads(payload)
+
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.operation = sys.intern(data['operation']) if data is not None else None
+
+    def load(self):
+        """Decode the job file, or the raw payload of stream jobs, keeping its digest.
+
+        :raise IOError: Job file can't be read.
+        :raise ValueError: Job isn't valid json.
+        """
+        payload = self.read()
+        self.digest = self._digest(payload)
+        return json.loads(payload)
+
+    def read(self):
+        """Raw job payload (bytes): job file contents, or the raw payload of stream jobs.
+
+        :raise IOError: Job file can't be read.
+        """
+        if self.folder is None:
+            return self.raw
+
+        with open(self.path, 'rb') as job_fp:
+            return job_fp.read()
+
+    @staticmethod
+    def _digest(payload):
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def unload(self):
+        """Drop decoded job data, keeping what the job was validated for (see data)."""
+        self._data = None
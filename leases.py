@@ -0,0 +1,235 @@
+""" Job leases
+
+    Lets several Ninja nodes (hosts, or processes) share one jobs folder, each job being run by exactly one of them.
+
+    A node claims a job by creating <job file><LEASE_FILE_EXT> with O_EXCL, only one node can succeed. While the node
+    holds the lease it keeps touching it (heartbeat). Once the job is confirmed the lease is marked as done and left in
+    place (it's archived along with the job), so no other node can claim it anymore.
+
+    Leases whose heartbeat stopped for more than `ttl` seconds belong to crashed (or stopped) nodes: any node's reaper
+    breaks them, by renaming them aside (only one reaper wins the rename), and hands their jobs back to its node
+    along with the stage they were in (see mark()): jobs which may have been submitted already mustn't be run again.
+    The node that broke a lease claims its job like any new job.
+
+    Lease file content: "<node id> <pid> [<stage>]", or "done" once the job is confirmed. Node ids must be unique per
+    node and stable across restarts (see adopt()).
+"""
+import logging
+import os
+import time
+import uuid
+from os.path import join, isfile
+from threading import Thread, Event, Lock
+
+LEASE_FILE_EXT = '.lease'
+DONE = 'done'
+
+
+class LeaseManager(Thread):
+
+    def __init__(self, jobs_folder, node_id, reclaim, ttl=120, heartbeat=20):
+        super().__init__(name='LeaseManager', daemon=True)
+        self.logger = logging.getLogger('LeaseManager')
+        self.jobs_folder = jobs_folder
+        self.node_id = node_id
+        self.owner = '{} {}'.format(node_id, os.getpid())
+        self.reclaim = reclaim      # Callable receiving (job name, stage) of each job whose stale lease was broken
+        self.ttl = ttl              # Seconds without heartbeat after which a lease is considered abandoned
+        self.heartbeat = heartbeat  # Seconds between heartbeats (and reaper scans)
+        self.held = set()           # Names of the jobs whose lease is held by this node
+        self.mutex = Lock()
+        self.stopped = Event()
+
+    def _lease_path(self, job_name):
+        return join(self.jobs_folder, job_name + LEASE_FILE_EXT)
+
+    def claim(self, job_name):
+        """Claim a job, before it's loaded.
+
+        :return: bool True if this node holds the job's lease (now or already), False if another node does or the
+                 job is already done.
+        """
+        with self.mutex:
+            if job_name in self.held:
+                return True
+
+            lease_path = self._lease_path(job_name)
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                return False
+
+            try:
+                os.write(fd, self.owner.encode())
+            finally:
+                os.close(fd)
+
+            # Job may have been archived already (along with its lease) by the time a lagging node claims it
+            if not isfile(join(self.jobs_folder, job_name)):
+                os.unlink(lease_path)
+                return False
+
+            self.held.add(job_name)
+            return True
+
+    def adopt(self, job_name):
+        """Take over a lease this node held before a restart (jobs restored from this node's persisted queue only).
+
+        The lease is left in place, it's only touched: it can't be claimed by anyone while it's there, and a reaper
+        which is breaking it right now puts it back once it sees the fresh heartbeat.
+
+        :return: bool True if the lease is held by this node now, False if another node took the job meanwhile.
+        """
+        with self.mutex:
+            if job_name in self.held:
+                return True
+
+            lease_path = self._lease_path(job_name)
+            owner = self._read(lease_path)
+            if owner is None or owner == DONE or owner.split(' ')[0] != self.node_id:
+                return False
+
+            try:
+                os.utime(lease_path)
+            except FileNotFoundError:
+                return False
+
+            # Lease broken (and claimed by another node) before it was touched
+            if self._read(lease_path) != owner:
+                return False
+
+            self.held.add(job_name)
+            return True
+
+    def acquire(self, job_name, restored=False):
+        """Claim a job or, if it was restored from this node's persisted queue, adopt its lease.
+
+        :return: bool True if this node holds the job's lease.
+        """
+        return self.claim(job_name) or (restored and self.adopt(job_name))
+
+    def mark(self, job_name, stage):
+        """Record the stage a held job is in, e.g. 'operation' once it may have been submitted."""
+        with self.mutex:
+            if job_name in self.held:
+                self._write(job_name, '{} {}'.format(self.owner, stage) if stage else self.owner)
+
+    def release(self, job_name):
+        """Mark the job as done: its lease stays in place, so it can't be claimed again."""
+        with self.mutex:
+            if job_name not in self.held:
+                return
+
+            self.held.discard(job_name)
+            self._write(job_name, DONE)
+
+    def _write(self, job_name, content):
+        # Written next to the lease then renamed over it: jobs folder may not share a filesystem with /tmp
+        lease_path = self._lease_path(job_name)
+        tmp_path = '{}.{}'.format(lease_path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'w') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, lease_path)
+        except OSError as err:
+            self.logger.critical("Failed to write lease of job {}: {}".format(job_name, str(err)))
+
+    def run(self):
+        while not self.stopped.wait(self.heartbeat):
+            self._beat()
+
+            try:
+                self._reap()
+            except OSError as err:
+                self.logger.error("Failed to scan leases: {}".format(str(err)))
+
+    def stop(self):
+        """Stop heartbeats: held leases expire after `ttl` unless this node adopts them back after a restart."""
+        self.stopped.set()
+        self.join()
+
+    def _beat(self):
+        with self.mutex:
+            held = list(self.held)
+
+        for job_name in held:
+            try:
+                os.utime(self._lease_path(job_name))
+            except FileNotFoundError:
+                with self.mutex:
+                    if job_name in self.held:
+                        self.logger.critical("Lease of job {} was broken by another node while held!".format(job_name))
+                        self.held.discard(job_name)
+
+    def _reap(self):
+        expired = time.time() - self.ttl
+
+        stale = []
+        with os.scandir(self.jobs_folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(LEASE_FILE_EXT):
+                    continue
+
+                try:
+                    if entry.stat().st_mtime < expired:
+                        stale.append(entry.name[:-len(LEASE_FILE_EXT)])
+                except FileNotFoundError:
+                    pass    # Being broken by another node right now
+
+        for job_name in stale:
+            with self.mutex:
+                lease_path = self._lease_path(job_name)
+
+                # Done leases never change again, they're left alone
+                if job_name in self.held or self._read(lease_path) in (None, DONE):
+                    continue
+
+                aside_path = self._set_aside(lease_path)
+                if aside_path is None:
+                    continue
+
+                owner = self._read(aside_path)
+
+                # Heartbeat (or completion) came in right before the rename: put it back
+                if owner == DONE or os.stat(aside_path).st_mtime >= expired:
+                    self._put_back(aside_path, lease_path)
+                    continue
+
+                os.unlink(aside_path)
+
+            stage = owner.split(' ')[2] if owner and owner.count(' ') >= 2 else ''
+            self.logger.warning("Broke stale lease of job {} (held by {}), reclaiming it...".format(job_name, owner))
+            self.reclaim(job_name, stage)
+
+    def _set_aside(self, lease_path):
+        """Atomically take a lease file out of the way, only one node can succeed.
+
+        :return: Path it was renamed to, None if it no longer exists.
+        """
+        aside_path = '{}.{}'.format(lease_path, uuid.uuid4().hex)
+        try:
+            os.rename(lease_path, aside_path)
+        except FileNotFoundError:
+            return None
+
+        return aside_path
+
+    def _put_back(self, aside_path, lease_path):
+        """Undo _set_aside(), unless someone claimed the job while its lease was out of the way."""
+        try:
+            os.link(aside_path, lease_path)
+        except FileExistsError:
+            self.logger.critical("Job {} was claimed while its lease was set aside!".format(lease_path))
+            return False
+        finally:
+            os.unlink(aside_path)
+
+        return True
+
+    @staticmethod
+    def _read(lease_path):
+        try:
+            with open(lease_path) as lease_file:
+                return lease_file.read().strip()
+        except IOError:
+            return None
@@ -1,21 +1,33 @@
 import importlib.util
+import itertools
 import json
 import logging
 import logging.handlers
 import os
+import signal
+import socket
 import sys
 import time
 import traceback
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from json.decoder import JSONDecodeError
 from os.path import join, abspath, realpath, basename, isdir, isfile, dirname
-from threading import Lock
+from queue import Queue
+from threading import Condition, Thread, Timer, local
 
-import shutil
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
 
+from archiver import Archiver
+from job import Job
+from leases import LeaseManager
+from profiler import JobProfiler
+from ratelimit import RateLimiter
+from scheduler import RetryScheduler, CircuitBreaker
+import sinks
+from transports import SocketIntake, SpoolIntake
 from utils import atomic_write
 
 
@@ -33,28 +45,106 @@ class Ninja:
     # Required configuration parameters, shared among all modules (set in CONFIG_FILE).
     REQUIRED_CFG_PARAMS = ('firefox_binary', 'firefox_profile', 'firefox_port', 'jobs_folder')
 
+    # Configuration parameters bound to resources set up at start-up: changing them requires a restart.
+    RESTART_CFG_PARAMS = ('module', 'jobs_folder', 'confirm_sinks', 'intake_socket', 'intake_spool', 'archive_folder',
+                          'archive_age', 'archive_interval', 'job_leases', 'node_id', 'lease_ttl', 'lease_heartbeat')
+
+    # Seconds CONFIG_FILE must be left untouched before a change is reloaded (editors write it in several steps)
+    CONFIG_RELOAD_DELAY = 1
+
     # Default module name on which Ninja will forward tasks
     MODULE_HANDLER_NAME = 'task_handler'
 
     # Default job confirmation file extension
     CONFIRM_FILE_EXT = ".confirm"
 
+    # Default confirmation sinks (config: confirm_sinks), see sinks.create()
+    CONFIRM_SINKS = [{"type": "file"}]
+
+    # Default retry policy for transient failures (config: retry_max_attempts, retry_base_delay, retry_max_delay)
+    RETRY_MAX_ATTEMPTS = 3
+    RETRY_BASE_DELAY = 30
+    RETRY_MAX_DELAY = 600
+
+    # Default circuit breaker settings (config: breaker_failure_threshold, breaker_probe_interval)
+    BREAKER_FAILURE_THRESHOLD = 3
+    BREAKER_PROBE_INTERVAL = 120
+
+    # Default wall-clock deadline of a single job, in seconds (config: job_deadline, 0 disables it). Modules may
+    # extend it for jobs doing more work (TaskHandler.job_deadline(job_data, deadline)), e.g. batches.
+    JOB_DEADLINE = 900
+
+    # Default file where pending jobs are persisted on shutdown (config: queue_state_file)
+    QUEUE_STATE_FILE = 'queue_state.json'
+
+    # Default seconds the running job is given to finish once shutdown is requested (config: shutdown_grace)
+    SHUTDOWN_GRACE = 60
+
+    # Default archiving of completed jobs (config: archive_folder, archive_age, archive_interval, 0 disables it)
+    ARCHIVE_FOLDER = 'archive'
+    ARCHIVE_AGE = 86400
+    ARCHIVE_INTERVAL = 300
+
+    # Default job leases, for nodes sharing a jobs folder (config: job_leases, node_id, lease_ttl, lease_heartbeat)
+    LEASE_TTL = 120
+    LEASE_HEARTBEAT = 20
+
+    # Default file exposing rate limiter state (config: rate_limits_file, limits set by config: rate_limits)
+    RATE_LIMITS_FILE = 'log/rate_limits.json'
+    # Queued jobs looked at for one the rate limits allow to run, when the oldest ones are held back
+    RATE_LIMIT_LOOKAHEAD = 100
+
+    # Default validated jobs whose data is kept in memory (config: ready_data_limit), jobs queued behind them are
+    # unloaded and loaded back from their job file (or raw payload) when they're due
+    READY_DATA_LIMIT = 1000
+
+    # Default folder of job profiles (config: profile_folder, enabled by config: profile_jobs or job field "profile")
+    PROFILE_FOLDER = 'profiles'
+
     def __init__(self):
+        self.started_at = time.time()
+        self.startup_phases = []     # (phase, seconds) of start-up, see _timed()
+
         # Resolve Ninja's script absolute path
         self.app_root_dir = dirname(abspath(realpath(sys.argv[0])))
         os.chdir(self.app_root_dir)
 
         # Setup Ninja variables
-        self.job_queue = deque()     # Pending jobs' queue
-        self.job_mutex = Lock()      # queue Mutex
+        self.job_queue = deque()     # Intake queue: new Job objects, waiting to be loaded and validated
+        self.job_mutex = Condition() # Intake queue Mutex, notified on new jobs
+        self.ready_queue = deque()   # Execution queue: validated Job objects
+        self.ready_mutex = Condition()  # Execution queue Mutex, notified on new validated jobs
         self.job_folder = ""         # Absolute path of jobs folder, will be loaded from settings.
-        self.current_job = ""        # Current job file being processed
+        self.local = local()         # Per stage (thread) state: job being processed by each stage
+        self.running_jobs = set()    # Jobs being run by the module handler right now
+        self.running_mutex = Condition()  # Running jobs Mutex, notified when a job finishes
+        self.job_slots = 1           # Jobs run at once, as told by the module (TaskHandler.job_slots())
+        self.intake = Thread(target=self._intake_loop, name='Intake', daemon=True)  # Intake stage
+        self.intake_stopped = False  # Set on shutdown, intake stage stops loading new jobs
+        self.confirm_writer = Ninja.ConfirmationWriter()  # Confirmation stage
+        self.archiver = None         # Moves completed jobs out of jobs folder
+        self.leases = None           # Job claiming among nodes sharing the jobs folder
+        self.restored_jobs = set()   # Jobs restored from persisted queue, whose leases this node adopts back
+        self.transports = []         # Stream intake transports (Unix socket, JSON lines spool)
+        self.delayed_jobs = {}       # Stream jobs waiting for a retry (they have no job file to be reloaded from)
         self.config = {}             # Configuration read and stored as a dictionary
         self.module_name = ''        # Configured module on which Ninja will dispatch tasks to
         self.observer = Observer()   # Our filesystem watchdog
         self.logger = None           # Ninja logger instance
         self.task_handler = None     # TaskHandler class instance
         self.ss_dir = ''             # Screen Shots directory, for debugging possible errors.
+        self.retry_scheduler = None  # Backoff/retry budget of jobs which failed for transient reasons
+        self.circuit_breaker = None  # Pauses dispatch while the remote site is failing
+        self.queue_state_file = ''   # Where pending jobs are persisted on shutdown
+        self.job_deadline = 0        # Max seconds a job may run before the module is asked to abort it
+        self.shutdown_requested = False  # Set by SIGTERM/SIGINT, dispatcher stops after running jobs
+        self.profile_jobs = False    # Whether every job is profiled (see profiler)
+        self.profiler = None
+        self.config_changed_at = 0   # When CONFIG_FILE was last changed, 0 once reloaded
+        self.rate_limiter = None     # Paces remote actions (logins, transfers, ...) performed by dispatched jobs
+        self.rate_limits_file = ''   # Where rate limiter state is exposed to operators (and persisted)
+        self.rate_limited = {}       # Jobs held back by the rate limiter: job name -> limit
+        self.ready_data_limit = 0    # Validated jobs whose data is kept in memory, see READY_DATA_LIMIT
 
         self.task_manager = Ninja.TaskManager(job_queue=self.job_queue, job_mutex=self.job_mutex)  # our watchdog, job dispatcher
 
@@ -62,80 +152,662 @@ class Ninja:
 
     def _setup(self):
         # Setup Ninja
-        self._setup_log()            # 1. setup Logging system
-        self._load_configuration()   # 2. Load configuration
-        self._check_runtime()        # 3. Check if we are good to go, firefox binary is set, jobs_folder exists, etc
-        self._load_module_handler()  # 4. Dynamically load Module handler specified in the configuration param 'module'.
+        self._timed('log', self._setup_log)                    # 1. setup Logging system
+        self._timed('configuration', self._load_configuration) # 2. Load configuration
+        self._timed('watchdog', self._start_watchdog)          # 3. Watch jobs_folder: jobs dropped from now on are queued
+        self._timed('preflight', self._preflight)              # 4. Check runtime and load Module handler, concurrently
+
+    def _timed(self, phase, func, *args):
+        """Run a start-up phase, recording how long it took (reported once Ninja is started)."""
+        started = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.startup_phases.append((phase, time.time() - started))
+
+    def _preflight(self):
+        """Run start-up checks while the Module handler is loaded, which pulls in its heavy imports (e.g. Selenium).
+
+        Checks abort through sys.exit(), raised again here by future.result().
+        """
+        checks = (('runtime', self._check_runtime),
+                  ('sinks', self._setup_sinks),
+                  ('module', self._load_module_handler))
+
+        with ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix='Preflight') as executor:
+            futures = [executor.submit(self._timed, 'preflight/' + name, check) for name, check in checks]
+
+            for future in futures:
+                future.result()
+
+    def _startup_report(self):
+        self.logger.info("Start-up took {:.3f}s: {}".format(time.time() - self.started_at, ', '.join(
+            '{} {:.3f}s'.format(phase, seconds) for phase, seconds in self.startup_phases)))
 
     def run(self):
-        self.observer.schedule(self.task_manager, self.config['jobs_folder'], recursive=False)
-        self.observer.start()
+        # Jobs left behind by a previous shutdown come first, in their original order.
+        self._timed('restore', self._restore_queue)
+        self._restore_rate_limits()
+
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+
+        # Pipeline: watchdog -> intake (load, validate) -> execution (this thread) -> confirmation writer
+        self.confirm_writer.start()
+        self.intake.start()
+
+        if self.archiver is not None:
+            self.archiver.start()
+
+        if self.leases is not None:
+            self.leases.start()
+
+        self._timed('transports', self._start_transports)
+
+        # Start-up checks passed: module may start its background work (e.g. launch its browser)
+        started = getattr(self.task_handler, 'started', None)
+        if callable(started):
+            started()
+
+        self._startup_report()
         self.logger.info("Ninja started successfully!")
         self.logger.info("Waiting for jobs on folder {}...".format(self.config['jobs_folder']))
 
         # Job dispatcher loop.
-        # Checks for new jobs on the job queue, pop, validate and run them.
+        # Runs jobs already validated by the intake stage.
         try:
-            while True:
-                # if queue is not empty
-                if self.job_queue:
-                    with self.job_mutex:
-                        job_file_name = self.job_queue.popleft()
+            while not self.shutdown_requested:
+                # Configuration changes are applied between jobs
+                if self.config_changed_at and time.time() - self.config_changed_at >= Ninja.CONFIG_RELOAD_DELAY \
+                        and not self.running_jobs:
+                    self._reload_configuration()
+
+                # Jobs whose retry backoff has expired go back to the intake queue
+                for job_name in self.retry_scheduler.pop_due():
+                    job = self.delayed_jobs.pop(job_name, None)
+                    self._enqueue(job if job is not None else Job(job_name, join(self.job_folder, job_name)))
+
+                if not self._dispatch_allowed():
+                    time.sleep(1)
+                    continue
+
+                # Every job slot is taken, wait for a running job to finish
+                with self.running_mutex:
+                    if len(self.running_jobs) >= self.job_slots:
+                        self.running_mutex.wait(1)
+                        continue
+
+                with self.ready_mutex:
+                    if not self.ready_queue:
+                        self.ready_mutex.wait(1)
+
+                    idle = not self.ready_queue
+                    if not idle:
+                        job = self._next_job()
+                        if job is None:
+                            # Every queued job is held back by rate limits
+                            self.ready_mutex.wait(1)
+                            continue
+
+                if idle:
+                    if not self.running_jobs:
+                        self._idle()
+                    continue
+
+                self._dispatch(job)
+        except Exception as ex:
+            self.logger.critical("Caught exception: {}".format(str(ex)))
+
+        # Jobs still running in worker threads get the same grace period
+        with self.running_mutex:
+            while self.running_jobs:
+                self.running_mutex.wait()
 
-                    self._validate_job(job_file_name)
+        self._shutdown()
 
-                time.sleep(1)
+    @property
+    def current_job(self):
+        """Absolute path of the job file being processed by the calling stage (thread), empty for stream jobs."""
+        job = getattr(self.local, 'job', None)
+        return job.path if job is not None and job.path is not None else ''
+
+    def _idle(self):
+        """Nothing to run: module may use the time, e.g. to keep its session alive (TaskHandler.idle())."""
+        idle = getattr(self.task_handler, 'idle', None)
+        if not callable(idle):
+            return
+
+        try:
+            idle()
         except Exception as ex:
-            self.logger.critical("Caught exception: {}".format(str(ex)))
-            self.observer.stop()
+            self.logger.error("Module idle task failed: {}".format(str(ex)))
 
-        self.observer.join()
+    def _start_watchdog(self):
+        if not isdir(self.config['jobs_folder']):
+            self.logger.info("Jobs folder not found, trying to create it: {}".format(self.config["jobs_folder"]))
+            try:
+                os.mkdir(self.config['jobs_folder'])
+            except IOError as io_err:
+                self.logger.fatal("Unable to create jobs directory: {}. Aborting...".format(str(io_err)))
+                sys.exit(1)
 
-    def _validate_job(self, job_file_name):
-        self.logger.info("Validating job {} ...".format(job_file_name))
+        self.job_folder = abspath(realpath(self.config['jobs_folder']))
+
+        # New jobs wait in the intake queue until the pipeline is started (see run())
+        self.observer.schedule(self.task_manager, self.config['jobs_folder'], recursive=False)
+        self.observer.schedule(Ninja.ConfigWatcher(config_file=join(self.app_root_dir, Ninja.CONFIG_FILE),
+                                                   changed=self._config_changed),
+                               self.app_root_dir, recursive=False)
+        self.observer.start()
 
-        job_file_name = join(self.job_folder, job_file_name)
-        self.current_job = job_file_name
+    def _reclaim_job(self, job_name, stage):
+        """Stale lease broken by our reaper: job goes back through intake (and claiming).
 
+        Unless the node which held it crashed during the operation itself: the transfer may have been submitted, so
+        the job is confirmed as interrupted, to be checked by hand.
+        """
+        job = Job(job_name, join(self.job_folder, job_name))
+        if stage != 'operation':
+            self._enqueue(job)
+            return
+
+        if not self.leases.claim(job_name):
+            return
+
+        self.local.job = job
         try:
-            job_fp = open(job_file_name)
-        except IOError as io_err:
-            self.logger.critical("Failed to open job file {}: {}".format(job_file_name, str(io_err)))
+            job_data = job.load()
+        except (IOError, ValueError) as err:
+            self.logger.critical("Failed to load interrupted job {}: {}".format(job_name, str(err)))
+            self.leases.release(job_name)
             self._job_load_failed()
+            return
+
+        self.logger.critical("Job {} was interrupted during operation by a node failure.".format(job_name))
+        self.confirm_job(job_data if isinstance(job_data, dict) else {}, status='err_job_interrupted',
+                         status_message='Operation interrupted: node failure',
+                         admin_message='Job interrupted during operation (node failure), check account statement '
+                                       'before resubmitting it.')
+
+    def _config_changed(self):
+        self.config_changed_at = time.time()
+
+    def _enqueue(self, job):
+        with self.job_mutex:
+            self.job_queue.append(job)
+            self.job_mutex.notify()
+
+    def _start_transports(self):
+        if self.config.get('intake_socket'):
+            self.transports.append(SocketIntake(self.config['intake_socket'], self._enqueue))
+
+        if self.config.get('intake_spool'):
+            self.transports.append(SpoolIntake(self.config['intake_spool'], Ninja.CONFIRM_FILE_EXT, self._enqueue))
+
+        for transport in self.transports:
+            transport.start()
+
+    def _intake_loop(self):
+        """Intake stage: load and validate new jobs ahead of execution, rejecting invalid ones right away."""
+        while True:
+            with self.job_mutex:
+                while not self.job_queue and not self.intake_stopped:
+                    self.job_mutex.wait()
+
+                if self.intake_stopped:
+                    return
+
+                job = self.job_queue.popleft()
+
+            # Among nodes sharing the jobs folder, only the one holding the job's lease runs it
+            if self.leases is not None and job.path is not None:
+                restored = job.name in self.restored_jobs
+                self.restored_jobs.discard(job.name)
+                if not self.leases.acquire(job.name, restored=restored):
+                    self.logger.info("Job {} was claimed by another node, skipping it.".format(job.name))
+                    continue
+
+            reason = 'Job rejected'
+            try:
+                validated = self._validate_job(job)
+            except Exception as ex:
+                self.logger.critical("Caught exception validating job {}: {}".format(job.name, str(ex)))
+                validated = None
+                reason = 'Invalid job: {}'.format(str(ex))
+
+            if validated is None:
+                # Rejected jobs must be confirmed as such, then their lease is marked done (no node runs them again)
+                if job.confirmed_at is None:
+                    self._reject_job(job, reason)
+
+                if self.leases is not None and job.confirmed_at is not None:
+                    self.leases.release(job.name)
+                continue
+
+            validated.ready_at = time.time()
+            with self.ready_mutex:
+                if len(self.ready_queue) >= self.ready_data_limit:
+                    validated.unload()
+                self.ready_queue.append(validated)
+                self.ready_mutex.notify()
+
+    def _request_shutdown(self, signum, frame):
+        if self.shutdown_requested:
+            self.logger.warning("Signal {} received again, aborting current job...".format(signum))
+            self._abort_current_job()
+            return
+
+        self.logger.info("Signal {} received, shutting down (current job has {}s to finish)...".format(
+            signum, self.config.get('shutdown_grace', Ninja.SHUTDOWN_GRACE)))
+
+        # Stop intake right away, jobs already queued are persisted for the next start
+        self.shutdown_requested = True
+        self.observer.stop()
+
+        grace = Timer(self.config.get('shutdown_grace', Ninja.SHUTDOWN_GRACE), self._abort_current_job)
+        grace.daemon = True
+        grace.start()
+
+    def _abort_current_job(self):
+        with self.running_mutex:
+            jobs = ', '.join(sorted(job.name for job in self.running_jobs))
+
+        if jobs and callable(getattr(self.task_handler, 'abort', None)):
+            self.logger.critical("Aborting job {}...".format(jobs))
+            self.task_handler.abort()
+
+    def _shutdown(self):
+        self.observer.stop()
+        self.observer.join()
+
+        for transport in self.transports:
+            transport.stop()
+
+        # Job being validated right now still makes it to the execution queue, then gets persisted.
+        with self.job_mutex:
+            self.intake_stopped = True
+            self.job_mutex.notify()
+        self.intake.join()
+
+        self._persist_queue()
+
+        if hasattr(self.task_handler, 'shutdown') and callable(self.task_handler.shutdown):
+            self.logger.info("Shutting down TaskHandler...")
+            self.task_handler.shutdown()
+
+        # Flush pending confirmations
+        self.confirm_writer.stop()
+
+        for transport in self.transports:
+            transport.close()
+
+        if self.archiver is not None:
+            self.archiver.stop()
+
+        # Leases of persisted jobs expire unless this node adopts them back on restart
+        if self.leases is not None:
+            self.leases.stop()
+
+        self.logger.info("Ninja stopped.")
+
+    def _persist_queue(self):
+        # Validated jobs were received before the ones still waiting for intake
+        with self.ready_mutex:
+            jobs = list(self.ready_queue)
+
+        with self.job_mutex:
+            jobs.extend(self.job_queue)
+
+        # Stream jobs can't be persisted (their channel won't survive), producers are told to resubmit them.
+        for job in jobs + list(self.delayed_jobs.values()):
+            if job.channel is not None:
+                self._reject_stream_job(job)
+
+        queue = [job.name for job in jobs if job.channel is None]
+
+        retries = self.retry_scheduler.snapshot()
+        retries['delayed'] = [(due, name) for due, name in retries['delayed'] if name not in self.delayed_jobs]
+
+        state = {
+            'queue': queue,
+            'retries': retries
+        }
+
+        if not queue and not state['retries']['delayed']:
+            return
+
+        if atomic_write(json.dumps(state), self.queue_state_file):
+            self.logger.info("{} queued and {} delayed jobs saved to {}".format(
+                len(queue), len(state['retries']['delayed']), self.queue_state_file))
         else:
+            self.logger.critical("Failed to save pending jobs to {}".format(self.queue_state_file))
+
+    def _restore_queue(self):
+        if not isfile(self.queue_state_file):
+            return
+
+        try:
+            with open(self.queue_state_file) as state_file:
+                state = json.load(state_file)
+        except (IOError, JSONDecodeError, ValueError) as err:
+            self.logger.critical("Failed to load pending jobs from {}: {}".format(self.queue_state_file, str(err)))
+            return
+
+        # Jobs removed or confirmed meanwhile are dropped
+        def pending(job_file_name):
+            job_path = join(self.job_folder, job_file_name)
+            return isfile(job_path) and not isfile(job_path + Ninja.CONFIRM_FILE_EXT)
+
+        queue = [Job(name, join(self.job_folder, name)) for name in state.get('queue', []) if pending(name)]
+        self.restored_jobs.update(job.name for job in queue)
+
+        # Ahead of jobs the watchdog queued while Ninja was starting up
+        with self.job_mutex:
+            self.job_queue.extendleft(reversed(queue))
+            self.job_mutex.notify()
+
+        retries = state.get('retries', {})
+        retries['delayed'] = [(due, job) for due, job in retries.get('delayed', []) if pending(job)]
+        self.restored_jobs.update(job for due, job in retries['delayed'])
+        self.retry_scheduler.restore(retries)
+
+        self.logger.info("Restored {} queued and {} delayed jobs from {}".format(
+            len(queue), len(retries['delayed']), self.queue_state_file))
+
+        os.unlink(self.queue_state_file)
+
+    def _next_job(self):
+        """Pick the next job to run: the oldest one rate limits allow to run now. Called with ready_mutex held.
+
+        :return: Job, removed from the execution queue, None if every job looked at has to wait.
+        """
+        requirements_of = getattr(self.task_handler, 'rate_limit_requirements', None)
+        if not self.rate_limiter.enabled or not callable(requirements_of):
+            return self.ready_queue.popleft()
+
+        waiting = {}
+        for index, job in enumerate(itertools.islice(self.ready_queue, Ninja.RATE_LIMIT_LOOKAHEAD)):
             try:
-                job_data = json.load(job_fp)
-            except (JSONDecodeError, ValueError) as json_err:
-                self.logger.critical("FAILED TO DECODE(json) JOB FILE {}: {}".format(job_file_name, str(json_err)))
-                self._job_load_failed()
-            else:
-                if 'operation' in job_data:
-                    self.logger.info("Running job {} ...".format(job_file_name))
-                    self._run_job(job_data)
-                else:
-                    self.logger.critical("INVALID JOB FILE: Required field is missing -> 'operation'")
-                    self.confirm_job(data=job_data, status='err_sys_invalid_job',
-                                     status_message="Required field is missing -> 'operation'")
-            finally:
-                job_fp.close()
+                requirements = requirements_of(job.data)
+            except (IOError, ValueError):
+                # Job file is gone or was changed since validation, job is rejected once dispatched (see _run_job())
+                requirements = []
+            wait, limit = self.rate_limiter.check(requirements)
+
+            if not wait:
+                self.rate_limiter.acquire(requirements)
+                del self.ready_queue[index]
+                self.rate_limited.pop(job.name, None)
+                self.rate_limited.update(waiting)
+                self._publish_rate_limits()
+                return job
+
+            if self.rate_limited.get(job.name, {}).get('limit') != limit:
+                self.logger.info("Job {} held back by rate limit {} ({:.0f}s)".format(job.name, limit, wait))
+            waiting[job.name] = {'limit': limit, 'wait': round(wait, 1)}
+
+        self.rate_limited = waiting
+        self._publish_rate_limits()
+        return None
+
+    def _publish_rate_limits(self):
+        state = {
+            'updated': time.time(),
+            'buckets': self.rate_limiter.snapshot(),
+            'waiting': self.rate_limited
+        }
+
+        atomic_write(json.dumps(state, indent=2), self.rate_limits_file)
+
+    def _restore_rate_limits(self):
+        if not self.rate_limiter.enabled or not isfile(self.rate_limits_file):
+            return
+
+        try:
+            with open(self.rate_limits_file) as state_file:
+                state = json.load(state_file)
+            self.rate_limiter.restore(state['buckets'], state['updated'])
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            self.logger.warning("Ignoring rate limits state {}: {}".format(self.rate_limits_file, str(err)))
+
+    def _dispatch_allowed(self):
+        """Check circuit breaker state before dispatching next job.
+
+        While the breaker is open jobs are held in the queue. Once a probe is due, TaskHandler.probe() (if implemented
+        by the module) is used to check whether the site has recovered, otherwise the next job itself is the probe.
+        """
+        if self.circuit_breaker.state == CircuitBreaker.CLOSED:
+            return True
+
+        # Site is probed (or the next job is the probe) once running jobs are done
+        if self.running_jobs:
+            return False
+
+        if not self.circuit_breaker.probe_due():
+            return False
+
+        probe = getattr(self.task_handler, 'probe', None)
+        if not callable(probe):
+            return True
+
+        self.logger.info("Probing site...")
+
+        if probe():
+            self.circuit_breaker.record_success()
+            return True
+
+        self.circuit_breaker.record_failure()
+        return False
+
+    def _reject_stream_job(self, job):
+        self.local.job = job
+
+        try:
+            job_data = job.data if job.data is not None else json.loads(job.raw)
+        except (JSONDecodeError, ValueError):
+            job_data = {}
+
+        self.confirm_job(job_data if isinstance(job_data, dict) else {}, status='err_sys_shutdown',
+                         status_message='Ninja is shutting down, job must be resubmitted')
+
+    def _validate_job(self, job):
+        """Load and validate a job, either from its job file or from its raw payload (stream jobs).
+
+        :return: Job ready to be run, or None if it was rejected (and confirmed as such).
+        """
+        self.logger.info("Validating job {} ...".format(job.name))
+        self.local.job = job
+
+        try:
+            job_data = job.load()
+        except IOError as io_err:
+            self.logger.critical("Failed to open job file {}: {}".format(job.path, str(io_err)))
+            self._job_load_failed()
+            return None
+        except (JSONDecodeError, ValueError) as json_err:
+            self.logger.critical("FAILED TO DECODE(json) JOB {}: {}".format(job.name, str(json_err)))
+            self._job_load_failed()
+            return None
+
+        if not isinstance(job_data, dict):
+            self.logger.critical("INVALID JOB {}: json object expected".format(job.name))
+            self._job_load_failed()
+            return None
+
+        if 'operation' not in job_data:
+            self.logger.critical("INVALID JOB FILE: Required field is missing -> 'operation'")
+            self.confirm_job(job_data, status='err_sys_invalid_job',
+                             status_message="Required field is missing -> 'operation'")
+            return None
 
-    def _run_job(self, job_data):
         operation = job_data['operation']
 
         # Forward job validation to configured module of this instance
         if not self.task_handler.validate(job_data):
-            return
+            return None
 
         if not hasattr(self.task_handler, operation) or not callable(getattr(self.task_handler, operation)):
             self.logger.critical("Operation not implemented by module. Module({}) Operation({}). Ignoring job...".
                                  format(self.module_name, operation))
+            self.confirm_job(job_data, status='err_sys_invalid_job',
+                             status_message="Operation not implemented: {}".format(operation))
+            return None
+
+        job.data = job_data
+        return job
+
+    def _reject_job(self, job, reason):
+        """Confirm a job rejected by intake without a confirmation (e.g. validation raised)."""
+        self.local.job = job
+
+        try:
+            job_data = job.load()
+        except (IOError, ValueError):
+            job_data = None
+
+        if not isinstance(job_data, dict):
+            self._job_load_failed()
             return
 
+        self.confirm_job(job_data, status='err_sys_invalid_job', status_message=reason)
+
+    def _update_job_slots(self):
+        job_slots = getattr(self.task_handler, 'job_slots', None)
+        self.job_slots = max(1, job_slots()) if callable(job_slots) else 1
+
+        if self.job_slots > 1:
+            self.logger.info("Running up to {} jobs at once.".format(self.job_slots))
+
+    def _dispatch(self, job):
+        """Run a job in this thread or, when the module runs several jobs at once, in a worker thread of its own."""
+        with self.running_mutex:
+            self.running_jobs.add(job)
+
+        if self.job_slots > 1:
+            Thread(target=self._job_worker, args=(job,), name='Job-{}'.format(job.name), daemon=True).start()
+        else:
+            self._run_job(job)
+
+    def _job_worker(self, job):
+        try:
+            self._run_job(job)
+        except Exception as ex:
+            self.logger.critical("Caught exception: {}".format(str(ex)))
+            self.shutdown_requested = True
+
+    def _run_job(self, job):
+        try:
+            try:
+                job_data = job.data
+            except (IOError, ValueError) as err:
+                self._job_reload_failed(job, err)
+                return
+
+            if self.profile_jobs or job_data.get('profile'):
+                self.profiler.run(job, self._execute_job, job)
+            else:
+                self._execute_job(job)
+        finally:
+            with self.running_mutex:
+                self.running_jobs.discard(job)
+                self.running_mutex.notify_all()
+
+    def _job_reload_failed(self, job, err):
+        """Job unloaded while queued (see READY_DATA_LIMIT) couldn't be loaded back as it was validated: it's
+        rejected, without running what it was changed into.
+        """
+        self.logger.critical("Failed to load job {} back: {}".format(job.name, str(err)))
+        self.local.job = job
+        self.confirm_job({'operation': job.operation}, status='err_sys_invalid_job',
+                         status_message='Job was changed or removed while queued: {}'.format(str(err)))
+
+    def _execute_job(self, job):
+        self.logger.info("Running job {} ...".format(job.path or job.name))
+        self.local.job = job
+        job.started_at = time.time()
+
         # Invoke module handler to handle this Job
-        op_handler = getattr(self.task_handler, operation)
-        op_handler(job_data)
+        self.local.site_failed = False
+        op_handler = getattr(self.task_handler, job.operation)
+
+        # Job deadline is only enforceable by modules that know how to abort a job (TaskHandler.abort())
+        deadline = None
+        if self.job_deadline and callable(getattr(self.task_handler, 'abort', None)):
+            seconds = self.job_deadline
+            job_deadline = getattr(self.task_handler, 'job_deadline', None)
+            if callable(job_deadline):
+                seconds = job_deadline(job.data, seconds)
+
+            deadline = Timer(seconds, self._job_deadline_expired, args=(job, seconds))
+            deadline.daemon = True
+            deadline.start()
+
+        try:
+            op_handler(job.data)
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+
+        if not self.local.site_failed:
+            self.circuit_breaker.record_success()
+
+    def _job_deadline_expired(self, job, seconds):
+        # Job may have finished right before the timer was cancelled
+        if job not in self.running_jobs:
+            return
+
+        self.logger.critical("Job {} exceeded its deadline ({}s), aborting it...".format(job.name, seconds))
+        self.task_handler.abort(job)
+
+    def retry_job(self, job_data, status, status_message='', admin_message='', site_failure=False):
+        """Reschedule current job after a transient failure.
+
+        Once the job's retry budget is exhausted it is confirmed with the given status, as a terminal failure.
+
+        :param job_data: Current job data.
+        :param status: Status to confirm the job with, if it can't be retried anymore.
+        :param status_message: Same as confirm_job().
+        :param admin_message: Same as confirm_job().
+        :param site_failure: Whether the remote site itself failed (login, navigation), feeds the circuit breaker.
+        :return: bool True if the job was rescheduled, False if it was confirmed.
+        """
+        if site_failure:
+            self.local.site_failed = True
+            self.circuit_breaker.record_failure()
+
+        job = self.local.job
+        delay = self.retry_scheduler.schedule(job.name)
+
+        # Module tells it's safe to run job again: reaper may hand it to another node if this one crashes meanwhile
+        if delay is not None and self.leases is not None and job.path is not None:
+            self.leases.mark(job.name, '')
+
+        if delay is None:
+            self.logger.critical("Job {} has exhausted its retry budget.".format(job.name))
+            self.confirm_job(job_data, status=status, status_message=status_message, admin_message=admin_message)
+            return False
+
+        if job.channel is not None:
+            self.delayed_jobs[job.name] = job
+
+        self.logger.warning("Job {} failed ({}), retrying in {:.0f}s...".format(job.name, status, delay))
+        return True
+
+    def job_stage(self, stage):
+        """Record the stage current job is in (called by modules): a job interrupted by a node failure during its
+        'operation' stage is never run again (see _reclaim_job()).
+        """
+        job = self.local.job
+        if self.leases is not None and job.path is not None:
+            self.leases.mark(job.name, stage)
 
     def confirm_job(self, job_data, status='ok', status_message='', admin_message=''):
+        job = self.local.job
+        self.retry_scheduler.forget(job.name)
+
+        if self.leases is not None and job.path is not None:
+            self.leases.release(job.name)
+
         status_data = {
             "status": status
         }
@@ -153,33 +825,35 @@ class Ninja:
         except (JSONDecodeError, ValueError) as err:
             self.logger.critical("Failed to create output json: {}".format(str(err)))
         else:
-            confirm_file_name = join(self.job_folder, self.current_job + Ninja.CONFIRM_FILE_EXT)
-
-            if atomic_write(data, confirm_file_name):
-                self.logger.info("Confirmation file successfully written: {}".format(confirm_file_name))
-            else:
-                self.logger.critical("Failed to create confirmation file: {}".format(confirm_file_name))
+            job.confirmed_at = time.time()
+            self.confirm_writer.submit(data, job)
 
     def _job_load_failed(self):
         """Create an error-confirmation file for current job.
 
         If, for some reason, it wasn't possible to load source job file, this method should be called.
         When things like I/O Error or invalid json format are detected on source file.
-        In that case, just copy source file to destination confirm file, cause there is nothing else we could do.
+        In that case, just confirm it with the source job contents (through the confirmation stage, as any other
+        confirmation), cause there is nothing else we could do.
 
 
         :param job_file_name Current job file nasme
         :return:
         """
 
-        confirm_file_name = join(self.job_folder, self.current_job + Ninja.CONFIRM_FILE_EXT)
+        job = self.local.job
 
+        # Stream jobs get their raw payload back, file jobs the contents of their job file
         try:
-            shutil.copyfile(self.current_job, confirm_file_name)
-        except Exception as err:
-            self.logger.critical("FAILED TO CREATE CONFIRMATION FILE {}: {}".format(confirm_file_name, str(err)))
-        else:
-            self.logger.info("ERROR-Confirm file created for job {}.".format(self.current_job))
+            data = job.read().decode(errors='replace')
+        except IOError as err:
+            self.logger.critical("Unable to read job {} back: {}".format(job.name, str(err)))
+            data = json.dumps({'status': 'err_sys_invalid_job', 'status_message': 'Unable to load job: ' + str(err)},
+                              separators=(',', ':'))
+
+        job.confirmed_at = time.time()
+        self.confirm_writer.submit(data, job)
+        self.logger.info("ERROR-Confirmation queued for job {}.".format(job.name))
 
     def _setup_log(self):
         log_dir = join(self.app_root_dir, "log")
@@ -221,19 +895,142 @@ class Ninja:
 
         self.module_name = self.config['module']
 
-        if 'ss_dir' in self.config:
-            self.ss_dir = self.config['ss_dir']
-        else:
-            self.ss_dir = join(self.app_root_dir, 'screenshots')
+        if 'log_level' in self.config and not isinstance(logging.getLevelName(self.config['log_level']), int):
+            self.logger.fatal('Invalid log level: <{}>. Aborting...'.format(self.config['log_level']))
+            sys.exit(1)
 
-        if not isdir(self.ss_dir):
-            self.logger.info("Creating screenshots directory: {}".format(self.ss_dir))
+        try:
+            RateLimiter(self.config.get('rate_limits', {}))
+        except ValueError as err:
+            self.logger.fatal('{}. Aborting...'.format(str(err)))
+            sys.exit(1)
+
+        self.retry_scheduler = RetryScheduler()
+        self.circuit_breaker = CircuitBreaker()
+        self._apply_configuration()
+
+    def _setup_sinks(self):
+        for sink_cfg in self.config.get('confirm_sinks', Ninja.CONFIRM_SINKS):
             try:
-                os.mkdir(self.ss_dir)
-            except IOError as io_err:
-                self.logger.fatal("Unable to create screenshots directory {}: {}. Aborting...".format(self.ss_dir, str(io_err)))
+                self.confirm_writer.sinks.append(sinks.create(sink_cfg, Ninja.CONFIRM_FILE_EXT))
+            except (ValueError, IOError) as err:
+                self.logger.fatal("Unable to setup confirmation sink {}: {}. Aborting...".format(sink_cfg, str(err)))
                 sys.exit(1)
 
+    def _apply_configuration(self):
+        """Apply the settings of self.config which can be changed while running (see _reload_configuration())."""
+        self.logger.setLevel(os.environ.get("LOGLEVEL", self.config.get('log_level', Ninja.LOG_LEVEL)))
+
+        self.retry_scheduler.max_attempts = self.config.get('retry_max_attempts', Ninja.RETRY_MAX_ATTEMPTS)
+        self.retry_scheduler.base_delay = self.config.get('retry_base_delay', Ninja.RETRY_BASE_DELAY)
+        self.retry_scheduler.max_delay = self.config.get('retry_max_delay', Ninja.RETRY_MAX_DELAY)
+
+        self.circuit_breaker.failure_threshold = self.config.get('breaker_failure_threshold',
+                                                                 Ninja.BREAKER_FAILURE_THRESHOLD)
+        self.circuit_breaker.probe_interval = self.config.get('breaker_probe_interval', Ninja.BREAKER_PROBE_INTERVAL)
+
+        self.job_deadline = self.config.get('job_deadline', Ninja.JOB_DEADLINE)
+
+        self.profile_jobs = self.config.get('profile_jobs', False)
+        self.profiler = JobProfiler(self.config.get('profile_folder', join(self.app_root_dir, Ninja.PROFILE_FOLDER)))
+
+        self.queue_state_file = self.config.get('queue_state_file', join(self.app_root_dir, Ninja.QUEUE_STATE_FILE))
+        self.ss_dir = self.config.get('ss_dir', join(self.app_root_dir, 'screenshots'))
+
+        # Tokens left are carried over to the new limits
+        rate_limiter = RateLimiter(self.config.get('rate_limits', {}))
+        if self.rate_limiter is not None:
+            rate_limiter.restore(self.rate_limiter.snapshot(), time.time())
+        self.rate_limiter = rate_limiter
+        self.rate_limits_file = self.config.get('rate_limits_file', join(self.app_root_dir, Ninja.RATE_LIMITS_FILE))
+
+        # Jobs looked at by the rate limiter are kept in memory
+        self.ready_data_limit = max(Ninja.RATE_LIMIT_LOOKAHEAD,
+                                    self.config.get('ready_data_limit', Ninja.READY_DATA_LIMIT))
+
+    def _reload_configuration(self):
+        """Reload CONFIG_FILE after it changed, called by the dispatcher between jobs.
+
+        The new configuration is validated as a whole and either fully applied or ignored. Parameters which require a
+        restart (RESTART_CFG_PARAMS) keep their current value, driver settings are picked up by the module the next
+        time it starts a browser.
+        """
+        self.config_changed_at = 0
+
+        cfg_file_path = join(self.app_root_dir, Ninja.CONFIG_FILE)
+        self.logger.info("Reloading configuration file {} ...".format(cfg_file_path))
+
+        try:
+            with open(cfg_file_path) as cfg_file:
+                config = json.load(cfg_file)
+        except (IOError, ValueError) as err:
+            self.logger.error("Ignoring configuration change, unable to load it: {}".format(str(err)))
+            return
+
+        error = self._validate_configuration(config)
+        if error is not None:
+            self.logger.error("Ignoring configuration change: {}".format(error))
+            return
+
+        for cfg in Ninja.RESTART_CFG_PARAMS:
+            if config.get(cfg) != self.config.get(cfg):
+                self.logger.warning("Configuration parameter <{}> changed, restart Ninja to apply it.".format(cfg))
+                if cfg in self.config:
+                    config[cfg] = self.config[cfg]
+                else:
+                    del config[cfg]
+
+        changed = sorted(cfg for cfg in set(config) | set(self.config) if config.get(cfg) != self.config.get(cfg))
+        if not changed:
+            self.logger.info("No configuration changes to apply.")
+            return
+
+        self.config = config
+        self._apply_configuration()
+
+        # Module settings, driver settings included, are read from ninja.config; reconfigure() updates derived state
+        reconfigure = getattr(self.task_handler, 'reconfigure', None)
+        if callable(reconfigure):
+            reconfigure(changed)
+        self._update_job_slots()
+
+        self.logger.info("Configuration reloaded, changed parameters: {}".format(', '.join(changed)))
+
+    def _validate_configuration(self, config):
+        """Validate a configuration to be reloaded.
+
+        :return: Error message, None if configuration is valid.
+        """
+        if not isinstance(config, dict):
+            return "configuration must be a JSON object"
+
+        required = Ninja.REQUIRED_CFG_PARAMS + tuple(getattr(self.task_handler, 'REQUIRED_CFG_PARAMS', ()))
+        for required_cfg in required:
+            if required_cfg not in config:
+                return "missing configuration parameter <{}>".format(required_cfg)
+
+        if not isfile(config['firefox_binary']):
+            return "could not locate firefox binary: {}".format(config['firefox_binary'])
+
+        if not isdir(config['firefox_profile']):
+            return "could not locate firefox profile: {}".format(config['firefox_profile'])
+
+        if 'log_level' in config and not isinstance(logging.getLevelName(config['log_level']), int):
+            return "invalid log level <{}>".format(config['log_level'])
+
+        try:
+            RateLimiter(config.get('rate_limits', {}))
+        except ValueError as err:
+            return str(err)
+
+        ss_dir = config.get('ss_dir', join(self.app_root_dir, 'screenshots'))
+        try:
+            os.makedirs(ss_dir, exist_ok=True)
+        except OSError as err:
+            return "unable to create screenshots directory {}: {}".format(ss_dir, str(err))
+
+        return None
+
     def _check_runtime(self):
         self.logger.info("Checking if runtime dependencies are ok...")
 
@@ -245,15 +1042,34 @@ class Ninja:
             self.logger.fatal("Could not locate firefox profile: {}. Aborting...".format(self.config['firefox_profile']))
             sys.exit(1)
 
-        if not isdir(self.config['jobs_folder']):
-            self.logger.info("Jobs folder not found, trying to create it: {}".format(self.config["jobs_folder"]))
+        if not isdir(self.ss_dir):
+            self.logger.info("Creating screenshots directory: {}".format(self.ss_dir))
             try:
-                os.mkdir(self.config['jobs_folder'])
+                os.mkdir(self.ss_dir)
             except IOError as io_err:
-                self.logger.fatal("Unable to create jobs directory: {}. Aborting...".format(str(io_err)))
+                self.logger.fatal("Unable to create screenshots directory {}: {}. Aborting...".format(self.ss_dir, str(io_err)))
                 sys.exit(1)
 
-        self.job_folder = abspath(realpath(self.config['jobs_folder']))
+        archive_interval = self.config.get('archive_interval', Ninja.ARCHIVE_INTERVAL)
+        if archive_interval:
+            archive_folder = self.config.get('archive_folder', join(self.app_root_dir, Ninja.ARCHIVE_FOLDER))
+            if not isdir(archive_folder):
+                self.logger.info("Creating archive directory: {}".format(archive_folder))
+                try:
+                    os.makedirs(archive_folder)
+                except IOError as io_err:
+                    self.logger.fatal("Unable to create archive directory: {}. Aborting...".format(str(io_err)))
+                    sys.exit(1)
+
+            self.archiver = Archiver(self.job_folder, archive_folder, Ninja.CONFIRM_FILE_EXT,
+                                     max_age=self.config.get('archive_age', Ninja.ARCHIVE_AGE),
+                                     interval=archive_interval)
+
+        if self.config.get('job_leases', False):
+            self.leases = LeaseManager(self.job_folder, self.config.get('node_id', socket.gethostname()),
+                                       reclaim=self._reclaim_job,
+                                       ttl=self.config.get('lease_ttl', Ninja.LEASE_TTL),
+                                       heartbeat=self.config.get('lease_heartbeat', Ninja.LEASE_HEARTBEAT))
 
         self.logger.info("Runtime check successful.")
 
@@ -296,11 +1112,12 @@ class Ninja:
                 self.logger.fatal("Failed to initialize TaskHandler. Aborting...")
                 sys.exit(1)
 
+        self._update_job_slots()
         self.logger.info("Module successfully loaded!")
 
     def take_ss(self, driver):
 
-        ss_file = join(self.ss_dir, basename(self.current_job) + ".png")
+        ss_file = join(self.ss_dir, self.local.job.name + ".png")
         driver.get_screenshot_as_file(ss_file)
 
     class TaskManager(FileSystemEventHandler):
@@ -319,7 +1136,67 @@ class Ninja:
             self.logger.info("New job file: {}".format(job_abs_path))
 
             with self.queue_mutex:
-                self.queue.append(basename(event.src_path))
+                self.queue.append(Job(basename(event.src_path), job_abs_path))
+                self.queue_mutex.notify()
+
+    class ConfigWatcher(FileSystemEventHandler):
+        """Notifies changes of the configuration file (written in place, or replaced through a rename)."""
+
+        def __init__(self, *args, **kwargs):
+            self.config_file = kwargs['config_file']
+            self.changed = kwargs['changed']
+
+        def on_created(self, event):
+            if abspath(event.src_path) == self.config_file:
+                self.changed()
+
+        def on_modified(self, event):
+            if abspath(event.src_path) == self.config_file:
+                self.changed()
+
+        def on_moved(self, event):
+            if abspath(event.dest_path) == self.config_file:
+                self.changed()
+
+    class ConfirmationWriter(Thread):
+        """Confirmation stage: delivers confirmations to the configured sinks, off the execution stage's critical path.
+        """
+
+        def __init__(self):
+            super().__init__(name='ConfirmationWriter', daemon=True)
+            self.logger = logging.getLogger('ConfirmationWriter')
+            self.queue = Queue()
+            self.sinks = []
+
+        def submit(self, data, job):
+            self.queue.put((data, job))
+
+        def stop(self):
+            """Deliver all pending confirmations, then stop."""
+            self.queue.put(None)
+            self.join()
+
+            for sink in self.sinks:
+                sink.close()
+
+        def run(self):
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+
+                data, job = item
+
+                # Stream jobs are answered through the channel they came from, whatever the configured sinks
+                if job.channel is not None and job.channel.send(job, data):
+                    self.logger.info("Confirmation successfully sent: {}".format(job.name))
+
+                for sink in self.sinks:
+                    try:
+                        sink.emit(job, data)
+                    except Exception as ex:
+                        self.logger.critical("{} failed to confirm job {}: {}".format(type(sink).__name__, job.name,
+                                                                                     str(ex)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+""" Per-job profiler
+
+    Opt-in (config: profile_jobs, or "profile": true in a job file): the job runs under cProfile, its profile is
+    dumped to <profile_folder>/<job name>-<timestamp>.prof (open it with pstats, snakeviz, etc.) along with a .txt
+    summary splitting the job's wall time into:
+
+    - webdriver: HTTP round-trips to the WebDriver (command execution by the browser included)
+    - sleep:     time.sleep(), fixed sleeps and WebDriverWait polling (waiting for the page)
+    - other:     what's left: Ninja's own code (json, logging, locators, ...), file I/O, locks
+
+    along with cpu, the CPU time of the job's thread. It isn't part of the split: it's spent in WebDriver round-trips
+    (requests, json) as well as in Ninja's own code.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from os.path import join, isdir
+
+# pstats keys of the functions whose cumulative time is accounted as WebDriver / sleep time
+WEBDRIVER_FUNCTION = ('remote_connection.py', '_request')
+SLEEP_FUNCTION = ('~', '<built-in method time.sleep>')
+
+# Functions listed in the summary, by cumulative time
+SUMMARY_TOP = 30
+
+
+class JobProfiler:
+
+    def __init__(self, profile_folder):
+        self.logger = logging.getLogger('JobProfiler')
+        self.profile_folder = profile_folder
+
+    def run(self, job, func, *args):
+        """Run func(*args) under cProfile, then dump its profile and summary."""
+        profile = cProfile.Profile()
+        wall_started, cpu_started = time.time(), time.thread_time()
+
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            self._dump(job, profile, time.time() - wall_started, time.thread_time() - cpu_started)
+
+    def _dump(self, job, profile, wall, cpu):
+        if not isdir(self.profile_folder):
+            os.makedirs(self.profile_folder, exist_ok=True)
+
+        profile_path = join(self.profile_folder, '{}-{}.prof'.format(job.name, time.strftime('%Y%m%d%H%M%S')))
+        profile.dump_stats(profile_path)
+
+        stats = pstats.Stats(profile)
+        webdriver = sleep = 0.0
+        for (file_name, _, function_name), (_, _, _, cumulative, _) in stats.stats.items():
+            if file_name.endswith(WEBDRIVER_FUNCTION[0]) and function_name == WEBDRIVER_FUNCTION[1]:
+                webdriver += cumulative
+            elif (file_name, function_name) == SLEEP_FUNCTION:
+                sleep += cumulative
+
+        other = max(0.0, wall - webdriver - sleep)
+        summary = "wall={:.3f}s webdriver={:.3f}s sleep={:.3f}s other={:.3f}s cpu={:.3f}s".format(
+            wall, webdriver, sleep, other, cpu)
+
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(SUMMARY_TOP)
+
+        try:
+            with open(profile_path[:-len('.prof')] + '.txt', 'w') as summary_file:
+                summary_file.write("Job {}: {}\n\n".format(job.name, summary))
+                summary_file.write(report.getvalue())
+        except IOError as err:
+            self.logger.error("Failed to write profile summary of job {}: {}".format(job.name, str(err)))
+
+        self.logger.info("Job {} profile: {} ({})".format(job.name, summary, profile_path))
@@ -0,0 +1,136 @@
+""" Token bucket rate limiting
+
+    Keeps the actions Ninja performs on the remote site (logins, SMS token requests, transfers, ...) under configured
+    rates, both globally and per account. Configuration (config: rate_limits):
+
+        {"login":    {"global": {"per_minute": 2, "burst": 2}, "account": {"per_minute": 1, "burst": 1}},
+         "transfer": {"account": {"per_minute": 10, "burst": 5}}}
+
+    Modules tell which actions a job is going to perform (TaskHandler.rate_limit_requirements()), the dispatcher only
+    hands a job out once every bucket involved has enough tokens.
+"""
+import time
+from threading import Lock
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0   # Tokens added per second
+        self.burst = burst              # Bucket capacity
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, count, now):
+        """Seconds until `count` tokens are available (0 if they're available now)."""
+        self._refill(now)
+        if self.tokens >= count:
+            return 0.0
+
+        if self.rate <= 0:
+            return float('inf')
+
+        return (min(count, self.burst) - self.tokens) / self.rate
+
+    def take(self, count, now):
+        self._refill(now)
+        self.tokens -= count
+
+
+class RateLimiter:
+
+    def __init__(self, limits):
+        """
+        :param limits: dict {action: {"global"|"account": {"per_minute": float, "burst": int}}}
+        :raise ValueError: Invalid limits.
+        """
+        self.limits = {}
+        for action, scopes in limits.items():
+            for scope, limit in scopes.items():
+                if scope not in ('global', 'account'):
+                    raise ValueError("Unknown rate limit scope <{}> of action <{}>".format(scope, action))
+                try:
+                    self.limits[(action, scope)] = (float(limit['per_minute']), int(limit.get('burst', 1)))
+                except (KeyError, TypeError, ValueError):
+                    raise ValueError("Invalid rate limit of action <{}> ({}): {}".format(action, scope, limit))
+
+        self.buckets = {}   # (action, 'global' or account) -> TokenBucket
+        self.mutex = Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.limits)
+
+    def _buckets(self, requirements):
+        """Buckets involved in requirements [(action, account, count), ...], as [(bucket key, count), ...]."""
+        involved = []
+        for action, account, count in requirements:
+            if (action, 'global') in self.limits:
+                involved.append(((action, 'global'), count))
+            if (action, 'account') in self.limits and account is not None:
+                involved.append(((action, account), count))
+
+        return involved
+
+    def _bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            per_minute, burst = self.limits[(key[0], 'global' if key[1] == 'global' else 'account')]
+            bucket = self.buckets[key] = TokenBucket(per_minute, burst)
+
+        return bucket
+
+    def check(self, requirements):
+        """Tell how long a job with these requirements has to wait.
+
+        :param requirements: [(action, account, count), ...]
+        :return: (seconds, reason) seconds is 0 if the job may run now, reason names the limiting bucket.
+        """
+        now = time.time()
+        wait, reason = 0.0, ''
+
+        with self.mutex:
+            for key, count in self._buckets(requirements):
+                bucket_wait = self._bucket(key).wait_time(count, now)
+                if bucket_wait > wait:
+                    wait, reason = bucket_wait, '{}/{}'.format(*key)
+
+        return wait, reason
+
+    def acquire(self, requirements):
+        now = time.time()
+        with self.mutex:
+            for key, count in self._buckets(requirements):
+                self._bucket(key).take(count, now)
+
+    def snapshot(self):
+        """Current state of every bucket, e.g. to be exposed to operators or persisted across restarts."""
+        now = time.time()
+        with self.mutex:
+            state = {}
+            for (action, scope), bucket in self.buckets.items():
+                bucket._refill(now)
+                state['{}/{}'.format(action, scope)] = {
+                    'tokens': round(bucket.tokens, 3),
+                    'burst': bucket.burst,
+                    'per_minute': round(bucket.rate * 60, 3),
+                    'full_in': round((bucket.burst - bucket.tokens) / bucket.rate, 1) if bucket.rate > 0 else None
+                }
+
+        return state
+
+    def restore(self, state, saved_at):
+        """Restore tokens left from a snapshot(), so a restart doesn't hand out a fresh burst."""
+        with self.mutex:
+            for name, bucket_state in state.items():
+                action, _, scope = name.partition('/')
+                if (action, 'global' if scope == 'global' else 'account') not in self.limits:
+                    continue
+
+                bucket = self._bucket((action, scope))
+                bucket.tokens = min(bucket.burst, float(bucket_state['tokens']))
+                bucket.updated = saved_at
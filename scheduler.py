@@ -0,0 +1,113 @@
+import heapq
+import logging
+import random
+import time
+from threading import Lock
+
+
+class RetryScheduler:
+    """Retry budget and exponential backoff for jobs that failed for transient reasons.
+
+    Jobs are identified by their name (job file name). Each call to schedule() consumes one attempt from the job's
+    budget and parks it until its backoff expires, pop_due() then hands it back to the dispatcher.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=30, max_delay=600):
+        self.max_attempts = max_attempts    # Max number of executions of a single job (first one included)
+        self.base_delay = base_delay        # Backoff of the first retry, in seconds, doubled on each new attempt
+        self.max_delay = max_delay          # Backoff upper bound, in seconds
+        self.attempts = {}                  # job name -> number of failed attempts so far
+        self.delayed = []                   # heap of (due time, job name)
+        self.mutex = Lock()
+
+    def schedule(self, job_name):
+        """Park a failed job until its backoff expires.
+
+        :param job_name: Job to be retried.
+        :return: Backoff delay in seconds, or None if the job's retry budget is exhausted.
+        """
+        with self.mutex:
+            attempts = self.attempts.get(job_name, 0) + 1
+
+            if attempts >= self.max_attempts:
+                self.attempts.pop(job_name, None)
+                return None
+
+            self.attempts[job_name] = attempts
+
+            # Jitter avoids several failed jobs hitting the bank again at the very same moment.
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            heapq.heappush(self.delayed, (time.time() + delay, job_name))
+
+            return delay
+
+    def pop_due(self):
+        """Return jobs whose backoff has expired, oldest first."""
+        now = time.time()
+        due = []
+
+        with self.mutex:
+            while self.delayed and self.delayed[0][0] <= now:
+                due.append(heapq.heappop(self.delayed)[1])
+
+        return due
+
+    def snapshot(self):
+        """Serializable state, to be persisted across restarts (see restore())."""
+        with self.mutex:
+            return {
+                'attempts': dict(self.attempts),
+                'delayed': sorted(self.delayed)
+            }
+
+    def restore(self, state):
+        with self.mutex:
+            self.attempts.update(state.get('attempts', {}))
+            for due, job_name in state.get('delayed', []):
+                heapq.heappush(self.delayed, (due, job_name))
+
+    def forget(self, job_name):
+        """Drop retry bookkeeping of a job, once it reaches a final state."""
+        with self.mutex:
+            self.attempts.pop(job_name, None)
+
+
+class CircuitBreaker:
+    """Pause job dispatch while the remote site keeps failing.
+
+    After `failure_threshold` consecutive site failures the breaker opens. While open, no job should be dispatched
+    until `probe_interval` seconds have passed, then a single probe (or job) is allowed to check whether the site has
+    recovered. A success closes the breaker, a failure keeps it open for another interval.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+
+    def __init__(self, failure_threshold=3, probe_interval=120):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0       # Consecutive failures
+        self.next_probe = 0     # When breaker is open, timestamp after which a probe is allowed
+        self.logger = logging.getLogger('CircuitBreaker')
+
+    def probe_due(self):
+        return self.state == CircuitBreaker.OPEN and time.time() >= self.next_probe
+
+    def record_success(self):
+        if self.state == CircuitBreaker.OPEN:
+            self.logger.info("Site has recovered, resuming job dispatch.")
+
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+
+        if self.state == CircuitBreaker.OPEN or self.failures >= self.failure_threshold:
+            if self.state == CircuitBreaker.CLOSED:
+                self.logger.critical("{} consecutive site failures, pausing job dispatch.".format(self.failures))
+
+            self.state = CircuitBreaker.OPEN
+            self.next_probe = time.time() + self.probe_interval
+            self.logger.warning("Next site probe in {}s.".format(self.probe_interval))
@@ -0,0 +1,247 @@
+""" Confirmation sinks
+
+    Where job confirmations are delivered to. Ninja's confirmation stage hands every confirmation (json string) to
+    each configured sink (config: confirm_sinks). Local sinks write it right away, network sinks batch confirmations
+    and deliver them from their own thread, retrying on failure, so a slow consumer never delays job execution.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import urllib.request
+from queue import Queue, Empty
+from threading import Thread
+
+from utils import atomic_write
+
+
+class Sink:
+
+    def emit(self, job, data):
+        """Deliver the confirmation (json string) of a job."""
+        raise NotImplementedError()
+
+    def close(self):
+        """Deliver pending confirmations and release resources."""
+        pass
+
+
+class FileSink(Sink):
+    """Ninja's original confirmation format: a <job file><confirm_ext> file next to each job file.
+
+    Stream jobs (see transports) have no job file: nothing is written for them, the confirmation stage answers them
+    through the channel they came from.
+    """
+
+    def __init__(self, confirm_ext):
+        self.logger = logging.getLogger('FileSink')
+        self.confirm_ext = confirm_ext
+
+    def emit(self, job, data):
+        if job.path is None:
+            return
+
+        confirm_file_name = job.path + self.confirm_ext
+
+        if atomic_write(data, confirm_file_name):
+            self.logger.info("Confirmation file successfully written: {}".format(confirm_file_name))
+        else:
+            self.logger.critical("Failed to create confirmation file: {}".format(confirm_file_name))
+
+
+class LedgerSink(Sink):
+    """Append-only JSON lines ledger of all confirmations."""
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('LedgerSink')
+        self.path = path
+        self.fp = open(path, 'a')
+
+    def emit(self, job, data):
+        try:
+            self.fp.write(data + '\n')
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+        except IOError as err:
+            self.logger.critical("Failed to append confirmation of job {} to {}: {}".format(job.name, self.path,
+                                                                                           str(err)))
+
+    def close(self):
+        self.fp.close()
+
+
+class TimingsSink(Sink):
+    """JSON lines file of when each job went through each pipeline stage, e.g. for load tests (see bench/load.py).
+
+    "written" is when this sink got the confirmation: listed last in confirm_sinks, it's when the sinks before it
+    were done with it.
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('TimingsSink')
+        self.path = path
+        self.fp = open(path, 'a')
+
+    def emit(self, job, data):
+        timings = {
+            'job': job.name,
+            'queued': job.queued_at,
+            'ready': job.ready_at,
+            'started': job.started_at,
+            'confirmed': job.confirmed_at,
+            'written': time.time()
+        }
+
+        try:
+            self.fp.write(json.dumps(timings) + '\n')
+            self.fp.flush()
+        except IOError as err:
+            self.logger.error("Failed to record timings of job {} to {}: {}".format(job.name, self.path, str(err)))
+
+    def close(self):
+        self.fp.close()
+
+
+class BatchingSink(Sink, Thread):
+    """Base of network sinks: confirmations are delivered in batches from a dedicated thread.
+
+    A batch is sent once `batch_size` confirmations are pending or `flush_interval` seconds have passed. Failed
+    deliveries are retried with exponential backoff, up to `max_retries` times, then the batch is dropped (it's still
+    available on the other sinks, e.g. FileSink or LedgerSink).
+    """
+
+    def __init__(self, batch_size=50, flush_interval=1, max_retries=5, retry_delay=1):
+        Thread.__init__(self, name=type(self).__name__, daemon=True)
+        self.logger = logging.getLogger(type(self).__name__)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = Queue()
+        self.closing = False
+        self.start()
+
+    def emit(self, job, data):
+        self.queue.put(data)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+    def deliver(self, batch):
+        """Send a batch (list of json strings), raising any exception on failure."""
+        raise NotImplementedError()
+
+    def run(self):
+        batch = []
+        flush_at = time.time() + self.flush_interval
+
+        while True:
+            try:
+                data = self.queue.get(timeout=max(0, flush_at - time.time()))
+            except Empty:
+                data = ''
+
+            if data is None:
+                self.closing = True
+            elif data:
+                batch.append(data)
+
+            if batch and (self.closing or len(batch) >= self.batch_size or time.time() >= flush_at):
+                self._deliver(batch)
+                batch = []
+
+            if self.closing:
+                return
+
+            if not batch:
+                flush_at = time.time() + self.flush_interval
+
+    def _deliver(self, batch):
+        # On shutdown, pending confirmations are given a single attempt
+        attempts = 1 if self.closing else self.max_retries + 1
+
+        for attempt in range(attempts):
+            try:
+                self.deliver(batch)
+            except Exception as err:
+                self.logger.warning("Failed to deliver {} confirmations (attempt {}): {}".format(len(batch),
+                                                                                               attempt + 1,
+                                                                                               str(err)))
+                if attempt + 1 < attempts:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                self.logger.debug("{} confirmations delivered.".format(len(batch)))
+                return
+
+        self.logger.critical("Dropping {} confirmations, unable to deliver them.".format(len(batch)))
+
+
+class WebhookSink(BatchingSink):
+    """POST batches of confirmations, as a json array, to an HTTP endpoint."""
+
+    def __init__(self, url, timeout=10, **kwargs):
+        self.url = url
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def deliver(self, batch):
+        request = urllib.request.Request(self.url, data=('[' + ','.join(batch) + ']').encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class UnixSocketSink(BatchingSink):
+    """Stream confirmations, as JSON lines, to a Unix socket (reconnecting on failure)."""
+
+    def __init__(self, path, timeout=10, **kwargs):
+        self.path = path
+        self.timeout = timeout
+        self.conn = None
+        super().__init__(**kwargs)
+
+    def deliver(self, batch):
+        if self.conn is None:
+            self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.conn.settimeout(self.timeout)
+            self.conn.connect(self.path)
+
+        try:
+            self.conn.sendall(('\n'.join(batch) + '\n').encode())
+        except OSError:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def close(self):
+        super().close()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def create(sink_cfg, confirm_ext):
+    """Build a sink from its configuration, e.g. {"type": "webhook", "url": "http://127.0.0.1:8000/confirm"}.
+
+    :raise ValueError: Unknown sink type or missing parameter.
+    """
+    sink_cfg = dict(sink_cfg)
+    sink_type = sink_cfg.pop('type', None)
+
+    try:
+        if sink_type == 'file':
+            return FileSink(confirm_ext)
+        if sink_type == 'ledger':
+            return LedgerSink(**sink_cfg)
+        if sink_type == 'timings':
+            return TimingsSink(**sink_cfg)
+        if sink_type == 'webhook':
+            return WebhookSink(**sink_cfg)
+        if sink_type == 'socket':
+            return UnixSocketSink(**sink_cfg)
+    except TypeError as err:
+        raise ValueError("Invalid '{}' sink parameters: {}".format(sink_type, str(err)))
+
+    raise ValueError("Unknown sink type: {}".format(sink_type))
@@ -0,0 +1,78 @@
+""" Stub module
+
+    A TaskHandler which doesn't drive any browser: every job just takes a configurable time, then it's confirmed,
+    failed or retried at configurable rates. Lets Ninja's own pipeline (watchdog, intake, dispatcher, confirmation
+    stage) be load tested without a bank on the other end, see bench/load.py.
+
+    Configuration (module: "stub"): stub_latency, stub_latency_jitter (seconds), stub_error_rate, stub_retry_rate
+    (fraction of jobs, 0 to 1), stub_slots (jobs run at once) and stub_seed.
+"""
+import logging
+import random
+import time
+
+
+class TaskHandler:
+    # Required configuration parameters for this specific Instance
+    REQUIRED_CFG_PARAMS = ()
+
+    # Default seconds a job takes, give or take up to LATENCY_JITTER (config: stub_latency, stub_latency_jitter)
+    LATENCY = 0
+    LATENCY_JITTER = 0
+
+    # Default fraction of jobs failing for good, and failing for a transient reason (config: stub_error_rate,
+    # stub_retry_rate)
+    ERROR_RATE = 0
+    RETRY_RATE = 0
+
+    # Default jobs run at once (config: stub_slots)
+    SLOTS = 1
+
+    def __init__(self, *args, **kwargs):
+        self.ninja = kwargs['ninja']
+        self.logger = logging.getLogger(__name__)
+        self.random = random.Random(self.ninja.config.get('stub_seed'))
+        self.jobs = 0
+
+    def setup(self):
+        for rate in ('stub_error_rate', 'stub_retry_rate'):
+            if not 0 <= self.ninja.config.get(rate, 0) <= 1:
+                self.logger.critical("Invalid <{}>, must be between 0 and 1: {}".format(rate, self.ninja.config[rate]))
+                return False
+
+        return True
+
+    def job_slots(self):
+        return self.ninja.config.get('stub_slots', TaskHandler.SLOTS)
+
+    def shutdown(self):
+        self.logger.info("Stub module ran {} jobs.".format(self.jobs))
+
+    def validate(self, job_data):
+        return True
+
+    def transfer_bank(self, job_data):
+        self._run(job_data)
+
+    def transfer_batch(self, job_data):
+        self._run(job_data)
+
+    def _run(self, job_data):
+        config = self.ninja.config
+        latency = config.get('stub_latency', TaskHandler.LATENCY)
+        jitter = config.get('stub_latency_jitter', TaskHandler.LATENCY_JITTER)
+
+        latency = max(0, latency + self.random.uniform(-jitter, jitter))
+        if latency:
+            time.sleep(latency)
+
+        self.jobs += 1
+        draw = self.random.random()
+        error_rate = config.get('stub_error_rate', TaskHandler.ERROR_RATE)
+
+        if draw < error_rate:
+            self.ninja.confirm_job(job_data, 'err_operation_failed', status_message='Stub error')
+        elif draw < error_rate + config.get('stub_retry_rate', TaskHandler.RETRY_RATE):
+            self.ninja.retry_job(job_data, 'err_operation_failed', status_message='Stub transient error')
+        else:
+            self.ninja.confirm_job(job_data)
@@ -0,0 +1,302 @@
+""" Stream intake transports
+
+    Alternatives to the file-per-job intake: jobs are received as JSON lines, either through a Unix socket or appended
+    to a spool file, and their confirmations are sent back through the same channel (as JSON lines too).
+"""
+import logging
+import os
+import socket
+from os.path import isfile
+from threading import Thread, Lock, Event
+
+from job import Job
+
+
+class Channel:
+    """Where confirmations of stream jobs are sent to."""
+
+    def send(self, job, data):
+        """Send the confirmation (json string) of a job.
+
+        :return: bool True if it was successfully delivered.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class SocketChannel(Channel):
+    """A Unix socket connection, confirmations are sent back to the producer which sent the jobs."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.mutex = Lock()
+
+    def send(self, job, data):
+        with self.mutex:
+            try:
+                self.conn.sendall(data.encode() + b'\n')
+            except OSError as err:
+                logging.getLogger(__name__).critical("Failed to send confirmation: {}".format(str(err)))
+                return False
+
+        return True
+
+    def close(self):
+        with self.mutex:
+            self.conn.close()
+
+
+class SpoolChannel(Channel):
+    """Confirmations of spool jobs are appended to a JSON lines file."""
+
+    def __init__(self, confirm_spool_path, confirmed=None):
+        self.path = confirm_spool_path
+        self.confirmed = confirmed  # Callable receiving each confirmed Job (see SpoolIntake)
+        self.mutex = Lock()
+        self.fp = open(confirm_spool_path, 'a')
+
+    def send(self, job, data):
+        with self.mutex:
+            try:
+                self.fp.write(data + '\n')
+                self.fp.flush()
+            except IOError as err:
+                logging.getLogger(__name__).critical("Failed to append confirmation to {}: {}".format(self.path,
+                                                                                                  str(err)))
+                return False
+            finally:
+                # Job was run either way, it mustn't be read again
+                if self.confirmed is not None:
+                    self.confirmed(job)
+
+        return True
+
+    def close(self):
+        with self.mutex:
+            self.fp.close()
+
+
+class SocketIntake(Thread):
+    """Accept jobs as JSON lines on a Unix socket, each connection gets its confirmations back."""
+
+    def __init__(self, socket_path, submit):
+        super().__init__(name='SocketIntake', daemon=True)
+        self.logger = logging.getLogger('SocketIntake')
+        self.socket_path = socket_path
+        self.submit = submit    # Callable receiving each new Job
+        self.channels = []
+        self.sequence = 0
+        self.mutex = Lock()
+        self.stopped = Event()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.server.settimeout(1)
+
+    def run(self):
+        self.logger.info("Waiting for jobs on socket {}...".format(self.socket_path))
+
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            channel = SocketChannel(conn)
+            with self.mutex:
+                self.channels.append(channel)
+
+            Thread(target=self._read_jobs, args=(conn, channel), name='SocketIntakeConn', daemon=True).start()
+
+    def _read_jobs(self, conn, channel):
+        with conn.makefile('rb') as lines:
+            try:
+                for line in lines:
+                    if self.stopped.is_set():
+                        break
+
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    with self.mutex:
+                        self.sequence += 1
+                        name = 'socket-{}'.format(self.sequence)
+
+                    self.submit(Job(name, raw=line, channel=channel))
+            except OSError:
+                pass
+
+    def stop(self):
+        """Stop receiving jobs, connections are kept open for pending confirmations (see close())."""
+        self.stopped.set()
+        self.server.close()
+        self.join()
+
+        # Readers stop right away, connections remain writable
+        with self.mutex:
+            for channel in self.channels:
+                try:
+                    channel.conn.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def close(self):
+        with self.mutex:
+            for channel in self.channels:
+                channel.close()
+
+
+class SpoolIntake(Thread):
+    """Read jobs appended to a JSON lines spool file, confirmations are appended to <spool><confirm_ext>.
+
+    Progress is saved to <spool>.offset: the low-water mark (offset of the first job read but not confirmed yet),
+    followed by the offsets of the jobs past it already confirmed. Confirmed jobs aren't read twice across restarts,
+    jobs read but never confirmed (e.g. Ninja crashed while they were queued) are read again.
+
+    Each confirmed offset is appended to the file as it's confirmed, the file is rewritten with the new low-water mark
+    (dropping the offsets below it) between spool reads.
+    """
+
+    OFFSET_FILE_EXT = '.offset'
+
+    def __init__(self, spool_path, confirm_ext, submit, interval=0.2):
+        super().__init__(name='SpoolIntake', daemon=True)
+        self.logger = logging.getLogger('SpoolIntake')
+        self.spool_path = spool_path
+        self.offset_path = spool_path + SpoolIntake.OFFSET_FILE_EXT
+        self.submit = submit
+        self.interval = interval
+        self.channel = SpoolChannel(spool_path + confirm_ext, confirmed=self._confirmed)
+        self.stopped = Event()
+        self.mutex = Lock()
+        self.offset = 0         # Read offset
+        self.pending = {}       # Offsets of jobs read and not confirmed yet, by job name
+        self.confirmed = set()  # Offsets of jobs confirmed past the low-water mark
+        self.saved = False      # Offset file is up to date (low-water mark included)
+        self.offset_fp = None   # Offset file, confirmed offsets are appended to
+
+        if isfile(self.offset_path):
+            with open(self.offset_path) as offset_file:
+                offsets = [int(offset) for offset in offset_file.read().split()]
+
+            if offsets:
+                self.offset = offsets[0]
+                self.confirmed = set(offsets[1:])
+
+        self._save()
+
+    def run(self):
+        self.logger.info("Waiting for jobs on spool {}...".format(self.spool_path))
+
+        while not self.stopped.wait(self.interval):
+            try:
+                self._read_jobs()
+            except IOError as err:
+                self.logger.critical("Failed to read spool {}: {}".format(self.spool_path, str(err)))
+
+            with self.mutex:
+                if not self.saved:
+                    self._save()
+
+    def _read_jobs(self):
+        if not isfile(self.spool_path):
+            return
+
+        if os.path.getsize(self.spool_path) < self.offset:
+            self.logger.warning("Spool {} was truncated, reading it from the start.".format(self.spool_path))
+            with self.mutex:
+                self.offset = 0
+                self.pending.clear()
+                self.confirmed.clear()
+                self._save()
+
+        with open(self.spool_path, 'rb') as spool:
+            spool.seek(self.offset)
+
+            for line in spool:
+                # Incomplete line, producer is still writing it
+                if not line.endswith(b'\n'):
+                    break
+
+                job_offset = self.offset
+                job_name = 'spool-{}'.format(job_offset)
+
+                with self.mutex:
+                    self.offset += len(line)
+
+                    # Blank line, or job confirmed before a restart
+                    if not line.strip() or job_offset in self.confirmed:
+                        self.saved = False
+                        continue
+
+                    self.pending[job_name] = job_offset
+
+                self.submit(Job(job_name, raw=line.strip(), channel=self.channel))
+
+    def _confirmed(self, job):
+        with self.mutex:
+            job_offset = self.pending.pop(job.name, None)
+            if job_offset is None:
+                return
+
+            self.confirmed.add(job_offset)
+            self.saved = False
+            if self.offset_fp is None:
+                return
+
+            try:
+                self.offset_fp.write(' {}'.format(job_offset))
+                self.offset_fp.flush()
+            except IOError as err:
+                self.logger.critical("Failed to save confirmed spool offset {} to {}: {}".format(
+                    job_offset, self.offset_path, str(err)))
+
+    def _save(self):
+        """Rewrite the offset file with the current low-water mark (self.mutex held)."""
+        # Low-water mark: first job not confirmed yet, or where reading stopped if every job read was confirmed
+        low_water = min(self.pending.values()) if self.pending else self.offset
+        self.confirmed = set(offset for offset in self.confirmed if offset >= low_water)
+
+        if self.offset_fp is not None:
+            self.offset_fp.close()
+            self.offset_fp = None
+
+        # Written next to the offset file then renamed over it: progress is never half written
+        tmp_path = self.offset_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as tmp_file:
+                tmp_file.write(' '.join(str(offset) for offset in [low_water] + sorted(self.confirmed)))
+            os.replace(tmp_path, self.offset_path)
+
+            # Next confirmed offsets are appended to the file now in place
+            self.offset_fp = open(self.offset_path, 'a')
+        except OSError as err:
+            self.logger.critical("Failed to save spool offset to {}: {}".format(self.offset_path, str(err)))
+        else:
+            self.saved = True
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def close(self):
+        self.channel.close()
+
+        with self.mutex:
+            if not self.saved:
+                self._save()
+
+            if self.offset_fp is not None:
+                self.offset_fp.close()